@@ -1,5 +1,8 @@
+import json
+from pathlib import Path
+from typing import Dict, List, Tuple, Union
+
 import pandas as pd
-import numpy as np
 import logging
 import yaml
 
@@ -8,11 +11,110 @@ with open("config/webapp.yaml", "r") as f:
 
 logger = logger = logging.getLogger("aggregate_data")
 
-def get_flight_number(df: pd.DataFrame, airline: str) -> list:
+ROUTE = ["airline", "origin", "destination"]
+DEPARTURE = ["airline", "origin", "destination", "departure_time"]
+CITY_DEPARTURE = ["origin", "destination", "departure_time"]
+
+
+class RouteIndex:
+    """Lookups of the web app, aggregated once from the clean data
+
+    Holds the flight numbers of each airline, the mean duration of each route and the most
+    frequent arrival time of each route and departure time, so every lookup is a dictionary
+    access instead of a scan of the clean data. The index can be saved as a small JSON
+    artifact, so the web app does not need the clean data at all.
+
+    Args:
+        flights (dict): Flight numbers of each airline, in order of appearance
+        durations (dict): Mean duration of each (airline, origin, destination)
+        mean_duration (float): Mean duration of all the flights
+        arrivals (dict): Most frequent arrival time of each (airline, origin, destination,
+                         departure_time)
+        city_arrivals (dict): Most frequent arrival time of each (origin, destination,
+                              departure_time), for airlines not flying a route
+    """
+
+    def __init__(self, flights: Dict[str, List[str]], durations: Dict[Tuple, float],
+                 mean_duration: float, arrivals: Dict[Tuple, str],
+                 city_arrivals: Dict[Tuple, str]):
+        self.flights = flights
+        self.durations = durations
+        self.mean_duration = mean_duration
+        self.arrivals = arrivals
+        self.city_arrivals = city_arrivals
+
+    @classmethod
+    def from_data(cls, df: pd.DataFrame) -> "RouteIndex":
+        """Aggregates the clean data in a single pass per lookup
+
+        Args:
+            df (pd.DataFrame): Clean data in pandas dataframe format
+
+        Returns:
+            RouteIndex: Index of the clean data
+        """
+        # Only the observed combinations of categorical columns are indexed
+        flights = {airline: list(flight_numbers) for airline, flight_numbers
+                   in df.groupby("airline", sort=False, observed=True)["flight"]
+                   .unique().items()}
+        duration = df["duration"].astype(float)
+        durations = duration.groupby([df[column] for column in ROUTE], sort=False,
+                                     observed=True).mean().to_dict()
+        index = cls(flights, durations, float(duration.mean()),
+                    most_frequent(df, DEPARTURE, "arrival_time"),
+                    most_frequent(df, CITY_DEPARTURE, "arrival_time"))
+        logger.info("Route index built from %s flights: %s routes, %s departures.", len(df),
+                    len(durations), len(index.arrivals))
+        return index
+
+    def save(self, path: Union[str, Path]) -> None:
+        """Writes the index to a JSON file"""
+        def records(lookup: dict, keys: List[str], value: str) -> List[dict]:
+            return [{**dict(zip(keys, key)), value: item} for key, item in lookup.items()]
+
+        index = {"flights": self.flights,
+                 "durations": records(self.durations, ROUTE, "duration"),
+                 "mean_duration": self.mean_duration,
+                 "arrivals": records(self.arrivals, DEPARTURE, "arrival_time"),
+                 "city_arrivals": records(self.city_arrivals, CITY_DEPARTURE, "arrival_time")}
+        Path(path).write_text(json.dumps(index), encoding="utf-8")
+
+    @classmethod
+    def from_json(cls, text: Union[str, bytes]) -> "RouteIndex":
+        """Reads an index written by save, e.g. the route statistics of a pipeline run"""
+        index = json.loads(text)
+
+        def lookup(records: List[dict], keys: List[str], value: str) -> dict:
+            return {tuple(record[key] for key in keys): record[value] for record in records}
+
+        return cls(index["flights"], lookup(index["durations"], ROUTE, "duration"),
+                   index["mean_duration"],
+                   lookup(index["arrivals"], DEPARTURE, "arrival_time"),
+                   lookup(index["city_arrivals"], CITY_DEPARTURE, "arrival_time"))
+
+    @classmethod
+    def load(cls, path: Union[str, Path]) -> "RouteIndex":
+        """Reads an index from a JSON file written by save"""
+        return cls.from_json(Path(path).read_text(encoding="utf-8"))
+
+
+def most_frequent(df: pd.DataFrame, keys: List[str], column: str) -> Dict[Tuple, str]:
+    """Finds the most frequent value of a column for each group, the first seen on ties"""
+    counts = df.groupby(keys + [column], sort=False, observed=True).size()
+    modes = counts.groupby(level=keys, sort=False, observed=True).idxmax()
+    return {key: mode[-1] for key, mode in modes.items()}
+
+
+def as_index(data: Union[pd.DataFrame, RouteIndex]) -> RouteIndex:
+    """Returns the index of the clean data, building it if given the data itself"""
+    return data if isinstance(data, RouteIndex) else RouteIndex.from_data(data)
+
+def get_flight_number(df: Union[pd.DataFrame, RouteIndex], airline: str) -> list:
     """Get all the possible flight number from the database, given the airline
 
     Args:
-        df (pd.DataFrame): Clean data in pandas dataframe format
+        df (pd.DataFrame or RouteIndex): Index of the clean data, or the clean data in
+                                         pandas dataframe format
         airline (str): The selected airline
 
     Returns:
@@ -23,17 +125,18 @@ def get_flight_number(df: pd.DataFrame, airline: str) -> list:
         logger.error("The selected airline is not in our dataset.")
         raise ValueError("The selected airline is not in our dataset.")
     
-    df = df[df["airline"] == airline]
-    lst = list(df["flight"].unique())
+    lst = list(as_index(df).flights.get(airline, []))
     logger.info("Successfully retrieved all possible flight number for %s airline", airline)
     
     return lst
 
-def get_avg_duration(df: pd.DataFrame, airline: str, origin: str, destination: str) -> float:
+def get_avg_duration(df: Union[pd.DataFrame, RouteIndex], airline: str, origin: str,
+                     destination: str) -> float:
     """Given airline, origin, and destination, find the average duration of the flight
 
     Args:
-        df (pd.DataFrame): Clean data in pandas dataframe format
+        df (pd.DataFrame or RouteIndex): Index of the clean data, or the clean data in
+                                         pandas dataframe format
         airline (str): The selected airline
         origin (str): The selected origin city
         destination (str): The selected destination city
@@ -54,27 +157,26 @@ def get_avg_duration(df: pd.DataFrame, airline: str, origin: str, destination: s
         logger.error("The selected destination is not in our dataset.")
         raise ValueError("The selected destination is not in our dataset.")
     
-    df_sliced = df[(df["airline"] == airline)
-                & (df["origin"] == origin)
-                & (df["destination"] == destination)]
-    
-    avg_duration = df_sliced["duration"].mean()
+    index = as_index(df)
+    avg_duration = index.durations.get((airline, origin, destination))
     
     # if no data, we use simple imputation method
-    if avg_duration is np.nan:
+    if avg_duration is None:
         logger.info("Get average duration of the entire data (no data from the specific inputs)")
-        return df["duration"].mean()
+        return index.mean_duration
 
     logger.info("Get average duration of the %s airline, %s origin, and %s destination",
                 airline, origin, destination)
     
     return avg_duration
 
-def get_arrival(df: pd.DataFrame, airline: str, origin: str, destination: str, depart: str) -> str:
+def get_arrival(df: Union[pd.DataFrame, RouteIndex], airline: str, origin: str,
+                destination: str, depart: str) -> str:
     """Given airline, origin, destination, and departure time, find the most likely arrival time (find mode)
 
     Args:
-        df (pd.DataFrame): Clean data in pandas dataframe format
+        df (pd.DataFrame or RouteIndex): Index of the clean data, or the clean data in
+                                         pandas dataframe format
         airline (str): The selected airline
         origin (str): The selected origin city
         destination (str): The selected destination city
@@ -100,17 +202,13 @@ def get_arrival(df: pd.DataFrame, airline: str, origin: str, destination: str, d
         logger.error("The selected departure time is not in our dataset.")
         raise ValueError("The selected departure time is not in our dataset.")
     
-    df_sliced = df[(df["airline"] == airline)
-                & (df["origin"] == origin)
-                & (df["destination"] == destination)
-                & (df["departure_time"] == depart)]
+    index = as_index(df)
+    arrival = index.arrivals.get((airline, origin, destination, depart))
 
     # if no data, we use simple imputation method
-    if df_sliced.empty:
-        df_sliced = df[(df["origin"] == origin)
-                    & (df["destination"] == destination)
-                    & (df["departure_time"] == depart)]
+    if arrival is None:
+        arrival = index.city_arrivals[(origin, destination, depart)]
     logger.info("Get most frequent arrival time of the %s airline, %s origin, %s destination, and %s departure time",
                 airline, origin, destination, depart)
     
-    return df_sliced["arrival_time"].value_counts().index[0]
+    return arrival
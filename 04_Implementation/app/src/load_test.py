@@ -0,0 +1,300 @@
+"""
+This module load tests the prediction API. Concurrent clients send a configurable mix of
+/predict and /predict/batch requests for every model, with records sampled from the clean
+data of a pipeline run, and the latency percentiles, throughput and error rate of each model
+are reported and checked against latency objectives.
+
+The API can be tested in-process through the Flask test client, or over HTTP on a running
+server:
+
+    python src/load_test.py --data clean_data.parquet --in-process
+    python src/load_test.py --data clean_data.parquet --url http://localhost:5000
+"""
+
+import argparse
+import itertools
+import json
+import logging
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+import yaml
+
+from s3_data import read_dataset
+
+
+logger = logging.getLogger("load_test")
+
+# Features sent to the API, as in the requests of the web app
+FEATURES = ["airline", "flight", "class", "departure_time", "origin", "duration", "stops",
+            "arrival_time", "destination"]
+
+READERS = {".csv": pd.read_csv, ".parquet": pd.read_parquet, ".feather": pd.read_feather}
+
+
+def load_records(data_path: Optional[str], bucket_name: str, prefix: str,
+                 data_format: str = "csv") -> pd.DataFrame:
+    """Loads the clean data of a pipeline run, from a local file or the S3 bucket
+
+    Args:
+        data_path (str): Local csv, parquet or feather file, or folder of parts. If None,
+                         the clean data is read from the bucket like the web app does.
+        bucket_name (str): S3 bucket of the pipeline artifacts
+        prefix (str): S3 key prefix of the pipeline run
+        data_format (str): File format of the artifact in S3 (csv, parquet or feather)
+
+    Returns:
+        pd.DataFrame: The features of the clean data
+    """
+    if data_path is not None:
+        path = Path(data_path)
+        # Folder of parts written by the pipeline in streaming mode
+        files = sorted(path.glob(f"part-*{path.suffix}")) if path.is_dir() else [path]
+        data = pd.concat([READERS[path.suffix](file) for file in files], ignore_index=True)
+    else:
+        import boto3  # pylint: disable=import-outside-toplevel
+        # Single object, or folder of parts when the pipeline ran in streaming mode
+        data = read_dataset(boto3.client("s3"), bucket_name,
+                            f"{prefix}/clean_data.{data_format}", data_format)
+    logger.info("Loaded %s records to sample requests from.", len(data))
+    return data[FEATURES]
+
+
+def plan_requests(records: pd.DataFrame, n_requests: int, mix: Dict[str, float],
+                  batch_fraction: float = 0.0, batch_size: int = 20,
+                  seed: int = 423) -> List[Tuple[str, str, dict]]:
+    """Draws the requests of a load test
+
+    The records of each request are sampled with replacement from the clean data, so the
+    requests follow the distribution of the flights the models were trained on.
+
+    Args:
+        records (pd.DataFrame): Records to sample from
+        n_requests (int): Number of requests
+        mix (dict): Relative weight of the requests for each model
+        batch_fraction (float): Share of the requests sent to /predict/batch
+        batch_size (int): Number of records of each batch request
+        seed (int): Seed of the random generator
+
+    Returns:
+        list: The model, endpoint and JSON body of each request
+    """
+    rng = np.random.default_rng(seed)
+    model_names = list(mix)
+    weights = np.array([mix[name] for name in model_names], dtype=float)
+    models = rng.choice(model_names, n_requests, p=weights / weights.sum())
+    is_batch = rng.random(n_requests) < batch_fraction
+
+    # Records as lists of plain Python values, ready for JSON
+    columns = {column: records[column].tolist() for column in records.columns}
+    plan = []
+    for model_name, batch in zip(models, is_batch):
+        rows = rng.integers(len(records), size=batch_size if batch else 1)
+        if batch:
+            body = {"Model": model_name,
+                    "Data": {column: [values[row] for row in rows]
+                             for column, values in columns.items()}}
+            plan.append((model_name, "/predict/batch", body))
+        else:
+            body = {"Model": model_name,
+                    "Data": {column: values[rows[0]] for column, values in columns.items()}}
+            plan.append((model_name, "/predict", body))
+    return plan
+
+
+def in_process_client() -> Callable[[], Callable]:
+    """Returns a factory of clients posting to the API through the Flask test client"""
+    import predict_api  # pylint: disable=import-outside-toplevel
+
+    def make_client() -> Callable:
+        client = predict_api.app.test_client()
+
+        def post(path: str, body: dict) -> Tuple[int, dict]:
+            response = client.post(path, json=body)
+            return response.status_code, response.get_json(silent=True)
+        return post
+
+    return make_client
+
+
+def http_client(url: str, timeout: float = 10.0) -> Callable[[], Callable]:
+    """Returns a factory of clients posting to the API of a running server"""
+    import requests  # pylint: disable=import-outside-toplevel
+
+    def make_client() -> Callable:
+        session = requests.Session()
+
+        def post(path: str, body: dict) -> Tuple[int, Optional[dict]]:
+            try:
+                response = session.post(f"{url.rstrip('/')}{path}", json=body, timeout=timeout)
+            except requests.exceptions.RequestException as error:
+                logger.debug("Request to %s failed: %s", path, error)
+                return 0, None
+            try:
+                return response.status_code, response.json()
+            except ValueError:
+                return response.status_code, None
+        return post
+
+    return make_client
+
+
+def run_load_test(make_client: Callable[[], Callable], plan: List[Tuple[str, str, dict]],
+                  concurrency: int = 8, warmup: int = 0) -> Tuple[pd.DataFrame, float]:
+    """Sends the planned requests from concurrent clients
+
+    Each client sends its next request as soon as the previous one returns (closed loop), so
+    the throughput is the one the API sustains at the given concurrency.
+
+    Args:
+        make_client (Callable): Factory of clients, one per thread
+        plan (list): Requests from plan_requests
+        concurrency (int): Number of concurrent clients
+        warmup (int): Number of requests sent first and left out of the results, e.g. to
+                      load lazily loaded models
+
+    Returns:
+        pd.DataFrame: Model, endpoint, status, latency in milliseconds and success of each
+                      request
+        float: Wall time of the test in seconds
+    """
+    warmup_client = make_client()
+    for _, path, body in plan[:warmup]:
+        warmup_client(path, body)
+    plan = plan[warmup:]
+
+    next_request = itertools.count()
+    lock = threading.Lock()
+    results: List[Optional[dict]] = [None] * len(plan)
+
+    def worker() -> None:
+        post = make_client()
+        while True:
+            with lock:
+                position = next(next_request)
+            if position >= len(plan):
+                return
+            model_name, path, body = plan[position]
+            start = time.perf_counter()
+            status, response = post(path, body)
+            latency = (time.perf_counter() - start) * 1000
+            key = "predictions" if path.endswith("batch") else "prediction"
+            results[position] = {"model": model_name, "endpoint": path, "status": status,
+                                 "latency_ms": latency,
+                                 "ok": status == 200 and response is not None
+                                       and key in response}
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        for future in [executor.submit(worker) for _ in range(concurrency)]:
+            future.result()
+    seconds = time.perf_counter() - start
+    logger.info("Sent %s requests with %s clients in %.2f seconds.", len(plan), concurrency,
+                seconds)
+    return pd.DataFrame(results), seconds
+
+
+def summarize(results: pd.DataFrame, seconds: float) -> pd.DataFrame:
+    """Computes the latency percentiles, throughput and error rate of each model and endpoint
+
+    Args:
+        results (pd.DataFrame): Requests from run_load_test
+        seconds (float): Wall time of the test
+
+    Returns:
+        pd.DataFrame: One row per model and endpoint, and one row for all the requests
+    """
+    def stats(group: pd.DataFrame) -> pd.Series:
+        latency = group["latency_ms"].to_numpy()
+        p50, p95, p99 = np.percentile(latency, [50, 95, 99])
+        return pd.Series({"requests": len(group), "errors": int((~group["ok"]).sum()),
+                          "error_rate": float((~group["ok"]).mean()),
+                          "throughput_rps": len(group) / seconds,
+                          "mean_ms": latency.mean(), "p50_ms": p50, "p95_ms": p95,
+                          "p99_ms": p99, "max_ms": latency.max()})
+
+    summary = results.groupby(["model", "endpoint"]).apply(stats).reset_index()
+    total = stats(results).to_frame().T.assign(model="all", endpoint="all")
+    summary = pd.concat([summary, total], ignore_index=True)
+    summary[["requests", "errors"]] = summary[["requests", "errors"]].astype(int)
+    return summary
+
+
+def check_slo(summary: pd.DataFrame, slo: dict) -> pd.DataFrame:
+    """Flags the models and endpoints missing the latency and error objectives
+
+    Args:
+        summary (pd.DataFrame): Summary from summarize
+        slo (dict): Optional maximum p50_ms, p95_ms, p99_ms and error_rate
+
+    Returns:
+        pd.DataFrame: The summary with a 'slo_met' column
+    """
+    met = pd.Series(True, index=summary.index)
+    for metric, limit in (slo or {}).items():
+        if limit is not None:
+            met &= summary[metric] <= limit
+    return summary.assign(slo_met=met)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(format="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
+                        level=logging.INFO)
+
+    parser = argparse.ArgumentParser(description="Load test of the prediction API")
+    parser.add_argument("--config", default="config/webapp.yaml",
+                        help="Path to configuration file")
+    parser.add_argument("--data", default=None,
+                        help="Local clean data file. Defaults to the clean data in S3")
+    parser.add_argument("--url", default=None, help="URL of a running server")
+    parser.add_argument("--in-process", action="store_true",
+                        help="Test the API in this process through the Flask test client")
+    parser.add_argument("--requests", type=int, default=None, help="Number of requests")
+    parser.add_argument("--concurrency", type=int, default=None,
+                        help="Number of concurrent clients")
+    parser.add_argument("--output", default=None, help="Path to save the report to (JSON)")
+    args = parser.parse_args()
+
+    with open(args.config, "r", encoding="utf-8") as f:
+        config = yaml.safe_load(f)
+    test_config = config.get("load_test", {})
+
+    records = load_records(args.data, os.getenv("BUCKET_NAME", config["aws"]["bucket_name"]),
+                           os.getenv("PREFIX", config["aws"]["prefix"]),
+                           os.getenv("DATA_FORMAT", config["aws"].get("data_format", "csv")))
+    n_requests = args.requests or test_config.get("requests", 1000)
+    warmup = test_config.get("warmup", 10)
+    plan = plan_requests(records, n_requests + warmup, test_config.get("mix", {
+                             "linear_regression": 1, "random_forest": 1, "xgboost": 1}),
+                         test_config.get("batch_fraction", 0.0),
+                         test_config.get("batch_size", 20), test_config.get("seed", 423))
+
+    if args.in_process:
+        client_factory = in_process_client()
+    else:
+        client_factory = http_client(args.url or test_config.get("url", "http://localhost:5000"),
+                                     test_config.get("timeout", 10.0))
+    results, seconds = run_load_test(client_factory, plan,
+                                     args.concurrency or test_config.get("concurrency", 8),
+                                     warmup)
+
+    summary = check_slo(summarize(results, seconds), test_config.get("slo", {}))
+    print(summary.to_string(index=False, float_format="{:.2f}".format))
+
+    if args.output:
+        report = {"requests": len(results), "seconds": seconds,
+                  "concurrency": args.concurrency or test_config.get("concurrency", 8),
+                  "summary": summary.to_dict("records")}
+        Path(args.output).write_text(json.dumps(report, indent=2), encoding="utf-8")
+        logger.info("Load test report saved to %s", args.output)
+
+    if not summary["slo_met"].all():
+        logger.error("Latency or error objectives not met.")
+        sys.exit(1)
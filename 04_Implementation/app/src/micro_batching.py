@@ -0,0 +1,186 @@
+"""
+This module provides a micro-batching scheduler for the prediction server. Concurrent
+single-record requests for the same model are queued for a few milliseconds and scored
+together with one vectorized call to the model, then each request gets its own result back.
+If the call fails, the records of the batch are scored one by one, so an invalid record only
+fails its own request.
+"""
+
+import logging
+import queue
+import threading
+import time
+from collections import Counter, deque
+from concurrent.futures import Future
+from typing import Callable, Dict, Optional
+
+import numpy as np
+import pandas as pd
+
+
+class MicroBatcher:
+    """Queues prediction requests per model and scores them in batches.
+
+    A batch is closed when it reaches max_batch_size rows or when its oldest request has
+    waited max_wait_ms, whichever comes first. Each model has its own queue and worker
+    thread, created on its first request. close() stops the workers once the queued
+    requests are scored.
+
+    Args:
+        predict_fn (Callable): Function taking a model name and a DataFrame of records and
+                               returning one prediction per record.
+        max_wait_ms (float): Maximum time a request waits for others to join its batch.
+        max_batch_size (int): Maximum number of records scored in one call.
+    """
+
+    def __init__(self, predict_fn: Callable[[str, pd.DataFrame], np.ndarray],
+                 max_wait_ms: float = 5.0, max_batch_size: int = 64):
+        self.predict_fn = predict_fn
+        self.max_wait = max_wait_ms / 1000
+        self.max_batch_size = max_batch_size
+
+        self._queues: Dict[str, queue.Queue] = {}
+        self._workers: Dict[str, threading.Thread] = {}
+        self._lock = threading.Lock()
+        self._closed = False
+
+        # Metrics
+        self._batch_sizes = Counter()
+        self._queue_delays = deque(maxlen=10000)
+        self._n_requests = 0
+
+    def submit(self, model_name: str, dataframe: pd.DataFrame) -> Future:
+        """Queues a single-record DataFrame for prediction with the given model.
+
+        Args:
+            model_name (str): Name of the model to use
+            dataframe (pd.DataFrame): DataFrame with one record
+
+        Returns:
+            Future: Resolves to the prediction for the record
+
+        Raises:
+            RuntimeError: If the batcher is closed
+        """
+        future = Future()
+        # Queued under the lock, so no request is queued after the stop signal of close()
+        with self._lock:
+            if self._closed:
+                raise RuntimeError("Micro-batcher is closed")
+            self._get_queue(model_name).put((time.perf_counter(), dataframe, future))
+        return future
+
+    def close(self, timeout: Optional[float] = None) -> None:
+        """Stops the workers after they score the requests already queued
+
+        Args:
+            timeout (float): Maximum time to wait for each worker, in seconds
+        """
+        with self._lock:
+            self._closed = True
+            for requests_queue in self._queues.values():
+                requests_queue.put(None)
+            workers = list(self._workers.values())
+        for worker in workers:
+            worker.join(timeout)
+        logging.debug("Micro-batcher closed.")
+
+    def _get_queue(self, model_name: str) -> queue.Queue:
+        """Returns the queue of a model, starting its worker thread on first use. Must be
+        called with the lock held."""
+        if model_name not in self._queues:
+            self._queues[model_name] = queue.Queue()
+            self._workers[model_name] = threading.Thread(
+                target=self._run, args=(model_name,), name=f"micro-batcher-{model_name}",
+                daemon=True)
+            self._workers[model_name].start()
+            logging.debug("Micro-batching worker started for model %s.", model_name)
+        return self._queues[model_name]
+
+    def _run(self, model_name: str) -> None:
+        """Worker loop: collects a batch, scores it and fans the results out. A None item
+        is the stop signal of close()."""
+        requests_queue = self._queues[model_name]
+        stopped = False
+        while not stopped:
+            # Block until a request arrives, then wait up to max_wait for more. Requests
+            # already queued join the batch even after the deadline.
+            item = requests_queue.get()
+            if item is None:
+                break
+            batch = [item]
+            deadline = batch[0][0] + self.max_wait
+            while len(batch) < self.max_batch_size:
+                timeout = deadline - time.perf_counter()
+                try:
+                    if timeout > 0:
+                        item = requests_queue.get(timeout=timeout)
+                    else:
+                        item = requests_queue.get_nowait()
+                except queue.Empty:
+                    break
+                if item is None:
+                    stopped = True
+                    break
+                batch.append(item)
+
+            self._score(model_name, batch)
+
+    def _score(self, model_name: str, batch: list) -> None:
+        """Scores a batch with one call to the model and resolves its futures"""
+        start = time.perf_counter()
+        with self._lock:
+            self._batch_sizes[len(batch)] += 1
+            self._n_requests += len(batch)
+            self._queue_delays.extend(start - queued_at for queued_at, _, _ in batch)
+
+        try:
+            dataframe = pd.concat([records for _, records, _ in batch], ignore_index=True)
+            predictions = self.predict_fn(model_name, dataframe)
+        except Exception as error:  # pylint: disable=broad-except
+            if len(batch) == 1:
+                logging.exception("Error occurred during batch prediction!")
+                batch[0][2].set_exception(error)
+            else:
+                logging.warning("Batch prediction of %s records failed. Scoring them one by "
+                                "one.", len(batch), exc_info=True)
+                self._score_each(model_name, batch)
+            return
+
+        for (_, _, future), prediction in zip(batch, predictions):
+            future.set_result(prediction)
+        logging.debug("Batch of %s records scored with model %s in %.2f ms.", len(batch),
+                      model_name, (time.perf_counter() - start) * 1000)
+
+    def _score_each(self, model_name: str, batch: list) -> None:
+        """Scores the records of a failed batch alone, so only the invalid ones fail"""
+        for _, records, future in batch:
+            try:
+                future.set_result(self.predict_fn(model_name, records)[0])
+            except Exception as error:  # pylint: disable=broad-except
+                future.set_exception(error)
+
+    def metrics(self) -> dict:
+        """Returns batch size and queueing delay metrics
+
+        Returns:
+            dict: Number of requests and batches, batch size histogram and queueing delay
+                  percentiles in milliseconds over the most recent requests
+        """
+        with self._lock:
+            batch_sizes = dict(sorted(self._batch_sizes.items()))
+            delays = np.array(self._queue_delays) * 1000
+            n_requests = self._n_requests
+
+        n_batches = sum(batch_sizes.values())
+        return {
+            "requests": n_requests,
+            "batches": n_batches,
+            "mean_batch_size": n_requests / n_batches if n_batches else 0.0,
+            "batch_sizes": batch_sizes,
+            "queue_delay_ms": {
+                "p50": float(np.percentile(delays, 50)) if delays.size else 0.0,
+                "p95": float(np.percentile(delays, 95)) if delays.size else 0.0,
+                "max": float(delays.max()) if delays.size else 0.0,
+            },
+        }
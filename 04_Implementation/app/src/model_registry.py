@@ -0,0 +1,236 @@
+"""
+This module provides a registry of the trained models served by the prediction API. Models
+are loaded from S3 in parallel or lazily on first use, downloaded files are kept in a local
+cache checked against the S3 ETag, and the models of a new pipeline run can be swapped in
+without restarting the server. The prefix, models and versions are swapped together, so a
+model is always read with its own version.
+"""
+
+import logging
+import os
+import threading
+from io import BytesIO
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import joblib
+from botocore.exceptions import BotoCoreError, ClientError, NoCredentialsError
+from joblib import numpy_pickle
+
+
+class ReloadError(Exception):
+    """Raised when the models of a run cannot be reloaded. The current models are kept."""
+
+
+class ModelRegistry:
+    """Loads and holds the trained models of one pipeline run.
+
+    Args:
+        s3_client: S3 client used to download the models
+        bucket_name (str): S3 bucket with the models
+        prefix (str): S3 key prefix of the run, e.g. "experiments/"
+        model_names (List[str]): Names of the models; each one is stored as <prefix><name>.pkl
+        cache_dir (str): Local directory for downloaded models. None disables the cache.
+        max_workers (int): Number of models loaded at the same time
+        mmap_mode (str): Optional joblib mmap_mode (e.g. "r") to memory-map the arrays of
+                         cached models saved as uncompressed joblib files
+        allowed_prefixes (List[str]): Prefixes a reload may load models from. A reload
+                                      prefix must start with one of them. Defaults to the
+                                      initial prefix.
+    """
+
+    def __init__(self, s3_client: Any, bucket_name: str, prefix: str, model_names: List[str],
+                 cache_dir: Optional[str] = None, max_workers: int = 4,
+                 mmap_mode: Optional[str] = None,
+                 allowed_prefixes: Optional[List[str]] = None):
+        self.s3_client = s3_client
+        self.bucket_name = bucket_name
+        self.model_names = list(model_names)
+        self.cache_dir = Path(cache_dir) if cache_dir else None
+        self.max_workers = max_workers
+        self.mmap_mode = mmap_mode
+        self.allowed_prefixes = list(allowed_prefixes) if allowed_prefixes else [prefix]
+
+        # Prefix and (model, version) of each model, replaced as a whole on every change so
+        # readers always see a consistent snapshot
+        self._state: Tuple[str, Dict[str, Tuple[Any, str]]] = (prefix, {})
+        self._lock = threading.Lock()
+        self._model_locks = {name: threading.Lock() for name in self.model_names}
+        self._reload_callbacks: List[Callable[[], None]] = []
+
+        if self.cache_dir is not None:
+            self.cache_dir.mkdir(parents=True, exist_ok=True)
+
+    @property
+    def prefix(self) -> str:
+        """S3 key prefix of the run the models are loaded from"""
+        return self._state[0]
+
+    def get(self, model_name: str) -> Any:
+        """Returns a model, loading it on first use
+
+        Args:
+            model_name (str): Name of the model
+
+        Returns:
+            The trained model
+
+        Raises:
+            KeyError: If the model is unknown or could not be loaded
+        """
+        return self.get_with_version(model_name)[0]
+
+    def get_with_version(self, model_name: str) -> Tuple[Any, str]:
+        """Returns a model and the ETag it was loaded from, loading it on first use. Both
+        come from the same snapshot, so a reload cannot pair a model with another version.
+
+        Args:
+            model_name (str): Name of the model
+
+        Returns:
+            Tuple: The trained model and its version
+
+        Raises:
+            KeyError: If the model is unknown or could not be loaded
+        """
+        entry = self._state[1].get(model_name)
+        if entry is not None:
+            return entry
+        if model_name not in self._model_locks:
+            raise KeyError(model_name)
+
+        # Only one thread loads a given model
+        with self._model_locks[model_name]:
+            prefix, entries = self._state
+            if model_name in entries:
+                return entries[model_name]
+            loaded = self._fetch(prefix, model_name)
+            if loaded is None:
+                raise KeyError(model_name)
+            with self._lock:
+                # Don't overwrite the models of a reload that finished meanwhile
+                if prefix == self._state[0]:
+                    self._state = (prefix, {**self._state[1], model_name: loaded})
+            return loaded
+
+    def version(self, model_name: str) -> Optional[str]:
+        """Returns the ETag of the S3 object a model was loaded from"""
+        entry = self._state[1].get(model_name)
+        return entry[1] if entry is not None else None
+
+    def versions(self) -> Dict[str, str]:
+        """Returns the ETag of every loaded model"""
+        return {name: version for name, (_, version) in self._state[1].items()}
+
+    def snapshot(self) -> Tuple[str, Dict[str, str]]:
+        """Returns the prefix and the ETag of every loaded model, from the same state"""
+        prefix, entries = self._state
+        return prefix, {name: version for name, (_, version) in entries.items()}
+
+    def on_reload(self, callback: Callable[[], None]) -> None:
+        """Registers a function called after the models are reloaded"""
+        self._reload_callbacks.append(callback)
+
+    def load_all(self) -> None:
+        """Loads all the models in parallel. Models that fail to load are loaded again on
+        their first request."""
+        prefix = self.prefix
+        loaded = self._fetch_all(prefix)
+        with self._lock:
+            if prefix == self._state[0]:
+                self._state = (prefix, {**self._state[1], **loaded})
+
+    def allows(self, prefix: str) -> bool:
+        """Whether models may be loaded from a prefix"""
+        if ".." in prefix.split("/"):
+            return False
+        return prefix == self.prefix or \
+            any(prefix.startswith(allowed) for allowed in self.allowed_prefixes)
+
+    def reload(self, prefix: Optional[str] = None) -> Dict[str, str]:
+        """Loads the models of a run and swaps them in once all of them are loaded
+
+        Requests keep using the current models while the new ones load. If any model fails
+        to load, nothing is swapped: the prefix and all the models stay those of the current
+        run.
+
+        Args:
+            prefix (str): S3 key prefix of the run to load. Defaults to the current prefix.
+
+        Returns:
+            Dict[str, str]: The ETag of every loaded model after the reload
+
+        Raises:
+            ReloadError: If the prefix is not allowed or a model could not be loaded
+        """
+        prefix = prefix if prefix is not None else self.prefix
+        if not self.allows(prefix):
+            raise ReloadError(f"Prefix {prefix} is not one of the allowed prefixes")
+        loaded = self._fetch_all(prefix)
+        failed = [name for name in self.model_names if name not in loaded]
+        if failed:
+            raise ReloadError(f"Models {failed} could not be loaded from {prefix}")
+
+        with self._lock:
+            self._state = (prefix, loaded)
+        logging.info("Models reloaded from %s: %s", prefix,
+                     {name: version for name, (_, version) in loaded.items()})
+
+        for callback in self._reload_callbacks:
+            callback()
+        return self.versions()
+
+    def _fetch_all(self, prefix: str) -> Dict[str, Tuple[Any, str]]:
+        """Loads all the models of a run in parallel
+
+        Returns:
+            Dict: The model and ETag of each model that could be loaded
+        """
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            loaded = dict(zip(self.model_names,
+                              executor.map(lambda name: self._fetch(prefix, name),
+                                           self.model_names)))
+        return {name: result for name, result in loaded.items() if result is not None}
+
+    def _fetch(self, prefix: str, model_name: str) -> Optional[Tuple[Any, str]]:
+        """Loads a model, from the local cache if its ETag matches the S3 object
+
+        Returns:
+            The model and its ETag, or None if it could not be loaded
+        """
+        key = f"{prefix}{model_name}.pkl"
+        try:
+            if self.cache_dir is None:
+                response = self.s3_client.get_object(Bucket=self.bucket_name, Key=key)
+                model = joblib.load(BytesIO(response["Body"].read()))
+                etag = response["ETag"]
+            else:
+                etag = self.s3_client.head_object(Bucket=self.bucket_name, Key=key)["ETag"]
+                cache_path = self.cache_dir / f"{model_name}-{etag.strip(chr(34))}.pkl"
+                if cache_path.exists():
+                    logging.debug("Model %s found in local cache %s.", model_name, cache_path)
+                else:
+                    self._download(key, model_name, cache_path)
+                model = joblib.load(cache_path, mmap_mode=self.mmap_mode)
+        except (BotoCoreError, ClientError, NoCredentialsError):
+            logging.exception("Error occurred during getting model %s from S3!", model_name)
+            return None
+        except numpy_pickle.NumpyPicklingError:
+            logging.exception("Error occurred during loading the model %s!", model_name)
+            return None
+
+        logging.debug("Model %s loaded successfully (ETag %s).", model_name, etag)
+        return model, etag
+
+    def _download(self, key: str, model_name: str, cache_path: Path) -> None:
+        """Downloads a model to the local cache, replacing the file only once complete"""
+        tmp_path = cache_path.with_suffix(f".{threading.get_ident()}.tmp")
+        self.s3_client.download_file(self.bucket_name, key, str(tmp_path))
+        os.replace(tmp_path, cache_path)
+
+        # Older versions of the same model are no longer needed
+        for old_path in self.cache_dir.glob(f"{model_name}-*.pkl"):
+            if old_path != cache_path:
+                old_path.unlink(missing_ok=True)
+        logging.debug("Model downloaded from S3 to %s.", cache_path)
@@ -2,19 +2,28 @@
 This module provides an API endpoint for making predictions using a trained model.
 """
 
+import atexit
+import hmac
 import logging
-from io import BytesIO
+import os
+from concurrent.futures import TimeoutError as FutureTimeoutError
 
 import pandas as pd
 import numpy as np
-import joblib
 import boto3
 from flask import Flask, request, jsonify
 
-from botocore.exceptions import BotoCoreError, NoCredentialsError
 from sklearn.exceptions import NotFittedError
-from joblib import numpy_pickle
+from sklearn.pipeline import Pipeline
+from sklearn.preprocessing import MaxAbsScaler, MinMaxScaler, RobustScaler, StandardScaler
 
+from micro_batching import MicroBatcher
+from model_registry import ModelRegistry, ReloadError
+from prediction_cache import PredictionCache, canonicalize
+
+
+# Transformers of numerical features, whose values must be numbers
+NUMERIC_TRANSFORMERS = (StandardScaler, MinMaxScaler, MaxAbsScaler, RobustScaler)
 
 # Create a Flask app instance
 app = Flask(__name__)
@@ -29,33 +38,82 @@ logging.basicConfig(
 
 # Set up AWS S3 client
 s3 = boto3.client("s3")
-BUCKET_NAME = "msia423-g7"  # replace with your bucket name
-PREFIX = "experiments/"  # replace with your prefix
+BUCKET_NAME = os.getenv("BUCKET_NAME", "msia423-g7")  # replace with your bucket name
+PREFIX = os.getenv("PREFIX", "experiments/")  # replace with your prefix
+
+# Cache of predictions by model, model version and record
+PREDICTION_CACHE = PredictionCache(
+    max_size=int(os.getenv("PREDICTION_CACHE_SIZE", "10000")),
+    ttl_seconds=float(os.getenv("PREDICTION_CACHE_TTL", "3600")),
+)
+
+# Opt-in micro-batching of concurrent /predict requests
+MICRO_BATCHING = os.getenv("MICRO_BATCHING", "false").lower() == "true"
+BATCH_MAX_WAIT_MS = float(os.getenv("BATCH_MAX_WAIT_MS", "5"))
+BATCH_MAX_SIZE = int(os.getenv("BATCH_MAX_SIZE", "64"))
+BATCH_TIMEOUT_S = float(os.getenv("BATCH_TIMEOUT_S", "10"))
 
-MODELS = {}  # Dictionary to hold all models
+# Registry holding all models, cached locally and loaded lazily if requested
+MODEL_CACHE_DIR = os.getenv("MODEL_CACHE_DIR", "model_cache") or None
+LAZY_LOADING = os.getenv("LAZY_LOADING", "false").lower() == "true"
+MODEL_MMAP_MODE = os.getenv("MODEL_MMAP_MODE") or None
+# Reloads are disabled unless a token is set, and only load runs under the allowed prefixes
+RELOAD_TOKEN = os.getenv("RELOAD_TOKEN") or None
+ALLOWED_PREFIXES = [prefix.strip() for prefix in os.getenv("ALLOWED_PREFIXES", PREFIX).split(",")
+                    if prefix.strip()]
+MODELS = ModelRegistry(s3, BUCKET_NAME, PREFIX,
+                       ["linear_regression", "random_forest", "xgboost"],
+                       cache_dir=MODEL_CACHE_DIR, mmap_mode=MODEL_MMAP_MODE,
+                       allowed_prefixes=ALLOWED_PREFIXES)
+
+# Predictions of the previous models are no longer valid after a reload
+MODELS.on_reload(PREDICTION_CACHE.clear)
 
 
 def load_models():
-    """Loads all models into memory when Flask app starts"""
-    models_list = ["linear_regression", "random_forest", "xgboost"]
+    """Loads all models into memory in parallel when Flask app starts"""
+    MODELS.load_all()
 
-    for model_name in models_list:
-        try:
-            response = s3.get_object(
-                Bucket=BUCKET_NAME, Key=f"{PREFIX}{model_name}.pkl"
-            )
-            try:
-                model = joblib.load(BytesIO(response["Body"].read()))
-                MODELS[model_name] = model  # Add the model to the MODELS dictionary
-                logging.debug("Model %s loaded successfully.", model_name)
-            except numpy_pickle.NumpyPicklingError as pickle_error:
-                logging.exception("Error occurred during loading the model!")
-        except (BotoCoreError, NoCredentialsError) as s3_error:
-            logging.exception("Error occurred during getting model from S3!")
+
+# Call the function to load models, unless they are loaded on first use
+if not LAZY_LOADING:
+    load_models()
 
 
-# Call the function to load models
-load_models()
+def predict_records(model_name: str, dataframe: pd.DataFrame) -> np.ndarray:
+    """Scores a DataFrame of records with one call to the preprocessor and the model
+
+    Args:
+        model_name (str): Name of the model in memory
+        dataframe (pd.DataFrame): Records to score
+
+    Returns:
+        np.ndarray: Predictions on the log scale
+    """
+    model = MODELS.get(model_name)
+    processed_data = model.named_steps["preprocessor"].transform(dataframe)
+    return model.named_steps["model"].predict(processed_data)
+
+
+def predict_records_versioned(model_name: str, dataframe: pd.DataFrame) -> list:
+    """Scores a DataFrame of records like predict_records, with the version of the model
+
+    Returns:
+        list: The prediction on the log scale and the model version of each record
+    """
+    model, version = MODELS.get_with_version(model_name)
+    processed_data = model.named_steps["preprocessor"].transform(dataframe)
+    return [(prediction, version)
+            for prediction in model.named_steps["model"].predict(processed_data)]
+
+
+MICRO_BATCHER = (
+    MicroBatcher(predict_records_versioned, max_wait_ms=BATCH_MAX_WAIT_MS,
+                 max_batch_size=BATCH_MAX_SIZE)
+    if MICRO_BATCHING else None
+)
+if MICRO_BATCHER is not None:
+    atexit.register(MICRO_BATCHER.close, timeout=BATCH_TIMEOUT_S)
 
 
 @app.route("/predict", methods=["POST"])
@@ -76,39 +134,63 @@ def predict():
     model_name = data["Model"]
     logging.debug("Model name: %s", model_name)
 
-    # Retrieve the model from memory
+    # Retrieve the model and its version from memory, from the same registry snapshot
     try:
-        model = MODELS[model_name]
+        model, model_version = MODELS.get_with_version(model_name)
         preprocessor = model.named_steps["preprocessor"]
         estimator = model.named_steps["model"]
         logging.debug("Model and preprocessor retrieved from memory successfully.")
     except KeyError:
         return jsonify({"error": f"Model {model_name} not found in memory"}), 400
 
-    # Convert JSON data into a pandas DataFrame
-    dataframe = pd.DataFrame(data["Data"], index=[0])
-    logging.debug("Converted JSON data to DataFrame.")
-
-    # Apply preprocessor to input data
-    processed_data = preprocessor.transform(dataframe)
-    logging.debug("Preprocessing applied successfully.")
+    # Look up the prediction in the cache
+    record_key = canonicalize(data["Data"], preprocessor.feature_names_in_)
+    cache_key = (model_name, model_version, record_key)
+    cached = PREDICTION_CACHE.get(cache_key)
+    if cached is not None:
+        logging.debug("Prediction retrieved from cache.")
+        return jsonify({"prediction": float(np.exp(cached))})
 
     try:
-        # Make a prediction using the trained model
-        prediction = estimator.predict(processed_data)
+        # Convert JSON data into a pandas DataFrame
+        dataframe = pd.DataFrame(data["Data"], index=[0])
+        logging.debug("Converted JSON data to DataFrame.")
+
+        if MICRO_BATCHER is not None:
+            # Score together with the concurrent requests for the same model, and cache the
+            # prediction under the version of the model that made it
+            prediction, model_version = MICRO_BATCHER.submit(model_name, dataframe) \
+                .result(timeout=BATCH_TIMEOUT_S)
+            prediction = [prediction]
+            cache_key = (model_name, model_version, record_key)
+        else:
+            # Apply preprocessor to input data
+            processed_data = preprocessor.transform(dataframe)
+            logging.debug("Preprocessing applied successfully.")
+
+            # Make a prediction using the trained model
+            prediction = estimator.predict(processed_data)
         logging.debug("Prediction made successfully.")
+    except FutureTimeoutError:
+        logging.error("Prediction not made within %s seconds.", BATCH_TIMEOUT_S)
+        return jsonify({"error": "Prediction timed out"}), 504
     except NotFittedError as prediction_error:
         logging.exception("Error occurred during prediction!")
         return (
             jsonify({"error": f"Error during prediction: {str(prediction_error)}"}),
             500,
         )
+    except (ValueError, TypeError) as invalid_record:
+        # Invalid values for the features of the model, e.g. a non-numeric duration
+        logging.debug("Invalid record: %s", invalid_record)
+        return jsonify({"error": f"Invalid data: {str(invalid_record)}"}), 400
+    PREDICTION_CACHE.put(cache_key, float(prediction[0]))
 
     # Create a response containing the prediction
     try:
         response = {
             "prediction": float(
-                np.exp(prediction[0])
+                np.exp(float(prediction[0]))
             )  # Revert the log transformation and convert to float
         }
         return jsonify(response)
@@ -117,6 +199,181 @@ def predict():
         return jsonify({"error": f"Error during response creation: {str(error)}"}), 500
 
 
+def numeric_columns(preprocessor) -> list:
+    """Lists the columns of the preprocessor transformed by a scaler of numerical features
+
+    Args:
+        preprocessor (sklearn ColumnTransformer): Fitted preprocessor of the model
+
+    Returns:
+        list: Names of the numerical columns
+    """
+    columns = []
+    for _, transformer, transformer_columns in preprocessor.transformers_:
+        # The scaler may be the last step of a pipeline, e.g. after an imputer
+        if isinstance(transformer, Pipeline):
+            transformer = transformer.steps[-1][1]
+        if isinstance(transformer, NUMERIC_TRANSFORMERS):
+            columns += list(transformer_columns)
+    return columns
+
+
+def validate_batch(dataframe: pd.DataFrame, preprocessor) -> dict:
+    """Validates the rows of a batch against the features the preprocessor was fit on
+
+    Args:
+        dataframe (pd.DataFrame): Batch of records, with the expected columns
+        preprocessor (sklearn ColumnTransformer): Fitted preprocessor of the model
+
+    Returns:
+        dict: Error message for each invalid row, keyed by its position in the batch
+    """
+    errors = {}
+
+    # Missing values, including features absent from a record
+    missing = dataframe.isna()
+    for column in dataframe.columns[missing.any()]:
+        for position in np.flatnonzero(missing[column]):
+            errors.setdefault(int(position), []).append(f"missing value for {column}")
+
+    # Non-numeric values for the numerical features
+    for column in numeric_columns(preprocessor):
+        numeric = pd.to_numeric(dataframe[column], errors="coerce")
+        for position in np.flatnonzero(numeric.isna() & ~missing[column]):
+            errors.setdefault(int(position), []).append(f"non-numeric value for {column}")
+        dataframe[column] = numeric
+
+    return {position: "; ".join(messages) for position, messages in errors.items()}
+
+
+@app.route("/predict/batch", methods=["POST"])
+def predict_batch():
+    """Endpoint for making predictions for a batch of records using a trained model.
+
+    The 'Data' key holds either a list of records or a columnar payload (a dictionary of
+    lists). Invalid records are reported in 'errors' and get a null prediction, without
+    failing the rest of the batch.
+    """
+    # Retrieve JSON data from the request
+    data = request.get_json()
+    logging.debug("Received batch JSON data for model %s", data.get("Model"))
+
+    # Verify that 'Data' and 'Model' keys are present in the request data
+    if "Data" not in data or "Model" not in data:
+        return (
+            jsonify({"error": "Data and Model keys are required in the request body"}),
+            400,
+        )
+
+    # Retrieve the model from memory
+    model_name = data["Model"]
+    try:
+        model, model_version = MODELS.get_with_version(model_name)
+        preprocessor = model.named_steps["preprocessor"]
+        estimator = model.named_steps["model"]
+    except KeyError:
+        return jsonify({"error": f"Model {model_name} not found in memory"}), 400
+
+    # Convert records or columnar JSON data into a pandas DataFrame
+    try:
+        dataframe = pd.DataFrame(data["Data"])
+    except (ValueError, TypeError) as error:
+        return jsonify({"error": f"Invalid batch data: {str(error)}"}), 400
+    dataframe = dataframe.reindex(columns=preprocessor.feature_names_in_)
+    logging.debug("Converted batch of %s records to DataFrame.", len(dataframe))
+
+    # Validate rows and predict the valid ones at once
+    errors = validate_batch(dataframe, preprocessor)
+    valid = np.ones(len(dataframe), dtype=bool)
+    valid[list(errors)] = False
+
+    # Look up the valid records in the cache
+    predictions = np.full(len(dataframe), np.nan)
+    cache_keys = {}
+    for position, record in zip(np.flatnonzero(valid), dataframe[valid].to_dict("records")):
+        cache_keys[position] = (model_name, model_version,
+                                canonicalize(record, preprocessor.feature_names_in_))
+        cached = PREDICTION_CACHE.get(cache_keys[position])
+        if cached is not None:
+            predictions[position] = cached
+    missing = valid & np.isnan(predictions)
+
+    # Predict the records not in the cache at once
+    if missing.any():
+        processed_data = preprocessor.transform(dataframe[missing])
+        try:
+            predictions[missing] = estimator.predict(processed_data)
+        except NotFittedError as prediction_error:
+            logging.exception("Error occurred during prediction!")
+            return (
+                jsonify({"error": f"Error during prediction: {str(prediction_error)}"}),
+                500,
+            )
+        for position in np.flatnonzero(missing):
+            PREDICTION_CACHE.put(cache_keys[position], float(predictions[position]))
+    logging.debug("Batch prediction made for %s of %s records (%s from cache).", valid.sum(),
+                  len(dataframe), valid.sum() - missing.sum())
+
+    # Revert the log transformation, with null for the invalid records
+    response = {
+        "predictions": [float(price) if is_valid else None
+                        for price, is_valid in zip(np.exp(predictions), valid)],
+        "errors": [{"index": position, "error": message}
+                   for position, message in sorted(errors.items())],
+    }
+    return jsonify(response)
+
+
+@app.route("/metrics/batching", methods=["GET"])
+def batching_metrics():
+    """Endpoint for the batch size and queueing delay metrics of micro-batching"""
+    if MICRO_BATCHER is None:
+        return jsonify({"error": "Micro-batching is not enabled"}), 404
+    return jsonify(MICRO_BATCHER.metrics())
+
+
+@app.route("/metrics/cache", methods=["GET"])
+def cache_metrics():
+    """Endpoint for the size, hits and misses of the prediction cache"""
+    return jsonify(PREDICTION_CACHE.stats())
+
+
+@app.route("/models", methods=["GET"])
+def models():
+    """Endpoint listing the loaded models, their S3 prefix and versions (ETags)"""
+    prefix, versions = MODELS.snapshot()
+    return jsonify({"prefix": prefix, "versions": versions})
+
+
+@app.route("/models/reload", methods=["POST"])
+def reload_models():
+    """Endpoint for loading the models of a new run without restarting the server.
+
+    The request must carry the RELOAD_TOKEN in an 'Authorization: Bearer <token>' header;
+    the endpoint is disabled if no token is set. The optional 'Prefix' key of the request
+    body sets the S3 prefix of the run to load, which must start with one of the
+    ALLOWED_PREFIXES; by default the models of the current prefix are reloaded. If any model
+    fails to load, the current models are kept.
+    """
+    if RELOAD_TOKEN is None:
+        return jsonify({"error": "Model reload is disabled"}), 403
+    token = request.headers.get("Authorization", "").removeprefix("Bearer ").strip()
+    if not hmac.compare_digest(token.encode(), RELOAD_TOKEN.encode()):
+        return jsonify({"error": "Invalid reload token"}), 401
+
+    data = request.get_json(silent=True) or {}
+    prefix = data.get("Prefix")
+    if prefix is not None and not (isinstance(prefix, str) and MODELS.allows(prefix)):
+        return jsonify({"error": f"Prefix {prefix} is not allowed"}), 400
+    try:
+        MODELS.reload(prefix)
+    except ReloadError as error:
+        logging.exception("Error occurred during model reload!")
+        return jsonify({"error": str(error)}), 502
+    prefix, versions = MODELS.snapshot()
+    return jsonify({"prefix": prefix, "versions": versions})
+
+
 # Run the Flask app
 if __name__ == "__main__":
     app.run(host="0.0.0.0", port=5000, debug=False)
@@ -0,0 +1,96 @@
+"""
+This module provides an in-process cache of predictions. The inputs the web app sends are
+few and repetitive, so predictions are cached by model name, model version and the
+canonicalized record, with a bound on the number of entries and a time to live.
+"""
+
+import threading
+import time
+from collections import OrderedDict
+from numbers import Number
+from typing import Any, Hashable, Iterable, Optional, Tuple
+
+
+def canonicalize(record: dict, feature_names: Iterable[str]) -> Tuple:
+    """Builds a hashable key for a record, in the order of the model features
+
+    Numbers are converted to float, so 1 and 1.0 give the same key. Strings are kept as
+    they are, as the encoders treat any other spelling as a different category.
+
+    Args:
+        record (dict): Feature values of the record
+        feature_names (Iterable[str]): Features the model was fit on
+
+    Returns:
+        Tuple: The canonical form of the record
+    """
+    values = []
+    for name in feature_names:
+        value = record.get(name)
+        if isinstance(value, Number) and not isinstance(value, bool):
+            value = float(value)
+        values.append(value)
+    return tuple(values)
+
+
+class PredictionCache:
+    """Thread-safe LRU cache with a time to live for each entry.
+
+    Args:
+        max_size (int): Maximum number of entries. The least recently used entry is evicted
+                        when the cache is full. 0 disables the cache.
+        ttl_seconds (float): Time after which an entry expires.
+    """
+
+    def __init__(self, max_size: int = 10000, ttl_seconds: float = 3600):
+        self.max_size = max_size
+        self.ttl_seconds = ttl_seconds
+        self._entries: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        """Returns the cached value for a key, or None if it is missing or expired"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or time.monotonic() - entry[1] > self.ttl_seconds:
+                if entry is not None:
+                    del self._entries[key]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, key: Hashable, value: Any) -> None:
+        """Stores a value, evicting the least recently used entries beyond max_size"""
+        if self.max_size <= 0:
+            return
+        with self._lock:
+            self._entries[key] = (value, time.monotonic())
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def clear(self) -> None:
+        """Removes all the entries"""
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> dict:
+        """Returns the number of entries, hits, misses and hit rate
+
+        Returns:
+            dict: Cache statistics
+        """
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self._entries),
+                "max_size": self.max_size,
+                "ttl_seconds": self.ttl_seconds,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+            }
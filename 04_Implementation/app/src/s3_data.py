@@ -0,0 +1,64 @@
+"""
+This module reads the data artifacts of a pipeline run from S3. Data sets written in one go
+are a single object, e.g. "clean_data.parquet"; data sets written in streaming mode as
+parquet or feather are a folder of parts, e.g. "clean_data.parquet/part-00000.parquet",
+which are read in order and concatenated.
+"""
+
+import logging
+from io import BytesIO
+from typing import List
+
+import pandas as pd
+
+logger = logging.getLogger("s3_data")
+
+READERS = {"csv": pd.read_csv, "parquet": pd.read_parquet, "feather": pd.read_feather}
+
+
+def list_parts(s3_client, bucket_name: str, key: str) -> List[str]:
+    """Lists the objects of a data set: the object at the key, or the parts under it
+
+    Args:
+        s3_client: boto3 S3 client
+        bucket_name (str): S3 bucket of the artifacts
+        key (str): S3 key of the data set, e.g. "runs/1/clean_data.parquet"
+
+    Returns:
+        list[str]: S3 keys of the data set, in order. Empty if the data set does not exist.
+    """
+    keys = []
+    for page in s3_client.get_paginator("list_objects_v2").paginate(Bucket=bucket_name,
+                                                                    Prefix=key):
+        keys.extend(obj["Key"] for obj in page.get("Contents", []))
+    if key in keys:
+        return [key]
+    return sorted(part for part in keys if part.startswith(f"{key}/"))
+
+
+def read_dataset(s3_client, bucket_name: str, key: str,
+                 data_format: str = "csv") -> pd.DataFrame:
+    """Reads a data set written by the pipeline, as a single object or as parts
+
+    Args:
+        s3_client: boto3 S3 client
+        bucket_name (str): S3 bucket of the artifacts
+        key (str): S3 key of the data set, e.g. "runs/1/clean_data.parquet"
+        data_format (str): File format of the data set (csv, parquet or feather)
+
+    Returns:
+        pd.DataFrame: The data set
+
+    Raises:
+        FileNotFoundError: If there is no object at or under the key
+    """
+    keys = list_parts(s3_client, bucket_name, key)
+    if not keys:
+        raise FileNotFoundError(f"No data set at s3://{bucket_name}/{key}")
+
+    frames = []
+    for part in keys:
+        response = s3_client.get_object(Bucket=bucket_name, Key=part)
+        frames.append(READERS[data_format](BytesIO(response["Body"].read())))
+    logger.debug("Read %s object(s) of s3://%s/%s", len(keys), bucket_name, key)
+    return frames[0] if len(frames) == 1 else pd.concat(frames, ignore_index=True)
@@ -2,15 +2,16 @@ import json
 import logging.config
 import argparse
 import os
-from io import StringIO
 import streamlit as st
 from PIL import Image
-from aggregate_data import get_flight_number, get_avg_duration, get_arrival
+from aggregate_data import RouteIndex, get_flight_number, get_avg_duration, get_arrival
+from s3_data import read_dataset
 import requests
 import pandas as pd
 import yaml
 import boto3
 from boto3.exceptions import Boto3Error
+from botocore.exceptions import ClientError
 
 st.set_page_config(layout="wide")
 
@@ -49,6 +50,7 @@ except Boto3Error as e:
 # environment variables for aws
 BUCKET_NAME = os.getenv("BUCKET_NAME", config["aws"]["bucket_name"])
 PREFIX = os.getenv("PREFIX", config["aws"]["prefix"])
+DATA_FORMAT = os.getenv("DATA_FORMAT", config["aws"].get("data_format", "csv"))
 
 # -------TITLE----------
 st.markdown(f"""<h1 style='text-align: center; color: white;'>
@@ -143,29 +145,57 @@ def validate_input():
 
 # read data to interpolate some inputs
 @st.cache_data
-def load_data(_session: boto3.Session, bucket_name: str, prefix: str) -> pd.DataFrame:
-    """Load original cloud csv data from S3 bucket to create min and max for sliders.
+def load_data(_session: boto3.Session, bucket_name: str, prefix: str,
+              data_format: str = "csv") -> pd.DataFrame:
+    """Load clean data artifact from S3 bucket to create min and max for sliders.
 
     Args:
         _session (boto3.Session): boto3 session to connect to AWS resources (S3 in this case)
         bucket_name (str): S3 bucket name that we want to access
         prefix (str): S3 key prefix for the reseource we want to access
+        data_format (str): File format of the artifact written by the pipeline
+                           (csv, parquet or feather)
 
     Returns:
-        pd.DataFrame: csv data in pandas dataframe format
+        pd.DataFrame: clean data in pandas dataframe format
     """
     try:
-        s3_boto3 = _session.resource("s3")
-        # data are the same in both predix -- choosing rf prefix
-        obj = s3_boto3.Object(bucket_name, key=f"{prefix}/clean_data.csv")
-        df = pd.read_csv(StringIO(obj.get()["Body"].read().decode("utf-8")))
+        # data are the same in both predix -- choosing rf prefix. In streaming mode the
+        # pipeline writes parquet and feather data as a folder of parts, read in order
+        df = read_dataset(_session.client("s3"), bucket_name,
+                          f"{prefix}/clean_data.{data_format}", data_format)
         logger.info("Successfully retrieved data from S3 bucket.")
         return df
-    except Boto3Error as e:
+    except (Boto3Error, ClientError, FileNotFoundError) as e:
         logger.error("Failed to retrieve data from S3 bucket: %s", str(e))
         raise e
 
-df = load_data(session, BUCKET_NAME, PREFIX)
+@st.cache_resource
+def load_route_index(_session: boto3.Session, bucket_name: str, prefix: str,
+                     data_format: str = "csv") -> RouteIndex:
+    """Load the route statistics written by the pipeline, so each prediction only does
+    dictionary lookups. Runs without route statistics fall back to the clean data.
+
+    Args:
+        _session (boto3.Session): boto3 session to connect to AWS resources (S3 in this case)
+        bucket_name (str): S3 bucket name that we want to access
+        prefix (str): S3 key prefix for the reseource we want to access
+        data_format (str): File format of the clean data artifact, for the fallback
+
+    Returns:
+        RouteIndex: flight numbers, durations and arrival times of each route
+    """
+    try:
+        obj = _session.resource("s3").Object(bucket_name, key=f"{prefix}/route_stats.json")
+        route_index = RouteIndex.from_json(obj.get()["Body"].read())
+        logger.info("Successfully retrieved route statistics from S3 bucket.")
+        return route_index
+    except ClientError as e:
+        logger.warning("Route statistics not available (%s). Aggregating the clean data.",
+                       str(e))
+        return RouteIndex.from_data(load_data(_session, bucket_name, prefix, data_format))
+
+route_index = load_route_index(session, BUCKET_NAME, PREFIX, DATA_FORMAT)
 
 # model type
 model_type = st.sidebar.selectbox(config["message"]["model_input"],
@@ -180,41 +210,46 @@ model_dict = {
 def predict():
     # validate input before making prediction
     if validate_input():
-        url = config["path"]["flask_url"]
+        url = config["path"]["flask_batch_url"]
 
-        arrival_time = get_arrival(df, airline, origin, destination, departure_time)
-        duration = get_avg_duration(df, airline, origin, destination)
-        flight_numbers = get_flight_number(df, airline)
+        arrival_time = get_arrival(route_index, airline, origin, destination, departure_time)
+        duration = get_avg_duration(route_index, airline, origin, destination)
+        flight_numbers = get_flight_number(route_index, airline)
 
         try:
+            # One request for all the flight numbers of the airline
+            input_data = {
+                "Data": [{
+                'airline': airline,
+                'flight': flight_number,
+                'class': st.session_state["seat"],
+                'departure_time': departure_time,
+                'origin': origin,
+                'duration': duration,
+                'stops': st.session_state["stop"],
+                'arrival_time': arrival_time,
+                'destination': destination
+                } for flight_number in flight_numbers], "Model": model_dict[model_type]
+                }
+            response = requests.post(url, json=input_data)
+            response.raise_for_status()  # Check if the request was successful
+            logger.info("Successfully call API")
             prices = []
-            for flight_number in flight_numbers:
-                input_data = {
-                    "Data": {
-                    'airline': airline,
-                    'flight': flight_number,
-                    'class': st.session_state["seat"],
-                    'departure_time': departure_time,
-                    'origin': origin,
-                    'duration': duration,
-                    'stops': st.session_state["stop"],
-                    'arrival_time': arrival_time,
-                    'destination': destination
-                    }, "Model": model_dict[model_type]
-                    }
-                response = requests.post(url, json=input_data)
-                response.raise_for_status()  # Check if the request was successful
-                logger.info("Successfully call API")
-                try:
-                    prices.append(float(json.loads(response.text)['prediction']))
-                except json.JSONDecodeError:
-                    st.error("Error: Invalid JSON response received.")
-                    st.error("Response text:", response.text)
-                    logger.error("Error: Invalid JSON response received.")
-                except KeyError:
-                    st.error("Error: 'prediction' key not found in the JSON response.")
-                    st.error("Response text:", response.text)
-                    logger.error("Error: 'prediction' key not found in the JSON response.")
+            try:
+                prices = [float(price) for price in json.loads(response.text)['predictions']
+                          if price is not None]
+            except json.JSONDecodeError:
+                st.error("Error: Invalid JSON response received.")
+                st.error("Response text:", response.text)
+                logger.error("Error: Invalid JSON response received.")
+            except KeyError:
+                st.error("Error: 'predictions' key not found in the JSON response.")
+                st.error("Response text:", response.text)
+                logger.error("Error: 'predictions' key not found in the JSON response.")
+            if not prices:
+                st.error("Error: No model returned a prediction for these inputs.")
+                logger.error("Error: No prediction in the API response.")
+                return
             predicted_price = sum(prices) / len(prices)
             st.success(f"Predicted Price: {round(predicted_price, 2)} Rupees")
             logger.info("Show prediction price: %f Rupees", round(predicted_price, 2))
@@ -0,0 +1,105 @@
+import hashlib
+import io
+import os
+import sys
+from pathlib import Path
+
+import joblib
+import numpy as np
+import pandas as pd
+import pytest
+from botocore.exceptions import ClientError
+from sklearn.compose import ColumnTransformer
+from sklearn.linear_model import LinearRegression
+from sklearn.pipeline import Pipeline
+from sklearn.preprocessing import OneHotEncoder, StandardScaler
+
+# The app modules import each other from the src folder
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "src"))
+
+# predict_api creates an S3 client and the model registry on import: use fake credentials,
+# no local model cache and lazy loading, so no request reaches AWS
+os.environ.update(AWS_ACCESS_KEY_ID="testing", AWS_SECRET_ACCESS_KEY="testing",
+                  AWS_DEFAULT_REGION="us-east-1", LAZY_LOADING="true", MODEL_CACHE_DIR="")
+
+
+def make_records(n_rows, seed=423):
+    """Records with the schema of the features sent by the web app"""
+    rng = np.random.default_rng(seed)
+    return pd.DataFrame({
+        "airline": rng.choice(["Air India", "Vistara"], n_rows),
+        "class": rng.choice(["Business", "Economy"], n_rows),
+        "duration": rng.uniform(1, 30, n_rows).round(2),
+    })
+
+
+@pytest.fixture(scope="session")
+def model():
+    """Small fitted pipeline with the structure of the pipeline models"""
+    records = make_records(200)
+    price = np.log(3000 + 2000 * records["duration"] + 40000 * (records["class"] == "Business"))
+    preprocessor = ColumnTransformer(transformers=[
+        ("num", StandardScaler(), ["duration"]),
+        ("cat", OneHotEncoder(handle_unknown="ignore"), ["airline", "class"]),
+    ])
+    return Pipeline(steps=[("preprocessor", preprocessor), ("model", LinearRegression())]) \
+        .fit(records, price)
+
+
+class FakeS3:
+    """In-memory S3 client serving pickled models and data files, with an ETag per object"""
+    def __init__(self, objects):
+        self.objects = {}
+        self.requests = []
+        for key, obj in objects.items():
+            self.put(key, obj)
+
+    def put(self, key, obj):
+        buffer = io.BytesIO()
+        joblib.dump(obj, buffer)
+        self.objects[key] = buffer.getvalue()
+
+    def put_bytes(self, key, data):
+        self.objects[key] = data
+
+    def get_paginator(self, operation_name):
+        assert operation_name == "list_objects_v2"
+        return self
+
+    def paginate(self, Bucket, Prefix):  # pylint: disable=invalid-name
+        # One page per object, to exercise the pagination of the callers
+        for key in sorted(self.objects):
+            if key.startswith(Prefix):
+                yield {"Contents": [{"Key": key}]}
+
+    def etag(self, key):
+        return f'"{hashlib.md5(self.objects[key]).hexdigest()}"'
+
+    def get_object(self, Bucket, Key):  # pylint: disable=invalid-name
+        self.requests.append(Key)
+        if Key not in self.objects:
+            raise ClientError({"Error": {"Code": "NoSuchKey"}}, "GetObject")
+        return {"Body": io.BytesIO(self.objects[Key]), "ETag": self.etag(Key)}
+
+    def head_object(self, Bucket, Key):  # pylint: disable=invalid-name
+        if Key not in self.objects:
+            raise ClientError({"Error": {"Code": "404"}}, "HeadObject")
+        return {"ETag": self.etag(Key)}
+
+    def download_file(self, Bucket, Key, Filename):  # pylint: disable=invalid-name
+        self.requests.append(Key)
+        Path(Filename).write_bytes(self.objects[Key])
+
+
+@pytest.fixture
+def api(model, monkeypatch):
+    """Test client of the prediction API, serving the model from a fake S3 bucket"""
+    import predict_api
+    from model_registry import ModelRegistry
+
+    s3_client = FakeS3({"runs/1/linear_regression.pkl": model})
+    registry = ModelRegistry(s3_client, "bucket", "runs/1/", ["linear_regression"])
+    registry.on_reload(predict_api.PREDICTION_CACHE.clear)
+    monkeypatch.setattr(predict_api, "MODELS", registry)
+    predict_api.PREDICTION_CACHE.clear()
+    return predict_api
@@ -0,0 +1,77 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+import load_test
+from tests.conftest import make_records
+
+
+def test_plan_requests():
+    records = make_records(50)
+    plan = load_test.plan_requests(records, 400, {"linear_regression": 3, "xgboost": 1},
+                                   batch_fraction=0.25, batch_size=5)
+
+    assert len(plan) == 400
+    models = pd.Series([model for model, _, _ in plan])
+    assert models.value_counts(normalize=True)["linear_regression"] == pytest.approx(0.75,
+                                                                                   abs=0.07)
+    batches = [body for _, endpoint, body in plan if endpoint == "/predict/batch"]
+    assert len(batches) / len(plan) == pytest.approx(0.25, abs=0.07)
+
+    for model, endpoint, body in plan:
+        assert body["Model"] == model
+        assert set(body["Data"]) == set(records.columns)
+        if endpoint == "/predict/batch":
+            # Columnar batches of records sampled from the data
+            assert all(len(values) == 5 for values in body["Data"].values())
+            assert set(body["Data"]["airline"]) <= set(records["airline"])
+        else:
+            assert endpoint == "/predict"
+            assert body["Data"]["class"] in set(records["class"])
+
+    # Same seed, same plan
+    assert load_test.plan_requests(records, 400, {"linear_regression": 3, "xgboost": 1},
+                                   batch_fraction=0.25, batch_size=5) == plan
+
+
+def test_plan_requests_single_model_no_batches():
+    plan = load_test.plan_requests(make_records(10), 20, {"xgboost": 1})
+    assert {(model, endpoint) for model, endpoint, _ in plan} == {("xgboost", "/predict")}
+
+
+@pytest.fixture
+def results():
+    latency = np.arange(1, 101, dtype=float)
+    return pd.DataFrame({
+        "model": ["linear_regression"] * 100 + ["xgboost"] * 100,
+        "endpoint": "/predict",
+        "latency_ms": np.concatenate([latency, latency * 10]),
+        "ok": [True] * 100 + [True] * 90 + [False] * 10,
+    })
+
+
+def test_summarize(results):
+    summary = load_test.summarize(results, seconds=4.0).set_index("model")
+
+    assert list(summary.index) == ["linear_regression", "xgboost", "all"]
+    assert summary.loc["linear_regression", "requests"] == 100
+    assert summary.loc["linear_regression", "p50_ms"] == pytest.approx(50.5)
+    assert summary.loc["linear_regression", "p95_ms"] == pytest.approx(
+        np.percentile(np.arange(1, 101), 95))
+    assert summary.loc["xgboost", "errors"] == 10
+    assert summary.loc["xgboost", "error_rate"] == pytest.approx(0.1)
+    assert summary.loc["xgboost", "max_ms"] == 1000
+    assert summary.loc["all", "requests"] == 200
+    assert summary.loc["all", "throughput_rps"] == pytest.approx(50)
+    assert summary.loc["all", "error_rate"] == pytest.approx(0.05)
+
+
+def test_check_slo(results):
+    summary = load_test.summarize(results, seconds=4.0)
+    checked = load_test.check_slo(summary, {"p95_ms": 200, "error_rate": 0.01})
+    assert dict(zip(checked["model"], checked["slo_met"])) == {
+        "linear_regression": True, "xgboost": False, "all": False}
+
+    # Objectives set to None, or no objectives, are not checked
+    assert load_test.check_slo(summary, {"p95_ms": None})["slo_met"].all()
+    assert load_test.check_slo(summary, None)["slo_met"].all()
@@ -0,0 +1,83 @@
+import threading
+
+import pandas as pd
+import pytest
+
+from micro_batching import MicroBatcher
+
+
+class RecordingModel:
+    """Predicts the value of each record and records the size of each call"""
+    def __init__(self):
+        self.calls = []
+        self.lock = threading.Lock()
+
+    def __call__(self, model_name, dataframe):
+        with self.lock:
+            self.calls.append(len(dataframe))
+        if (dataframe["value"] < 0).any():
+            raise ValueError("negative value")
+        return dataframe["value"].to_numpy() * 2
+
+
+def record(value):
+    return pd.DataFrame({"value": [value]})
+
+
+def test_concurrent_requests_are_batched():
+    model = RecordingModel()
+    batcher = MicroBatcher(model, max_wait_ms=200, max_batch_size=64)
+    futures = [batcher.submit("model", record(value)) for value in range(5)]
+
+    assert [future.result(timeout=5) for future in futures] == [0, 2, 4, 6, 8]
+    assert model.calls == [5]
+    assert batcher.metrics()["batch_sizes"] == {5: 1}
+    batcher.close(timeout=5)
+
+
+def test_batches_are_capped():
+    model = RecordingModel()
+    batcher = MicroBatcher(model, max_wait_ms=200, max_batch_size=2)
+    futures = [batcher.submit("model", record(value)) for value in range(5)]
+
+    assert [future.result(timeout=5) for future in futures] == [0, 2, 4, 6, 8]
+    assert max(model.calls) <= 2
+    assert sum(model.calls) == 5
+    batcher.close(timeout=5)
+
+
+def test_invalid_record_only_fails_its_request():
+    model = RecordingModel()
+    batcher = MicroBatcher(model, max_wait_ms=200, max_batch_size=64)
+    futures = [batcher.submit("model", record(value)) for value in (1, -1, 3)]
+
+    assert futures[0].result(timeout=5) == 2
+    assert futures[2].result(timeout=5) == 6
+    with pytest.raises(ValueError, match="negative value"):
+        futures[1].result(timeout=5)
+    # The failed batch, then each of its records alone
+    assert model.calls == [3, 1, 1, 1]
+    batcher.close(timeout=5)
+
+
+def test_models_have_separate_batches():
+    model = RecordingModel()
+    batcher = MicroBatcher(model, max_wait_ms=200, max_batch_size=64)
+    futures = [batcher.submit(name, record(1)) for name in ("a", "b", "a")]
+
+    assert [future.result(timeout=5) for future in futures] == [2, 2, 2]
+    assert sorted(model.calls) == [1, 2]
+    batcher.close(timeout=5)
+
+
+def test_close_scores_queued_requests():
+    model = RecordingModel()
+    batcher = MicroBatcher(model, max_wait_ms=10_000, max_batch_size=64)
+    future = batcher.submit("model", record(4))
+
+    # Closing does not wait for the end of the batch window
+    batcher.close(timeout=5)
+    assert future.result(timeout=0) == 8
+    assert not any(worker.is_alive() for worker in batcher._workers.values())
+    with pytest.raises(RuntimeError):
+        batcher.submit("model", record(1))
@@ -0,0 +1,120 @@
+import threading
+
+import pytest
+
+from model_registry import ModelRegistry, ReloadError
+from tests.conftest import FakeS3
+
+
+NAMES = ["linear_regression", "xgboost"]
+
+
+@pytest.fixture
+def s3_client():
+    # Two runs with different models; the third one misses a model
+    return FakeS3({**{f"runs/1/{name}.pkl": {"name": name, "run": 1} for name in NAMES},
+                   **{f"runs/2/{name}.pkl": {"name": name, "run": 2} for name in NAMES},
+                   "runs/3/linear_regression.pkl": {"name": "linear_regression", "run": 3}})
+
+
+def test_get_with_version(s3_client):
+    registry = ModelRegistry(s3_client, "bucket", "runs/1/", NAMES)
+    model, version = registry.get_with_version("xgboost")
+
+    assert model == {"name": "xgboost", "run": 1}
+    assert version == s3_client.etag("runs/1/xgboost.pkl")
+    assert registry.get("xgboost") is model
+    assert registry.version("xgboost") == version
+    # Loaded once, on first use
+    assert s3_client.requests == ["runs/1/xgboost.pkl"]
+    with pytest.raises(KeyError):
+        registry.get("unknown")
+
+
+def test_load_all(s3_client):
+    registry = ModelRegistry(s3_client, "bucket", "runs/1/", NAMES)
+    registry.load_all()
+    assert registry.snapshot() == ("runs/1/", {name: s3_client.etag(f"runs/1/{name}.pkl")
+                                               for name in NAMES})
+
+
+def test_reload_swaps_all_models(s3_client):
+    registry = ModelRegistry(s3_client, "bucket", "runs/1/", NAMES,
+                             allowed_prefixes=["runs/"])
+    registry.load_all()
+    reloads = []
+    registry.on_reload(lambda: reloads.append(registry.prefix))
+
+    versions = registry.reload("runs/2/")
+    assert versions == {name: s3_client.etag(f"runs/2/{name}.pkl") for name in NAMES}
+    assert registry.prefix == "runs/2/"
+    assert all(registry.get(name)["run"] == 2 for name in NAMES)
+    assert reloads == ["runs/2/"]
+
+
+def test_failed_reload_keeps_current_models(s3_client):
+    registry = ModelRegistry(s3_client, "bucket", "runs/1/", NAMES,
+                             allowed_prefixes=["runs/"])
+    registry.load_all()
+    before = registry.snapshot()
+    reloads = []
+    registry.on_reload(lambda: reloads.append(True))
+
+    with pytest.raises(ReloadError, match="xgboost"):
+        registry.reload("runs/3/")
+    assert registry.snapshot() == before
+    assert all(registry.get(name)["run"] == 1 for name in NAMES)
+    assert not reloads
+
+
+@pytest.mark.parametrize("prefix", ["other/", "runs/../secrets/", "runs"])
+def test_reload_rejects_prefixes(s3_client, prefix):
+    registry = ModelRegistry(s3_client, "bucket", "runs/1/", NAMES,
+                             allowed_prefixes=["runs/"])
+    assert not registry.allows(prefix)
+    with pytest.raises(ReloadError, match="not one of the allowed"):
+        registry.reload(prefix)
+    assert not s3_client.requests
+
+
+def test_default_allowed_prefix(s3_client):
+    registry = ModelRegistry(s3_client, "bucket", "runs/1/", NAMES)
+    assert registry.allows("runs/1/")
+    assert not registry.allows("runs/2/")
+
+
+def test_models_are_read_with_their_version(s3_client):
+    registry = ModelRegistry(s3_client, "bucket", "runs/1/", NAMES,
+                             allowed_prefixes=["runs/"])
+    registry.load_all()
+    expected = {run: s3_client.etag(f"runs/{run}/xgboost.pkl") for run in (1, 2)}
+
+    stop = threading.Event()
+    mismatches = []
+
+    def read():
+        while not stop.is_set():
+            model, version = registry.get_with_version("xgboost")
+            if expected[model["run"]] != version:
+                mismatches.append((model, version))
+
+    readers = [threading.Thread(target=read) for _ in range(4)]
+    for reader in readers:
+        reader.start()
+    for run in (2, 1, 2, 1, 2):
+        registry.reload(f"runs/{run}/")
+    stop.set()
+    for reader in readers:
+        reader.join()
+    assert not mismatches
+
+
+def test_local_cache(s3_client, tmp_path):
+    ModelRegistry(s3_client, "bucket", "runs/1/", NAMES, cache_dir=tmp_path).load_all()
+    assert len(s3_client.requests) == 2
+
+    # A new server finds the models in the cache
+    registry = ModelRegistry(s3_client, "bucket", "runs/1/", NAMES, cache_dir=tmp_path)
+    registry.load_all()
+    assert len(s3_client.requests) == 2
+    assert registry.get("xgboost") == {"name": "xgboost", "run": 1}
@@ -0,0 +1,181 @@
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pytest
+
+from micro_batching import MicroBatcher
+
+
+RECORD = {"airline": "Vistara", "class": "Business", "duration": 6.25}
+
+
+def post(api, path, payload):
+    response = api.app.test_client().post(path, json=payload)
+    return response.status_code, response.get_json()
+
+
+@pytest.fixture
+def batching_api(api, monkeypatch):
+    batcher = MicroBatcher(api.predict_records_versioned, max_wait_ms=200, max_batch_size=64)
+    monkeypatch.setattr(api, "MICRO_BATCHER", batcher)
+    yield api
+    batcher.close(timeout=5)
+
+
+def test_predict(api, model):
+    status, body = post(api, "/predict", {"Data": RECORD, "Model": "linear_regression"})
+    expected = np.exp(model.predict(api.pd.DataFrame(RECORD, index=[0]))[0])
+    assert status == 200
+    assert body["prediction"] == pytest.approx(expected)
+
+
+def test_predict_invalid_record(api):
+    status, body = post(api, "/predict", {"Data": {**RECORD, "duration": "six hours"},
+                                          "Model": "linear_regression"})
+    assert status == 400
+    assert "Invalid data" in body["error"]
+
+
+def test_predict_unknown_model(api):
+    status, _ = post(api, "/predict", {"Data": RECORD, "Model": "unknown"})
+    assert status == 400
+
+
+def test_micro_batching_isolates_invalid_records(batching_api, model):
+    records = [{**RECORD, "duration": duration} for duration in (2.5, "six hours", 7.0)]
+    with ThreadPoolExecutor(max_workers=3) as executor:
+        responses = list(executor.map(
+            lambda record: post(batching_api, "/predict",
+                                {"Data": record, "Model": "linear_regression"}), records))
+
+    assert [status for status, _ in responses] == [200, 400, 200]
+    for (_, body), record in zip(responses, records):
+        if "prediction" in body:
+            expected = np.exp(model.predict(batching_api.pd.DataFrame(record, index=[0]))[0])
+            assert body["prediction"] == pytest.approx(expected)
+    assert batching_api.MICRO_BATCHER.metrics()["requests"] == 3
+
+
+def test_micro_batching_timeout(batching_api, monkeypatch):
+    monkeypatch.setattr(batching_api, "BATCH_TIMEOUT_S", 0.01)
+    monkeypatch.setattr(batching_api.MICRO_BATCHER, "max_wait", 1.0)
+    status, body = post(batching_api, "/predict", {"Data": RECORD,
+                                                   "Model": "linear_regression"})
+    assert status == 504
+    assert "timed out" in body["error"]
+
+
+@pytest.fixture
+def reload_api(api, model, monkeypatch):
+    api.MODELS.s3_client.put("runs/2/linear_regression.pkl", model)
+    api.MODELS.allowed_prefixes = ["runs/"]
+    monkeypatch.setattr(api, "RELOAD_TOKEN", "secret")
+    return api
+
+
+def reload(api, payload, token="secret"):
+    response = api.app.test_client().post("/models/reload", json=payload,
+                                          headers={"Authorization": f"Bearer {token}"})
+    return response.status_code, response.get_json()
+
+
+def test_reload_disabled_without_token(api):
+    status, _ = reload(api, {})
+    assert status == 403
+
+
+def test_reload_requires_token(reload_api):
+    status, _ = reload(reload_api, {"Prefix": "runs/2/"}, token="wrong")
+    assert status == 401
+    assert reload_api.MODELS.prefix == "runs/1/"
+
+
+def test_reload(reload_api):
+    status, body = reload(reload_api, {"Prefix": "runs/2/"})
+    assert status == 200
+    assert body["prefix"] == "runs/2/"
+    assert list(body["versions"]) == ["linear_regression"]
+    assert reload_api.app.test_client().get("/models").get_json() == body
+
+
+@pytest.mark.parametrize("prefix", ["elsewhere/", "runs/../elsewhere/"])
+def test_reload_rejects_prefix(reload_api, prefix):
+    status, body = reload(reload_api, {"Prefix": prefix})
+    assert status == 400
+    assert "not allowed" in body["error"]
+    assert not any(key.startswith("elsewhere") for key in reload_api.MODELS.s3_client.requests)
+
+
+def test_failed_reload_keeps_models(reload_api):
+    reload_api.MODELS.get("linear_regression")
+    status, _ = reload(reload_api, {"Prefix": "runs/9/"})
+    assert status == 502
+    assert reload_api.MODELS.prefix == "runs/1/"
+    assert reload_api.MODELS.version("linear_regression") is not None
+
+
+def test_cache_key_uses_model_version(api):
+    payload = {"Data": RECORD, "Model": "linear_regression"}
+    post(api, "/predict", payload)
+    _, version = api.MODELS.get_with_version("linear_regression")
+    assert api.PREDICTION_CACHE.get(
+        ("linear_regression", version,
+         api.canonicalize(RECORD, api.MODELS.get("linear_regression")
+                          .named_steps["preprocessor"].feature_names_in_))) is not None
+
+
+BATCH = [RECORD, {**RECORD, "duration": "six hours"}, {"airline": "Vistara", "duration": 3.0},
+         {**RECORD, "airline": "Unknown airline", "duration": 1.5}]
+
+
+def test_predict_batch_records(api, model):
+    status, body = post(api, "/predict/batch", {"Data": BATCH, "Model": "linear_regression"})
+    assert status == 200
+
+    # Invalid rows get a null prediction and an error, the others are predicted
+    predictions = body["predictions"]
+    assert predictions[1] is None and predictions[2] is None
+    expected = np.exp(model.predict(api.pd.DataFrame([BATCH[0], BATCH[3]])))
+    assert [predictions[0], predictions[3]] == pytest.approx(list(expected))
+    assert body["errors"] == [{"index": 1, "error": "non-numeric value for duration"},
+                              {"index": 2, "error": "missing value for class"}]
+
+
+def test_predict_batch_columnar(api):
+    columnar = {column: [record.get(column) for record in BATCH]
+                for column in ("airline", "class", "duration")}
+    _, by_record = post(api, "/predict/batch", {"Data": BATCH, "Model": "linear_regression"})
+    status, by_column = post(api, "/predict/batch", {"Data": columnar,
+                                                     "Model": "linear_regression"})
+    assert status == 200
+    assert by_column == by_record
+
+
+def test_predict_batch_invalid_payload(api):
+    status, _ = post(api, "/predict/batch", {"Data": "not a batch",
+                                             "Model": "linear_regression"})
+    assert status == 400
+    status, _ = post(api, "/predict/batch", {"Data": BATCH, "Model": "unknown"})
+    assert status == 400
+
+
+def test_validate_batch_finds_numeric_columns_by_transformer(api):
+    from sklearn.compose import ColumnTransformer
+    from sklearn.impute import SimpleImputer
+    from sklearn.pipeline import make_pipeline
+    from sklearn.preprocessing import MinMaxScaler, OrdinalEncoder
+
+    # Transformer names other than "num", with a scaler alone or after an imputer
+    records = api.pd.DataFrame([RECORD, {**RECORD, "duration": 2.0}]).assign(stops=[0, 1])
+    preprocessor = ColumnTransformer(transformers=[
+        ("duration", MinMaxScaler(), ["duration"]),
+        ("stops", make_pipeline(SimpleImputer(), MinMaxScaler()), ["stops"]),
+        ("encoded", OrdinalEncoder(), ["airline", "class"]),
+    ]).fit(records)
+    assert api.numeric_columns(preprocessor) == ["duration", "stops"]
+
+    batch = api.pd.DataFrame({"airline": ["Vistara", "Air India"], "class": ["Business", 3],
+                              "duration": ["1.5", "long"], "stops": [1, "one"]})
+    assert api.validate_batch(batch, preprocessor) == {
+        1: "non-numeric value for duration; non-numeric value for stops"}
+    assert batch["duration"].iloc[0] == 1.5
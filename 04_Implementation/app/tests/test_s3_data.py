@@ -0,0 +1,64 @@
+import io
+
+import pandas as pd
+import pytest
+
+import load_test
+from s3_data import list_parts, read_dataset
+from tests.conftest import FakeS3, make_records
+
+
+def to_bytes(data, data_format):
+    buffer = io.BytesIO()
+    if data_format == "csv":
+        data.to_csv(buffer, index=False)
+    else:
+        getattr(data, f"to_{data_format}")(buffer)
+    return buffer.getvalue()
+
+
+@pytest.fixture
+def records():
+    return make_records(30)
+
+
+@pytest.mark.parametrize("data_format", ["csv", "parquet", "feather"])
+def test_read_single_object(records, data_format):
+    s3_client = FakeS3({})
+    s3_client.put_bytes(f"runs/1/clean_data.{data_format}", to_bytes(records, data_format))
+
+    data = read_dataset(s3_client, "bucket", f"runs/1/clean_data.{data_format}", data_format)
+    pd.testing.assert_frame_equal(data, records)
+
+
+@pytest.mark.parametrize("data_format", ["parquet", "feather"])
+def test_read_parts(records, data_format):
+    # Parts written in streaming mode, listed out of order and next to a similar key
+    s3_client = FakeS3({})
+    key = f"runs/1/clean_data.{data_format}"
+    for number, start in reversed(list(enumerate(range(0, 30, 12)))):
+        s3_client.put_bytes(f"{key}/part-{number:05d}.{data_format}",
+                            to_bytes(records.iloc[start:start + 12].reset_index(drop=True),
+                                     data_format))
+    s3_client.put_bytes(f"{key}.bak", b"")
+
+    assert list_parts(s3_client, "bucket", key) == [
+        f"{key}/part-{number:05d}.{data_format}" for number in range(3)]
+    pd.testing.assert_frame_equal(read_dataset(s3_client, "bucket", key, data_format), records)
+
+
+def test_read_missing_dataset():
+    with pytest.raises(FileNotFoundError):
+        read_dataset(FakeS3({}), "bucket", "runs/1/clean_data.parquet", "parquet")
+
+
+def test_load_records_from_local_parts(tmp_path):
+    records = pd.DataFrame({feature: [f"{feature}-{row}" for row in range(10)]
+                            for feature in load_test.FEATURES})
+    path = tmp_path / "clean_data.feather"
+    path.mkdir()
+    records.iloc[:6].reset_index(drop=True).to_feather(path / "part-00000.feather")
+    records.iloc[6:].reset_index(drop=True).to_feather(path / "part-00001.feather")
+
+    pd.testing.assert_frame_equal(load_test.load_records(str(path), "bucket", "runs/1"),
+                                  records)
@@ -0,0 +1,377 @@
+"""
+This script benchmarks the hot paths of the pipeline and the prediction API on synthetic
+flight data: every stage from clean_data to the preprocessor, the fit and predict of each
+configured model, and the handling of /predict and /predict/batch requests through the
+Flask test client. Results are saved as JSON and compared against a saved baseline, so a
+change that slows down a stage shows up as a regression.
+
+Run it from the pipeline folder:
+
+    python -m benchmarks.benchmark --sizes 10000 300000 3000000
+    python -m benchmarks.benchmark --sizes 10000 --save-baseline
+"""
+# Libraries
+import argparse
+import contextlib
+import datetime
+import gc
+import importlib
+import json
+import logging
+import os
+import platform
+import statistics
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import Callable, Iterator, List, Optional
+from unittest.mock import patch
+
+import pandas as pd
+import sklearn
+import xgboost
+import yaml
+from sklearn.model_selection import train_test_split
+
+import src.clean_data as cd
+import src.generate_features as gf
+import src.raw_data as rd
+import src.train_model as tm
+from benchmarks.synthetic import synthetic_raw_data
+
+
+# Set logger
+logger = logging.getLogger(__name__)
+
+# Source folder of the prediction API
+APP_DIR = Path(__file__).resolve().parents[2] / "app" / "src"
+BUCKET_NAME = "benchmark-bucket"
+# Token of the /models/reload endpoint of the benchmarked API
+RELOAD_TOKEN = "benchmark"
+
+def time_call(func: Callable, repeats: int = 3, rows: Optional[int] = None):
+    """
+    Times a function, running it several times after a garbage collection.
+
+    Args:
+        func (Callable): Function to time, without arguments.
+        repeats (int): Number of runs.
+        rows (int): Optional number of rows processed by each run, for the throughput.
+
+    Returns:
+        dict: Wall time of every run, their minimum and median, and the rows per second at
+              the median.
+        Any: Result of the last run.
+    """
+    seconds = []
+    for _ in range(repeats):
+        gc.collect()
+        start = time.perf_counter()
+        result = func()
+        seconds.append(time.perf_counter() - start)
+
+    timing = {"seconds": seconds, "min": min(seconds), "median": statistics.median(seconds)}
+    if rows:
+        timing["rows"] = rows
+        timing["rows_per_second"] = rows / timing["median"]
+    return timing, result
+
+
+def benchmark_stages(raw_data: pd.DataFrame, config: dict, repeats: int = 3,
+                     model_repeats: int = 1) -> tuple:
+    """
+    Times the stages of the pipeline and the fit and predict of each model.
+
+    Args:
+        raw_data (pd.DataFrame): Raw data to run the stages on.
+        config (dict): Configuration of the pipeline.
+        repeats (int): Number of runs of each stage and prediction.
+        model_repeats (int): Number of fits of each model.
+
+    Returns:
+        dict: Timings by benchmark name.
+        dict: Models trained on the data, for the API benchmarks.
+        pd.DataFrame: Test set of the models.
+    """
+    timings = {}
+    n_rows = len(raw_data)
+
+    timings["clean_data"], clean = time_call(
+        lambda: cd.clean_data(raw_data, **config["clean_data"]), repeats, n_rows)
+    feature_config = config["generate_features"]
+    timings["generate_features"], features = time_call(
+        lambda: gf.generate_features(clean, feature_config), repeats, len(clean))
+    timings["filter_airlines"], _ = time_call(
+        lambda: gf.filter_airlines(clean, feature_config.get("filter_airlines", 1000)),
+        repeats, len(clean))
+    # Keys with many more groups than airlines: flight codes and routes
+    for name, keys in (("flight", ["flight"]), ("route", ["airline", "origin", "destination"])):
+        timings[f"filter_rare.{name}"], _ = time_call(
+            lambda keys=keys: clean[gf.rare_mask(clean, keys, 10)], repeats, len(clean))
+
+    # Artifacts in the configured format
+    artifact_format = config.get("run_config", {}).get("artifact_format", "csv")
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        path = Path(tmp_dir) / f"features.{artifact_format}"
+        timings["save_dataset"], _ = time_call(lambda: rd.save_dataset(features, path),
+                                               repeats, len(features))
+        timings["load_dataset"], _ = time_call(lambda: rd.load_dataset(path), repeats,
+                                               len(features))
+
+    # Same split as train_and_evaluate
+    train_config = config["train_model"]
+    split_config = train_config.get("train_test_split", {})
+    x_train, x_test, y_train, _ = train_test_split(
+        features.drop("price", axis=1), features["price"],
+        test_size=split_config.get("test_size", 0.2),
+        random_state=split_config.get("random_state", 42))
+    timings["preprocessor"], _ = time_call(
+        lambda: tm.define_preprocessor(train_config).fit_transform(x_train), repeats,
+        len(x_train))
+
+    models = {}
+    for name, model in tm.define_models(train_config).items():
+        timings[f"fit.{name}"], models[name] = time_call(
+            lambda name=name, model=model: tm.train_model(
+                tm.define_preprocessor(train_config,
+                                       train_config["models"][name].get("preprocessor")),
+                model, x_train, y_train),
+            model_repeats, len(x_train))
+        timings[f"predict.{name}"], _ = time_call(
+            lambda name=name: models[name].predict(x_test), repeats, len(x_test))
+    return timings, models, x_test
+
+
+@contextlib.contextmanager
+def api_client() -> Iterator:
+    """
+    Starts the prediction API on a mocked S3 bucket, without credentials or network access.
+
+    Yields:
+        The Flask test client and the mocked S3 client, or None if the app or moto cannot
+        be imported.
+    """
+    try:
+        import boto3  # pylint: disable=import-outside-toplevel
+        from moto import mock_s3  # pylint: disable=import-outside-toplevel
+    except ImportError:
+        logger.warning("moto is not installed. The prediction API is not benchmarked.")
+        yield None
+        return
+
+    environment = {"AWS_ACCESS_KEY_ID": "testing", "AWS_SECRET_ACCESS_KEY": "testing",
+                   "AWS_DEFAULT_REGION": "us-east-1", "BUCKET_NAME": BUCKET_NAME,
+                   "PREFIX": "benchmark/", "MODEL_CACHE_DIR": "", "LAZY_LOADING": "true",
+                   "RELOAD_TOKEN": RELOAD_TOKEN}
+    with patch.dict(os.environ, environment), mock_s3():
+        s3_client = boto3.client("s3")
+        s3_client.create_bucket(Bucket=BUCKET_NAME)
+
+        sys.path.insert(0, str(APP_DIR))
+        try:
+            predict_api = importlib.import_module("predict_api")
+        except ImportError as error:
+            logger.warning("The prediction API cannot be imported (%s). It is not benchmarked.",
+                           error)
+            yield None
+            return
+        finally:
+            sys.path.remove(str(APP_DIR))
+        yield predict_api.app.test_client(), s3_client
+
+
+def benchmark_api(client, s3_client, models: dict, x_test: pd.DataFrame,
+                  n_requests: int = 200, batch_size: int = 1000, repeats: int = 3) -> dict:
+    """
+    Times the requests of the prediction API for each model. Every record is sent once, so
+    no prediction comes from the cache of the API.
+
+    Args:
+        client: Flask test client of the API.
+        s3_client: Mocked S3 client the API loads the models from.
+        models (dict): Trained models.
+        x_test (pd.DataFrame): Records to predict.
+        n_requests (int): Number of /predict requests for each model.
+        batch_size (int): Number of records of each /predict/batch request, reduced when the
+                          test set is too small.
+        repeats (int): Number of /predict/batch requests for each model.
+
+    Returns:
+        dict: Timings by benchmark name, per request.
+    """
+    # Publish the models and load them in the API
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        tm.save_all_models(models, Path(tmp_dir))
+        for name in models:
+            s3_client.upload_file(str(Path(tmp_dir) / f"{name}.pkl"), BUCKET_NAME,
+                                  f"benchmark/{name}.pkl")
+    response = client.post("/models/reload", json={},
+                           headers={"Authorization": f"Bearer {RELOAD_TOKEN}"})
+    if response.status_code != 200:
+        raise RuntimeError(f"/models/reload failed: {response.get_json()}")
+
+    timings = {}
+    records = x_test.to_dict("records")
+    n_requests = min(n_requests, len(records) // 2)
+    batch_size = max(1, min(batch_size, (len(records) - n_requests) // repeats))
+    for name in models:
+        seconds = []
+        for record in records[:n_requests]:
+            start = time.perf_counter()
+            response = client.post("/predict", json={"Model": name, "Data": record})
+            seconds.append(time.perf_counter() - start)
+            if response.status_code != 200:
+                raise RuntimeError(f"/predict failed for {name}: {response.get_json()}")
+        timings[f"api.predict.{name}"] = {"min": min(seconds),
+                                          "median": statistics.median(seconds),
+                                          "p95": sorted(seconds)[int(.95 * len(seconds))],
+                                          "requests": n_requests}
+
+        # Distinct records for each run of the batch request
+        batches = [x_test.iloc[start:start + batch_size] for start in range(
+            n_requests, n_requests + repeats * batch_size, batch_size)]
+        seconds = []
+        for batch in batches:
+            body = {"Model": name, "Data": batch.to_dict("list")}
+            start = time.perf_counter()
+            response = client.post("/predict/batch", json=body)
+            seconds.append(time.perf_counter() - start)
+            if response.status_code != 200:
+                raise RuntimeError(f"/predict/batch failed for {name}: {response.get_json()}")
+        timings[f"api.batch.{name}"] = {"seconds": seconds, "min": min(seconds),
+                                        "median": statistics.median(seconds),
+                                        "rows": len(batches[0]),
+                                        "rows_per_second": len(batches[0])
+                                                           / statistics.median(seconds)}
+    return timings
+
+
+def compare(results: dict, baseline: dict, tolerance: float = 0.2) -> pd.DataFrame:
+    """
+    Compares the median time of each benchmark with the baseline.
+
+    Args:
+        results (dict): Results of the current run.
+        baseline (dict): Results of the baseline run.
+        tolerance (float): Relative change of the median time considered noise.
+
+    Returns:
+        pd.DataFrame: Size, benchmark, baseline and current median seconds, their ratio and
+                      whether it is a regression, an improvement or within the tolerance.
+    """
+    rows = []
+    for size, timings in results["benchmarks"].items():
+        for name, timing in timings.items():
+            reference = baseline.get("benchmarks", {}).get(size, {}).get(name)
+            if reference is None:
+                continue
+            ratio = timing["median"] / reference["median"]
+            status = "regression" if ratio > 1 + tolerance else \
+                "improvement" if ratio < 1 - tolerance else "ok"
+            rows.append({"rows": size, "benchmark": name, "baseline": reference["median"],
+                         "current": timing["median"], "ratio": ratio, "status": status})
+    return pd.DataFrame(rows, columns=["rows", "benchmark", "baseline", "current", "ratio",
+                                       "status"])
+
+
+def run_benchmarks(config: dict, sizes: List[int], repeats: int = 3, model_repeats: int = 1,
+                   n_requests: int = 200, seed: int = 423, api: bool = True) -> dict:
+    """
+    Runs all the benchmarks at each data size.
+
+    Args:
+        config (dict): Configuration of the pipeline.
+        sizes (list[int]): Numbers of rows of synthetic raw data.
+        repeats (int): Number of runs of each stage and prediction.
+        model_repeats (int): Number of fits of each model.
+        n_requests (int): Number of /predict requests for each model.
+        seed (int): Seed of the synthetic data.
+        api (bool): Benchmark the prediction API.
+
+    Returns:
+        dict: The environment of the run and the timings at each size.
+    """
+    results = {
+        "created": datetime.datetime.now().isoformat(timespec="seconds"),
+        "environment": {"python": platform.python_version(), "platform": platform.platform(),
+                        "cpu_count": os.cpu_count(), "pandas": pd.__version__,
+                        "scikit-learn": sklearn.__version__, "xgboost": xgboost.__version__},
+        "benchmarks": {},
+    }
+    with (api_client() if api else contextlib.nullcontext()) as client:
+        for size in sizes:
+            logger.info("Benchmarking %s rows.", size)
+            raw_data = synthetic_raw_data(size, seed)
+            timings, models, x_test = benchmark_stages(raw_data, config, repeats, model_repeats)
+            if client is not None:
+                timings.update(benchmark_api(*client, models, x_test, n_requests,
+                                             repeats=repeats))
+            results["benchmarks"][str(size)] = timings
+            del raw_data, models, x_test
+    return results
+
+
+if __name__ == "__main__":
+    logging.basicConfig(format="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
+                        level=logging.INFO)
+
+    parser = argparse.ArgumentParser(description="Benchmarks of the pipeline hot paths")
+    parser.add_argument("--config", default="config/default-config.yaml",
+                        help="Path to configuration file")
+    parser.add_argument("--sizes", nargs="+", type=int, default=[10_000, 300_000, 3_000_000],
+                        help="Numbers of rows of synthetic data")
+    parser.add_argument("--repeats", type=int, default=3,
+                        help="Runs of each stage and prediction")
+    parser.add_argument("--model-repeats", type=int, default=1, help="Fits of each model")
+    parser.add_argument("--requests", type=int, default=200,
+                        help="Requests to /predict for each model")
+    parser.add_argument("--no-api", action="store_true",
+                        help="Do not benchmark the prediction API")
+    parser.add_argument("--output", default="benchmarks/results",
+                        help="Folder to save the results to")
+    parser.add_argument("--baseline", default="benchmarks/results/baseline.json",
+                        help="Results to compare against")
+    parser.add_argument("--save-baseline", action="store_true",
+                        help="Save the results as the new baseline")
+    parser.add_argument("--tolerance", type=float, default=0.2,
+                        help="Relative slowdown reported as a regression")
+    parser.add_argument("--fail-on-regression", action="store_true",
+                        help="Exit with an error if a benchmark regressed")
+    args = parser.parse_args()
+
+    with open(args.config, "r", encoding="utf-8") as f:
+        config = yaml.safe_load(f)
+
+    results = run_benchmarks(config, args.sizes, args.repeats, args.model_repeats,
+                             args.requests, api=not args.no_api)
+
+    output = Path(args.output)
+    output.mkdir(parents=True, exist_ok=True)
+    results_path = output / f"benchmark_{int(time.time())}.json"
+    results_path.write_text(json.dumps(results, indent=2), encoding="utf-8")
+    logger.info("Benchmark results saved to %s", results_path)
+
+    regressions = pd.DataFrame()
+    baseline_path = Path(args.baseline)
+    if baseline_path.exists() and not args.save_baseline:
+        comparison = compare(results, json.loads(baseline_path.read_text(encoding="utf-8")),
+                             args.tolerance)
+        print(comparison.to_string(index=False, float_format="{:.4f}".format))
+        regressions = comparison[comparison["status"] == "regression"]
+        logger.info("%s of %s benchmarks regressed against %s", len(regressions),
+                    len(comparison), baseline_path)
+    else:
+        summary = pd.DataFrame([{"rows": size, "benchmark": name, "median": timing["median"],
+                                 "rows_per_second": timing.get("rows_per_second")}
+                                for size, timings in results["benchmarks"].items()
+                                for name, timing in timings.items()])
+        print(summary.to_string(index=False, float_format="{:.4f}".format))
+
+    if args.save_baseline:
+        baseline_path.parent.mkdir(parents=True, exist_ok=True)
+        baseline_path.write_text(json.dumps(results, indent=2), encoding="utf-8")
+        logger.info("Baseline saved to %s", baseline_path)
+
+    if args.fail_on_regression and not regressions.empty:
+        sys.exit(1)
@@ -0,0 +1,120 @@
+"""
+This script compares the preprocessors of the 'preprocessors' section of the training
+configuration on synthetic flight data: the size of the matrix each one produces, the time
+to fit it, and the fit time and test metrics of every model trained on it.
+
+Run it from the pipeline folder:
+
+    python -m benchmarks.compare_encoders --sizes 50000 300000
+"""
+# Libraries
+import argparse
+import json
+import logging
+import time
+from pathlib import Path
+from typing import List
+
+import pandas as pd
+import scipy.sparse as sp
+import yaml
+from sklearn.base import clone
+from sklearn.model_selection import train_test_split
+
+import src.clean_data as cd
+import src.generate_features as gf
+import src.train_model as tm
+from benchmarks.synthetic import synthetic_raw_data
+
+
+# Set logger
+logger = logging.getLogger("compare_encoders")
+
+
+def matrix_size(matrix) -> dict:
+    """Shape, stored values and bytes of a dense or sparse matrix."""
+    if sp.issparse(matrix):
+        matrix = matrix.tocsr()
+        nbytes = matrix.data.nbytes + matrix.indices.nbytes + matrix.indptr.nbytes
+        stored = matrix.nnz
+    else:
+        nbytes = matrix.nbytes
+        stored = matrix.size
+    return {"columns": matrix.shape[1], "sparse": sp.issparse(matrix), "stored": int(stored),
+            "mb": nbytes / 1024 ** 2}
+
+
+def compare_encoders(features: pd.DataFrame, train_config: dict,
+                     names: List[str] = None) -> List[dict]:
+    """
+    Fits each preprocessor once on the training set and trains every model on its output.
+
+    Args:
+        features (pd.DataFrame): Data set with features.
+        train_config (dict): Configuration of train_model, with the preprocessors to compare.
+        names (list[str]): Preprocessors to compare. Defaults to all the configured ones.
+
+    Returns:
+        list[dict]: Matrix size, preprocessing time, fit time and metrics of each
+                    preprocessor and model.
+    """
+    split_config = train_config.get("train_test_split", {})
+    x_train, x_test, y_train, y_test = train_test_split(
+        features.drop("price", axis=1), features["price"],
+        test_size=split_config.get("test_size", 0.2),
+        random_state=split_config.get("random_state", 42))
+
+    rows = []
+    for name in names or list(train_config.get("preprocessors", {})) or [None]:
+        preprocessor = tm.define_preprocessor(train_config, name)
+        start = time.perf_counter()
+        x_processed = preprocessor.fit_transform(x_train, y_train)
+        preprocess_seconds = time.perf_counter() - start
+        x_test_processed = preprocessor.transform(x_test)
+        size = matrix_size(x_processed)
+
+        for model_name, model in tm.define_models(train_config).items():
+            model = clone(model)
+            start = time.perf_counter()
+            model.fit(x_processed, y_train)
+            fit_seconds = time.perf_counter() - start
+            metrics = tm.calculate_metrics(y_test, model.predict(x_test_processed))
+            rows.append({"preprocessor": name or "default", "model": model_name,
+                         "rows": len(x_train), **size,
+                         "preprocess_seconds": preprocess_seconds,
+                         "fit_seconds": fit_seconds, "RMSE": metrics["RMSE"],
+                         "R2": metrics["R2"]})
+            logger.info("%s with %s preprocessor: %s columns, fit in %.2f s, RMSE %.4f",
+                        model_name, name or "default", size["columns"], fit_seconds,
+                        metrics["RMSE"])
+    return rows
+
+
+if __name__ == "__main__":
+    logging.basicConfig(format="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
+                        level=logging.INFO)
+
+    parser = argparse.ArgumentParser(description="Comparison of the model preprocessors")
+    parser.add_argument("--config", default="config/default-config.yaml",
+                        help="Path to configuration file")
+    parser.add_argument("--sizes", nargs="+", type=int, default=[50_000],
+                        help="Numbers of rows of synthetic data")
+    parser.add_argument("--preprocessors", nargs="+", default=None,
+                        help="Preprocessors to compare. Defaults to all the configured ones")
+    parser.add_argument("--output", default=None, help="Path to save the report to (JSON)")
+    args = parser.parse_args()
+
+    with open(args.config, "r", encoding="utf-8") as f:
+        config = yaml.safe_load(f)
+
+    report = []
+    for size in args.sizes:
+        clean = cd.clean_data(synthetic_raw_data(size), **config["clean_data"])
+        features = gf.generate_features(clean, config["generate_features"])
+        report += compare_encoders(features, config["train_model"], args.preprocessors)
+
+    print(pd.DataFrame(report).to_string(index=False, float_format="{:.4f}".format))
+
+    if args.output:
+        Path(args.output).write_text(json.dumps(report, indent=2), encoding="utf-8")
+        logger.info("Comparison saved to %s", args.output)
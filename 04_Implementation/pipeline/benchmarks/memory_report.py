@@ -0,0 +1,112 @@
+"""
+This script reports the memory footprint of the clean_data and generate_features stages on
+synthetic flight data, with and without the compact schema of clean_data: the deep size of
+the dataframe each stage returns and the peak of the memory allocated while it runs.
+
+Run it from the pipeline folder:
+
+    python -m benchmarks.memory_report --sizes 10000 300000 3000000
+"""
+# Libraries
+import argparse
+import gc
+import json
+import logging
+import tracemalloc
+from pathlib import Path
+from typing import Callable, List
+
+import pandas as pd
+import yaml
+
+import src.clean_data as cd
+import src.generate_features as gf
+from benchmarks.synthetic import synthetic_raw_data
+
+
+# Set logger
+logger = logging.getLogger("memory_report")
+
+MB = 1024 ** 2
+
+
+def measure(func: Callable, *args, **kwargs):
+    """
+    Runs a function, tracing the memory it allocates.
+
+    Args:
+        func (Callable): Function to run.
+
+    Returns:
+        tuple: The output of the function and the peak of the memory allocated while it ran,
+               in megabytes.
+    """
+    gc.collect()
+    tracemalloc.start()
+    try:
+        output = func(*args, **kwargs)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return output, peak / MB
+
+
+def frame_memory(data: pd.DataFrame) -> float:
+    """Deep memory usage of a dataframe in megabytes, including the strings of object columns"""
+    return float(data.memory_usage(deep=True).sum()) / MB
+
+
+def memory_report(raw_data: pd.DataFrame, config: dict, compact: bool) -> List[dict]:
+    """
+    Measures the memory of the clean_data and generate_features stages.
+
+    Args:
+        raw_data (pd.DataFrame): Raw data with the schema of raw_data.
+        config (dict): Pipeline configuration.
+        compact (bool): Whether clean_data casts the clean data to its compact schema.
+
+    Returns:
+        list[dict]: Rows, output size and allocation peak of each stage, in megabytes.
+    """
+    clean_config = {**config["clean_data"], "compact": compact}
+    clean, clean_peak = measure(cd.clean_data, raw_data, **clean_config)
+    features, features_peak = measure(gf.generate_features, clean, config["generate_features"])
+
+    report = [{"stage": "raw_data", "compact": compact, "rows": len(raw_data),
+               "frame_mb": frame_memory(raw_data), "peak_mb": None},
+              {"stage": "clean_data", "compact": compact, "rows": len(clean),
+               "frame_mb": frame_memory(clean), "peak_mb": clean_peak},
+              {"stage": "generate_features", "compact": compact, "rows": len(features),
+               "frame_mb": frame_memory(features), "peak_mb": features_peak}]
+    logger.info("Memory of %s rows (compact=%s): clean data %.1f MB, features %.1f MB.",
+                len(raw_data), compact, report[1]["frame_mb"], report[2]["frame_mb"])
+    return report
+
+
+if __name__ == "__main__":
+    logging.basicConfig(format="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
+                        level=logging.INFO)
+
+    parser = argparse.ArgumentParser(description="Memory footprint of the pipeline stages")
+    parser.add_argument("--config", default="config/default-config.yaml",
+                        help="Path to configuration file")
+    parser.add_argument("--sizes", nargs="+", type=int, default=[10_000, 300_000],
+                        help="Numbers of rows of synthetic data")
+    parser.add_argument("--output", default=None, help="Path to save the report to (JSON)")
+    args = parser.parse_args()
+
+    with open(args.config, "r", encoding="utf-8") as f:
+        config = yaml.safe_load(f)
+
+    rows = []
+    for size in args.sizes:
+        raw = synthetic_raw_data(size)
+        rows += memory_report(raw, config, compact=False) + \
+                memory_report(raw, config, compact=True)
+
+    report = pd.DataFrame(rows)
+    print(report.to_string(index=False, float_format="{:.1f}".format))
+
+    if args.output:
+        Path(args.output).write_text(json.dumps(rows, indent=2), encoding="utf-8")
+        logger.info("Memory report saved to %s", args.output)
@@ -0,0 +1,79 @@
+"""
+This module generates synthetic flight data with the schema of the raw Kaggle files, so the
+benchmarks can run at any size without access to the S3 bucket. Values are drawn from
+vocabularies of formatted strings, which keeps generating millions of rows fast.
+"""
+# Libraries
+import numpy as np
+import pandas as pd
+
+
+# Airlines with their carrier code and share of the flights. The last one is rare enough to
+# be dropped by filter_airlines at every size.
+AIRLINES = {
+    "Vistara": ("UK", 0.42),
+    "Air India": ("AI", 0.27),
+    "Indigo": ("6E", 0.14),
+    "GO FIRST": ("G8", 0.08),
+    "AirAsia": ("I5", 0.05),
+    "SpiceJet": ("SG", 0.0397),
+    "Trujet": ("2T", 0.0003),
+}
+CITIES = ["Delhi", "Mumbai", "Bangalore", "Kolkata", "Hyderabad", "Chennai"]
+STOPS = ["non-stop ", "1-stop", "1-stop\n\t\t\t\t\t\t\t\t\t\t\t\t\n\t\t\t\t\t\t\t\t\t\t\t\tVia IXU",
+         "2+-stop"]
+STOP_SHARES = [0.12, 0.5, 0.26, 0.12]
+
+
+def synthetic_raw_data(n_rows: int, seed: int = 423) -> pd.DataFrame:
+    """
+    Generates raw flight data, as returned by raw_data for the business and economy files.
+
+    Args:
+        n_rows (int): Number of flights.
+        seed (int): Seed of the random generator. The same seed gives the same data.
+
+    Returns:
+        pd.DataFrame: Raw data with the columns of the csv files and the class column.
+    """
+    rng = np.random.default_rng(seed)
+    airlines = np.array(list(AIRLINES))
+    codes = np.array([code for code, _ in AIRLINES.values()])
+    shares = np.array([share for _, share in AIRLINES.values()])
+    airline = rng.choice(len(airlines), n_rows, p=shares / shares.sum())
+
+    # Vocabularies of formatted values
+    clock_times = np.array([f"{hour:02d}:{minute:02d}" for hour in range(24)
+                            for minute in range(0, 60, 5)])
+    durations = np.array([f"{hour:02d}h {minute:02d}m" for hour in range(1, 50)
+                          for minute in range(0, 60, 5)])
+    prices = np.arange(1100, 124000, 7)
+    price_texts = np.array([f"{price:,}" for price in prices])
+    dates = np.array([f"{day:02d}-{month:02d}-2022" for month in (2, 3) for day in range(1, 29)])
+
+    origin = rng.integers(len(CITIES), size=n_rows)
+    destination = (origin + rng.integers(1, len(CITIES), size=n_rows)) % len(CITIES)
+    is_business = rng.random(n_rows) < 0.31
+    stops = rng.choice(len(STOPS), n_rows, p=STOP_SHARES)
+    duration = rng.integers(len(durations), size=n_rows)
+
+    # Price grows with the class, the stops and the duration of the flight
+    price = rng.lognormal(8.4, 0.35, n_rows) * np.where(is_business, 7.5, 1) \
+        * (1 + 0.15 * np.minimum(stops, 2)) * (1 + duration / len(durations))
+    price = np.clip(np.searchsorted(prices, price), 0, len(prices) - 1)
+
+    cities = np.array(CITIES)
+    return pd.DataFrame({
+        "date": dates[rng.integers(len(dates), size=n_rows)],
+        "airline": airlines[airline],
+        "ch_code": codes[airline],
+        "num_code": rng.integers(100, 1000, n_rows),
+        "dep_time": clock_times[rng.integers(len(clock_times), size=n_rows)],
+        "from": cities[origin],
+        "time_taken": durations[duration],
+        "stop": np.array(STOPS)[stops],
+        "arr_time": clock_times[rng.integers(len(clock_times), size=n_rows)],
+        "to": cities[destination],
+        "price": price_texts[price],
+        "class": np.where(is_business, "business", "economy"),
+    })
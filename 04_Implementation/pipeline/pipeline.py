@@ -1,21 +1,27 @@
 """
-This script orchestrates the entire pipeline by calling modules that 
+This script orchestrates the entire pipeline by calling modules that
 perform each of the following steps:
 
     (1) Download raw data from S3 and save it locally
     (2) Clean the raw data and save it locally
     (3) Generate features from the cleaned data
     (4) Train models using the generated features
-    (5) Evaluate the trained models and save the results locally
+    (5) Evaluate the trained models, overall and by slice, and save the results locally
     (6) Upload all artifacts to S3
 
+The steps are declared as stages of a graph with explicit inputs and outputs, and stages
+that do not depend on each other run concurrently (e.g. the data sets are saved and
+uploaded while the models train).
+
 The pipeline can be configured using the file called 'default-config.yaml'
 """
 
 import argparse
+import contextlib
 import datetime
 import logging.config
 from pathlib import Path
+from typing import List, Optional
 
 import yaml
 
@@ -26,11 +32,356 @@ import src.clean_data as cd
 import src.aws_utils as aws
 import src.train_model as tm
 import src.generate_features as gf
+import src.stream_data as sd
+import src.stream_train as st
+import src.incremental as inc
+import src.stage_cache as sc
+import src.tune_model as tune
+import src.dag as dag
+import src.profiling as prof
+import src.route_stats as rs
+import src.evaluate as ev
 
 # Set up logger config for some file
 logging.config.fileConfig("config/logging/local.conf")
 logger = logging.getLogger("airline")
 
+
+def build_stages(config: dict, artifacts: Path) -> List[dag.Stage]:
+    """
+    Declares the stages of the pipeline and the values they exchange.
+
+    Data sets restored from the stage cache are passed as None to the next stages, which
+    read them from the run directory only if they need them.
+
+    Args:
+        config (dict): Configuration of the pipeline.
+        artifacts (Path): Directory of the current run.
+
+    Returns:
+        list[dag.Stage]: Stages of the pipeline.
+    """
+    run_config = config.get("run_config", {})
+    aws_config = config.get("aws_config")
+    bucket_name = aws_config["bucket_name"]
+    export_config = config["train_model"].get("export", {})
+    model_names = list(config["train_model"]["models"])
+
+    # File format for the data set artifacts
+    artifact_format = run_config.get("artifact_format", "csv")
+    paths = {name: artifacts / f"{name}.{artifact_format}"
+             for name in ("raw_data", "clean_data", "features", "train", "test")}
+
+    # Settings to reuse the outputs of the previous run. Not used in streaming mode.
+    streaming = config["raw_data"].get("streaming", False)
+    # In streaming mode, the models can also be trained out of core on the features file
+    out_of_core = streaming and \
+                  config["train_model"].get("streaming", {}).get("enabled", False)
+    incremental_config = config.get("incremental", {})
+    incremental = incremental_config.get("enabled", False) and not streaming
+
+    # Cache of the stage outputs. Streaming and incremental runs have their own.
+    stage_cache_config = run_config.get("stage_cache", {})
+    stage_cache = None
+    if stage_cache_config.get("enabled", False) and not (streaming or incremental):
+        stage_cache = Path(stage_cache_config.get("cache_dir", "artifacts/cache/stages"))
+
+    def with_cache(key: Optional[str]) -> Optional[Path]:
+        """Stages whose inputs were not read from the cache are not cached."""
+        return stage_cache if key is not None else None
+
+    def load_data_set(name: str):
+        """Loader of a data set from the directory of a previous run"""
+        return lambda previous_run: {name: rd.load_dataset(
+            previous_run / paths[name].name)}
+
+    # --- Data stages ---
+    def raw_data_stage() -> dict:
+        raw_key = None
+        if stage_cache is not None:
+            # Only the source files define the raw data: the transfer settings (max_workers,
+            # part_size, ...) change how they are downloaded, not the output
+            raw_key = sc.stage_key("raw_data", {"file_keys": config["raw_data"]["file_keys"]}, [
+                artifact_format, sc.code_fingerprint(rd),
+                *aws.get_etags(bucket_name, config["raw_data"]["file_keys"]).values()])
+            if sc.restore_stage(stage_cache, "raw_data", raw_key, artifacts):
+                return {"raw_data": None, "raw_key": raw_key}
+
+        # Create raw data set from source
+        raw_data = rd.raw_data(bucket_name, config["raw_data"]["file_keys"],
+                               config["raw_data"].get("max_workers", 8),
+                               config["raw_data"].get("part_size", 8 * 1024 * 1024))
+        return {"raw_data": raw_data, "raw_key": raw_key}
+
+    def clean_data_stage(raw_data, raw_key) -> dict:
+        clean_key = None
+        if raw_key is not None:
+            clean_key = sc.stage_key("clean_data", config["clean_data"],
+                                     [raw_key, sc.code_fingerprint(cd)])
+            if sc.restore_stage(stage_cache, "clean_data", clean_key, artifacts):
+                return {"clean_data": None, "clean_key": clean_key}
+
+        # Clean raw data
+        if raw_data is None:
+            raw_data = rd.load_dataset(paths["raw_data"])
+        return {"clean_data": cd.clean_data(raw_data, **config["clean_data"]),
+                "clean_key": clean_key}
+
+    def load_datasets_stage() -> dict:
+        # Reuse the raw and clean data of the files that did not change since the last run
+        raw_data, clean_data, sources, fingerprints = inc.load_datasets(
+            bucket_name, config["raw_data"], config["clean_data"],
+            Path(incremental_config["cache_dir"]))
+        return {"raw_data": raw_data, "clean_data": clean_data, "sources": sources,
+                "fingerprints": fingerprints, "raw_key": None, "clean_key": None}
+
+    def stream_datasets_stage() -> dict:
+        # Stream raw data in chunks through cleaning and feature generation
+        features_path = sd.stream_datasets(bucket_name, config["raw_data"],
+                                           config["clean_data"], config["generate_features"],
+                                           artifacts, artifact_format)
+        return {"features": None if out_of_core else rd.load_dataset(features_path),
+                "features_key": None, "raw_data_file": paths["raw_data"],
+                "clean_data_file": paths["clean_data"], "features_file": features_path}
+
+    def load_features_file(previous_run: Path) -> dict:
+        """Loader of the path of the features data set of a previous run"""
+        return {"features": None, "features_file": previous_run / paths["features"].name}
+
+    def generate_features_stage(clean_data, clean_key) -> dict:
+        features_key = None
+        if clean_key is not None:
+            features_key = sc.stage_key("generate_features", config["generate_features"],
+                                        [clean_key, sc.code_fingerprint(gf)])
+            if sc.restore_stage(stage_cache, "generate_features", features_key, artifacts):
+                return {"features": rd.load_dataset(paths["features"]),
+                        "features_key": features_key}
+
+        # Generate features
+        if clean_data is None:
+            clean_data = rd.load_dataset(paths["clean_data"])
+        return {"features": gf.generate_features(clean_data, config["generate_features"]),
+                "features_key": features_key}
+
+    def route_stats_stage(clean_data=None, clean_key=None, clean_data_file=None) -> dict:
+        stats_path = artifacts / "route_stats.json"
+        stats_key = None
+        if clean_key is not None:
+            stats_key = sc.stage_key("route_stats", config.get("route_stats", {}),
+                                     [clean_key, sc.code_fingerprint(rs)])
+            if sc.restore_stage(stage_cache, "route_stats", stats_key, artifacts):
+                return {"route_stats_file": stats_path}
+
+        # Summarize the clean data for the web app. In streaming mode the clean data is
+        # read one chunk at a time and only the counts of each chunk are kept
+        stats_config = config.get("route_stats", {})
+        stats = rs.RouteStatsAccumulator(stats_config.get("quantiles"))
+        if clean_data is None:
+            for chunk in rd.iter_dataset(clean_data_file or paths["clean_data"],
+                                         stats_config.get("chunk_size", 100000)):
+                stats.update(chunk)
+        else:
+            stats.update(clean_data)
+        rs.save_route_stats(stats.stats(), stats_path)
+        sc.store_stage(with_cache(stats_key), "route_stats", stats_key, [stats_path])
+        return {"route_stats_file": stats_path}
+
+    def save_stage(name: str, cache_stage: str, key_name: str) -> dag.Stage:
+        """Stage saving a data set and caching it, unless it was restored from the cache"""
+        def save(**inputs) -> dict:
+            if not paths[name].exists():
+                rd.save_dataset(inputs[name], paths[name])
+                sc.store_stage(with_cache(inputs[key_name]), cache_stage, inputs[key_name],
+                               [paths[name]])
+            return {f"{name}_file": paths[name]}
+        return dag.Stage(f"save_{name}", save, [name, key_name], [f"{name}_file"])
+
+    if streaming:
+        stages = [dag.Stage("stream_datasets", stream_datasets_stage, [],
+                            ["features", "features_key", "raw_data_file", "clean_data_file",
+                             "features_file"],
+                            [paths[name].name for name in ("raw_data", "clean_data",
+                                                           "features")],
+                            load_features_file if out_of_core else load_data_set("features")),
+                  dag.Stage("route_stats", route_stats_stage, ["clean_data_file"],
+                            ["route_stats_file"], ["route_stats.json"])]
+    else:
+        if incremental:
+            stages = [dag.Stage("load_datasets", load_datasets_stage, [],
+                                ["raw_data", "clean_data", "sources", "fingerprints",
+                                 "raw_key", "clean_key"],
+                                [paths["raw_data"].name, paths["clean_data"].name])]
+        else:
+            stages = [dag.Stage("raw_data", raw_data_stage, [], ["raw_data", "raw_key"],
+                                [paths["raw_data"].name], load_data_set("raw_data")),
+                      dag.Stage("clean_data", clean_data_stage, ["raw_data", "raw_key"],
+                                ["clean_data", "clean_key"], [paths["clean_data"].name],
+                                load_data_set("clean_data"))]
+        stages += [
+            save_stage("raw_data", "raw_data", "raw_key"),
+            save_stage("clean_data", "clean_data", "clean_key"),
+            dag.Stage("generate_features", generate_features_stage,
+                      ["clean_data", "clean_key"], ["features", "features_key"],
+                      [paths["features"].name], load_data_set("features")),
+            save_stage("features", "generate_features", "features_key"),
+            dag.Stage("route_stats", route_stats_stage, ["clean_data", "clean_key"],
+                      ["route_stats_file"], ["route_stats.json"]),
+        ]
+
+    # --- Training stages ---
+    model_files = [f"{name}.pkl" for name in model_names]
+    train_files = [paths["train"].name, paths["test"].name, "results.yaml",
+                   "tuning_trials.csv", *model_files]
+
+    def train_model_stage(features, features_key, sources=None, fingerprints=None,
+                          features_file=None) -> dict:
+        train_key = None
+        if features_key is not None:
+            train_key = sc.stage_key("train_model", config["train_model"],
+                                     [features_key, artifact_format,
+                                      sc.code_fingerprint(tm, tune)])
+            if sc.restore_stage(stage_cache, "train_model", train_key, artifacts):
+                return {"train": None, "test": None, "results": None, "train_key": None,
+                        "models": load_models(artifacts)}
+
+        # Train and evaluate models
+        if out_of_core:
+            train, test, results, tmo_dict = st.train_streaming(features_file,
+                                                                config["train_model"])
+        elif incremental:
+            train, test, results, tmo_dict = inc.train_incremental(
+                features, sources, config["train_model"], incremental_config, fingerprints,
+                artifacts / "tuning_trials.csv",
+                inc.data_fingerprint(config["clean_data"], config["generate_features"]))
+        else:
+            train, test, results, tmo_dict = tm.train_and_evaluate(
+                features, config["train_model"], artifacts / "tuning_trials.csv")
+        return {"train": train, "test": test, "results": results, "models": tmo_dict,
+                "train_key": train_key}
+
+    def load_models(run_dir: Path) -> dict:
+        return {name: tm.load_model(run_dir / f"{name}.pkl",
+                                    export_config.get("format", "pickle"))
+                for name in model_names}
+
+    def load_training(previous_run: Path) -> dict:
+        # Out-of-core runs do not write the training set
+        train_path = previous_run / paths["train"].name
+        return {"train": rd.load_dataset(train_path) if train_path.exists() else None,
+                "test": rd.load_dataset(previous_run / paths["test"].name),
+                "results": yaml.safe_load((previous_run / "results.yaml").read_text()),
+                "models": load_models(previous_run)}
+
+    def save_train_test_stage(train, test) -> dict:
+        # Out-of-core runs only hold the test set in memory
+        if train is not None:
+            rd.save_dataset(train, paths["train"])
+        if test is not None:
+            rd.save_dataset(test, paths["test"])
+        # Only the files written by this run, or restored from the cache or a previous run
+        return {"train_test_files": [path for path in (paths["train"], paths["test"])
+                                     if path.exists()]}
+
+    def save_results_stage(results) -> dict:
+        # Save results
+        if results is not None:
+            tm.save_results(results, artifacts / "results.yaml")
+        return {"results_file": artifacts / "results.yaml"}
+
+    def save_models_stage(models, results) -> dict:
+        # Save all models, unless restored from the cache
+        if results is not None:
+            tm.save_all_models(models, artifacts, export_config)
+        return {"model_files": [path for name in model_names
+                                for path in artifacts.glob(f"{name}.*")]}
+
+    def cache_train_model_stage(train_key, train_test_files, results_file,
+                                model_files) -> None:
+        outputs = [*train_test_files, results_file, artifacts / "tuning_trials.csv",
+                   *model_files]
+        sc.store_stage(with_cache(train_key), "train_model", train_key,
+                       [output for output in outputs if output.exists()])
+
+    def evaluate_stage(test, models) -> dict:
+        # Metrics of each model on the log and rupee scales, overall and by slice
+        evaluation_files = [artifacts / "evaluation.yaml", artifacts / "evaluation_slices.csv"]
+        if test is None:
+            test = rd.load_dataset(paths["test"])
+        results, slice_metrics = ev.evaluate_models(
+            models, test, config.get("evaluation", {}),
+            "price" in config["generate_features"].get("log_transform", []))
+        ev.save_evaluation(results, slice_metrics, *evaluation_files)
+        return {"evaluation_files": evaluation_files}
+
+    def benchmark_stage(models) -> dict:
+        tm.save_results(tm.benchmark_serialization(models, export_config),
+                        artifacts / "serialization_benchmark.yaml")
+        return {"benchmark_file": artifacts / "serialization_benchmark.yaml"}
+
+    stages += [
+        dag.Stage("train_model", train_model_stage,
+                  ["features", "features_key"] + (["sources", "fingerprints"]
+                                                  if incremental else []) +
+                  (["features_file"] if out_of_core else []),
+                  ["train", "test", "results", "models", "train_key"], train_files,
+                  load_training),
+        dag.Stage("save_train_test", save_train_test_stage, ["train", "test"],
+                  ["train_test_files"]),
+        dag.Stage("save_results", save_results_stage, ["results"], ["results_file"]),
+        dag.Stage("save_models", save_models_stage, ["models", "results"], ["model_files"]),
+        dag.Stage("cache_train_model", cache_train_model_stage,
+                  ["train_key", "train_test_files", "results_file", "model_files"]),
+        dag.Stage("evaluate", evaluate_stage, ["test", "models"], ["evaluation_files"],
+                  ["evaluation.yaml", "evaluation_slices.csv"]),
+    ]
+    model_outputs = ["train_test_files", "results_file", "model_files", "evaluation_files"]
+    if export_config.get("benchmark", False):
+        stages.append(dag.Stage("benchmark_serialization", benchmark_stage, ["models"],
+                                ["benchmark_file"], ["serialization_benchmark.yaml"]))
+        model_outputs.append("benchmark_file")
+
+    # --- Upload stages ---
+    def upload_stage(group: str):
+        """Stage uploading a group of artifacts to S3 as soon as they are written"""
+        def upload(**files) -> dict:
+            paths_to_upload = [artifacts / "config.yaml"] if group == "datasets" else \
+                              [artifacts / "tuning_trials.csv"]
+            for value in files.values():
+                paths_to_upload += value if isinstance(value, list) else [value]
+            uris = aws.upload_artifacts(artifacts, aws_config,
+                                        artifacts / f"upload_report_{group}.yaml",
+                                        [path for path in paths_to_upload
+                                         if path is not None and path.exists()])
+            return {f"{group}_uris": uris}
+        return upload
+
+    def list_uris_stage(datasets_uris, models_uris) -> None:
+        aws.write_list_files((datasets_uris or []) + (models_uris or []),
+                             artifacts / "list_s3_uris.txt")
+
+    if aws_config.get("upload", False):
+        stages += [
+            dag.Stage("upload_datasets", upload_stage("datasets"),
+                      ["raw_data_file", "clean_data_file", "features_file",
+                       "route_stats_file"],
+                      ["datasets_uris"]),
+            dag.Stage("upload_models", upload_stage("models"), model_outputs,
+                      ["models_uris"]),
+            dag.Stage("list_s3_uris", list_uris_stage, ["datasets_uris", "models_uris"]),
+        ]
+    else:
+        logger.info("Upload artifacts to S3 bucket set to false. No artifacts will be uploaded.")
+
+    return stages
+
+
+def latest_run(output: Path, current_run: Path) -> Optional[Path]:
+    """Returns the directory of the most recent run before the current one"""
+    runs = [path for path in output.iterdir()
+            if path.is_dir() and path.name.isdigit() and path != current_run]
+    return max(runs, key=lambda path: int(path.name)) if runs else None
+
+
 if __name__ == "__main__":
 
     # --- Set argparser instance to handle command line arguments ---
@@ -41,6 +392,19 @@ if __name__ == "__main__":
     parser.add_argument(
         "--config", default="config/default-config.yaml", help="Path to configuration file"
     )
+    parser.add_argument(
+        "--from-stage", default=None,
+        help="First stage to run. The outputs of earlier stages are read from a previous run"
+    )
+    parser.add_argument(
+        "--until-stage", default=None,
+        help="Last stage to run. Only the stages it depends on run before it"
+    )
+    parser.add_argument(
+        "--previous-run", default=None,
+        help="Run directory to read earlier outputs from with --from-stage. " +
+             "Defaults to the latest run"
+    )
     args = parser.parse_args()
 
     # Load configuration file for parameters and run config
@@ -56,41 +420,35 @@ if __name__ == "__main__":
     # default is an empty dictionary.
     run_config = config.get("run_config", {})
 
+    # One S3 client for the whole run, with a connection pool sized for the most concurrent
+    # downloads and uploads
+    aws.configure_s3_client(aws.s3_pool_size(config))
+
     # Set up output directory for saving artifacts
     now = int(datetime.datetime.now().timestamp())
-    artifacts = Path(run_config.get("output", "runs")) / str(now)
+    output = Path(run_config.get("output", "runs"))
+    artifacts = output / str(now)
     artifacts.mkdir(parents=True)
 
     # Save config file to artifacts directory for traceability
     with (artifacts / "config.yaml").open("w") as f:
         yaml.dump(config, f)
 
-    # Create raw data set from source, upload to S3 and save to csv
-    print(config["aws_config"]["bucket_name"])
-    raw_data = rd.raw_data(config["aws_config"]["bucket_name"],**config["raw_data"])
-    rd.save_dataset(raw_data, artifacts / "raw_data.csv")
+    # Measure the time, memory and throughput of each stage and model
+    profiling_config = config.get("profiling", {})
+    profiler = None
+    if profiling_config.get("enabled", False):
+        profiler = prof.Profiler(profiling_config.get("tracemalloc", False),
+                                 profiling_config.get("profiler"), artifacts / "profiles",
+                                 profiling_config.get("sample_interval", 0.05))
 
-    # Clean raw data and save to csv
-    clean_data = cd.clean_data(raw_data, **config["clean_data"])
-    rd.save_dataset(clean_data, artifacts / "clean_data.csv")
-
-    # Generate features
-    features = gf.generate_features(clean_data, config["generate_features"])
-    rd.save_dataset(features, artifacts / "features.csv")
-
-    # Train and evaluate models, save artifacts
-    train, test, results, tmo_dict = tm.train_and_evaluate(features, config["train_model"])
-    rd.save_dataset(train, artifacts / "train.csv")
-    rd.save_dataset(test, artifacts / "test.csv")
-
-    # Save results and best model
-    tm.save_results(results, artifacts / "results.yaml")
-    tm.save_all_models(tmo_dict, artifacts)
-
-    # Upload all artifacts to S3
-    aws_config = config.get("aws_config")
-    if aws_config.get("upload", False):
-        uris = aws.upload_artifacts(artifacts, aws_config)
-        aws.write_list_files(uris, artifacts/"list_s3_uris.txt")
-    else:
-        logger.info("Upload artifacts to S3 bucket set to false. No artifacts will be uploaded.")
+    # Run the stages, saving the wall time of each one
+    previous_run = Path(args.previous_run) if args.previous_run else latest_run(output, artifacts)
+    try:
+        with profiler or contextlib.nullcontext():
+            dag.run_dag(build_stages(config, artifacts), artifacts,
+                        run_config.get("max_workers", 4), args.from_stage, args.until_stage,
+                        previous_run, artifacts / "stage_timings.yaml")
+    finally:
+        if profiler is not None:
+            profiler.save(artifacts / "profile.json")
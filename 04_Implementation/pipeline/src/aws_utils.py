@@ -2,38 +2,105 @@
 This module provides functions for uploading the generated artifacts to an S3 bucket. 
 If allowed by the user, the process will create the S3 bucket if it doesn't exist.  
 """
+import functools
+import hashlib
 import logging
+import time
 import typing
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from pathlib import Path
 
 import boto3
 import botocore
+import botocore.config
 import sys
+import yaml
+from boto3.s3.transfer import TransferConfig
 
 # Set logger
 logger = logging.getLogger(__name__)
 
-def get_data_s3(bucket_name: str, file_key: str) -> typing.Any:
+# Connections of the shared S3 client, set once from the configuration by
+# configure_s3_client before the first call to get_s3_client
+MAX_POOL_CONNECTIONS = 10
+
+
+def s3_pool_size(config: dict) -> int:
     """
-    This function is used to retrieve a file from an AWS S3 bucket.
+    Computes the number of connections needed by the most concurrent S3 calls of the
+    pipeline: the downloads of the raw data and the multipart uploads of the artifacts.
+
+    Parameters:
+        config (dict): Configuration of the pipeline, with the "raw_data" and "aws_config"
+                       sections.
+
+    Returns:
+        int: Maximum number of connections of the S3 client.
+    """
+    aws_config = config.get("aws_config", {})
+    return max(MAX_POOL_CONNECTIONS, config.get("raw_data", {}).get("max_workers", 8),
+               aws_config.get("max_workers", 8) * aws_config.get("max_concurrency", 4))
+
+
+def configure_s3_client(max_pool_connections: int) -> None:
+    """
+    Sets the size of the connection pool of the shared S3 client. Call it once, before the
+    client is first used; a client created with another size is replaced.
+
+    Parameters:
+        max_pool_connections (int): Maximum number of connections kept in the pool.
+
+    Returns:
+        None
+    """
+    global MAX_POOL_CONNECTIONS  # pylint: disable=global-statement
+    if max_pool_connections != MAX_POOL_CONNECTIONS:
+        MAX_POOL_CONNECTIONS = max_pool_connections
+        get_s3_client.cache_clear()
+    logger.debug("S3 client configured with %s connections.", max_pool_connections)
+
+
+@functools.lru_cache(maxsize=None)
+def get_s3_client() -> typing.Any:
+    """
+    Returns an S3 client shared by all the calls in the process. boto3 clients are thread
+    safe, so a single client with a connection pool sized for the number of concurrent
+    requests (see configure_s3_client) avoids creating a new session and connection for
+    every download.
+
+    Returns:
+        botocore.client.S3: The S3 client.
+    """
+    # Create an S3 client using the default credentials chain
+    session = boto3.Session()
+    s3_client = session.client(
+        "s3", config=botocore.config.Config(max_pool_connections=MAX_POOL_CONNECTIONS)
+    )
+    logger.info("Connection to AWS S3 session successful.")
+
+    # Function output
+    return s3_client
+
+
+def get_stream_s3(bucket_name: str, file_key: str) -> typing.Any:
+    """
+    This function is used to open a file from an AWS S3 bucket as a stream, so it can be
+    read incrementally without holding the whole file in memory.
 
     Parameters:
         bucket_name (str): The name of the S3 bucket.
         file_key (str): The key of the file (i.e., the path to the file within the bucket).
 
     Returns:
-        bytes: The content of the file as bytes.
+        botocore.response.StreamingBody: A file-like object with the content of the file.
     """
-    # Create an S3 client using the default credentials chain
+    # Shared S3 client using the default credentials chain
     try:
-        session = boto3.Session()
-        s3_client = session.client("s3")
+        s3_client = get_s3_client()
     except botocore.exceptions.ClientError as err:
         logger.error("Error creating S3 client. The process can't continue downloading the" +
                      "file from S3 bucket. Error: ", err)
         sys.exit(1)
-    else:
-        logger.info("Connection to AWS S3 session successful.")
 
     # Get object from S3
     try:
@@ -42,19 +109,216 @@ def get_data_s3(bucket_name: str, file_key: str) -> typing.Any:
         logger.error("Error accessing %s. The process can't continue downloading the file" +
                      "from S3 bucket. Error: %s",file_key, err)
         sys.exit(1)
-    else:
-        # Read object
-        content = response["Body"].read().decode('utf-8')
-    
+
+    logger.info("File %s opened from S3 bucket %s", file_key, bucket_name)
+
+    # Function output
+    return response["Body"]
+
+
+def get_data_s3(bucket_name: str, file_key: str) -> typing.Any:
+    """
+    This function is used to retrieve a file from an AWS S3 bucket.
+
+    Parameters:
+        bucket_name (str): The name of the S3 bucket.
+        file_key (str): The key of the file (i.e., the path to the file within the bucket).
+
+    Returns:
+        str: The content of the file decoded as text.
+    """
+    # Read object
+    content = get_stream_s3(bucket_name, file_key).read().decode('utf-8')
+
     logger.info("File %s recovered from S3 bucket %s", file_key, bucket_name)
 
     # Function output
     return content
 
 
-def upload_artifacts(artifacts: Path, aws_config: dict) -> typing.List[str]:
+def get_object_part(s3_client: typing.Any, bucket_name: str, file_key: str,
+                    byte_range: typing.Optional[str] = None) -> bytes:
+    """
+    Downloads a file, or the byte range of a file, from an AWS S3 bucket.
+
+    Parameters:
+        s3_client (botocore.client.S3): The S3 client.
+        bucket_name (str): The name of the S3 bucket.
+        file_key (str): The key of the file (i.e., the path to the file within the bucket).
+        byte_range (str): Optional HTTP range to download, e.g. "bytes=0-1023".
+
+    Returns:
+        bytes: The content of the file or of the requested range.
     """
-    Upload all the artifacts in the specified directory to an S3 bucket.
+    if byte_range is None:
+        response = s3_client.get_object(Bucket = bucket_name, Key = file_key)
+    else:
+        response = s3_client.get_object(Bucket = bucket_name, Key = file_key, Range = byte_range)
+    return response["Body"].read()
+
+
+def download_objects(bucket_name: str, file_keys: typing.List[str], max_workers: int = 8,
+                     part_size: int = 8 * 1024 * 1024
+                     ) -> typing.Iterator[typing.Tuple[str, bytes]]:
+    """
+    Downloads multiple files from an AWS S3 bucket concurrently. All files are requested at
+    once from a thread pool sharing one pooled S3 client, and files larger than part_size are
+    split in ranged GETs that are downloaded in parallel. Files are yielded as soon as all
+    their parts arrive, so the caller can parse one file while the others keep downloading.
+
+    Parameters:
+        bucket_name (str): The name of the S3 bucket.
+        file_keys (list[str]): The keys of the files (i.e., their paths within the bucket).
+        max_workers (int): Maximum number of concurrent requests. Requests beyond the
+                           connections of the shared client wait for a free connection.
+        part_size (int): Size in bytes of each ranged GET for large files.
+
+    Yields:
+        tuple[str, bytes]: The key and the content of each file, in order of completion.
+    """
+    s3_client = get_s3_client()
+
+    with ThreadPoolExecutor(max_workers = max_workers) as executor:
+        # Get file sizes to plan the ranged GETs
+        try:
+            sizes = dict(zip(file_keys, executor.map(
+                lambda key: s3_client.head_object(Bucket = bucket_name,
+                                                  Key = key)["ContentLength"],
+                file_keys)))
+        except botocore.exceptions.ClientError as err:
+            logger.error("Error accessing files %s. The process can't continue downloading " +
+                         "the files from S3 bucket. Error: %s", file_keys, err)
+            sys.exit(1)
+
+        # Submit one request per file, or per part for large files
+        futures = {}
+        parts = {}
+        for file_key, size in sizes.items():
+            if size <= part_size:
+                byte_ranges = [None]
+            else:
+                byte_ranges = [f"bytes={start}-{min(start + part_size, size) - 1}"
+                               for start in range(0, size, part_size)]
+            parts[file_key] = [None] * len(byte_ranges)
+            for n_part, byte_range in enumerate(byte_ranges):
+                future = executor.submit(get_object_part, s3_client, bucket_name, file_key,
+                                         byte_range)
+                futures[future] = (file_key, n_part)
+            logger.debug("File %s (%s bytes) requested in %s parts.",
+                         file_key, size, len(byte_ranges))
+
+        # Yield each file as soon as all its parts are downloaded
+        pending = {file_key: len(file_parts) for file_key, file_parts in parts.items()}
+        for future in as_completed(futures):
+            file_key, n_part = futures[future]
+            try:
+                parts[file_key][n_part] = future.result()
+            except botocore.exceptions.ClientError as err:
+                logger.error("Error accessing %s. The process can't continue downloading the " +
+                             "file from S3 bucket. Error: %s", file_key, err)
+                sys.exit(1)
+
+            pending[file_key] -= 1
+            if pending[file_key] == 0:
+                logger.info("File %s recovered from S3 bucket %s", file_key, bucket_name)
+                yield file_key, b"".join(parts.pop(file_key))
+
+
+def get_etags(bucket_name: str, file_keys: typing.List[str],
+              max_workers: int = 8) -> typing.Dict[str, str]:
+    """
+    Gets the ETag of multiple files in an AWS S3 bucket without downloading them. The ETag
+    changes whenever the content of a file changes, so it fingerprints the file.
+
+    Parameters:
+        bucket_name (str): The name of the S3 bucket.
+        file_keys (list[str]): The keys of the files (i.e., their paths within the bucket).
+        max_workers (int): Maximum number of concurrent requests. Requests beyond the
+                           connections of the shared client wait for a free connection.
+
+    Returns:
+        dict[str, str]: The ETag of each file, without quotes.
+    """
+    s3_client = get_s3_client()
+
+    with ThreadPoolExecutor(max_workers = max_workers) as executor:
+        try:
+            etags = dict(zip(file_keys, executor.map(
+                lambda key: s3_client.head_object(Bucket = bucket_name,
+                                                  Key = key)["ETag"].strip('"'),
+                file_keys)))
+        except botocore.exceptions.ClientError as err:
+            logger.error("Error accessing files %s. The process can't continue reading " +
+                         "the files from S3 bucket. Error: %s", file_keys, err)
+            sys.exit(1)
+
+    logger.debug("ETags of %s files read from S3 bucket %s", len(etags), bucket_name)
+    return etags
+
+
+def file_sha256(file_name: Path, block_size: int = 1024 * 1024) -> str:
+    """
+    Computes the SHA-256 hash of a file's content, reading it in blocks.
+
+    Args:
+        file_name: A Path object pointing to the file.
+        block_size: Number of bytes read at a time.
+
+    Returns:
+        The hex digest of the file content.
+    """
+    sha256 = hashlib.sha256()
+    with open(file_name, "rb") as file:
+        for block in iter(lambda: file.read(block_size), b""):
+            sha256.update(block)
+    return sha256.hexdigest()
+
+
+def upload_file(s3_client: typing.Any, file_name: Path, bucket_name: str, s3_key: str,
+                transfer_config: TransferConfig,
+                skip_unchanged: bool = True) -> typing.Dict[str, typing.Any]:
+    """
+    Uploads a file to an S3 bucket, skipping it if the object already in the bucket has the
+    same content hash. The hash is stored in the object metadata on upload.
+
+    Args:
+        s3_client: The S3 client.
+        file_name: A Path object pointing to the file to upload.
+        bucket_name: The name of the S3 bucket.
+        s3_key: The key of the object to create.
+        transfer_config: Multipart and concurrency settings for the transfer.
+        skip_unchanged: If True, don't upload files whose content is already in the bucket.
+
+    Returns:
+        A dictionary with the file 'status' (uploaded or skipped), its size in 'bytes' and the
+        time taken in 'seconds'.
+    """
+    start = time.perf_counter()
+    content_hash = file_sha256(file_name)
+
+    if skip_unchanged:
+        try:
+            metadata = s3_client.head_object(Bucket=bucket_name, Key=s3_key)["Metadata"]
+        except botocore.exceptions.ClientError:
+            metadata = {}
+        if metadata.get("sha256") == content_hash:
+            return {"status": "skipped", "bytes": 0, "seconds": time.perf_counter() - start}
+
+    # Upload file to specified S3 bucket
+    s3_client.upload_file(str(file_name), bucket_name, s3_key, Config=transfer_config,
+                          ExtraArgs={"Metadata": {"sha256": content_hash}})
+
+    return {"status": "uploaded", "bytes": file_name.stat().st_size,
+            "seconds": time.perf_counter() - start}
+
+
+def upload_artifacts(artifacts: Path, aws_config: dict,
+                     report_path: typing.Optional[Path] = None,
+                     files: typing.Optional[typing.List[Path]] = None) -> typing.List[str]:
+    """
+    Upload all the artifacts in the specified directory to an S3 bucket. Files are uploaded
+    concurrently by a bounded pool of workers, large files are sent as multipart uploads and
+    files already in the bucket with the same content are skipped.
 
     Args:
         artifacts_dir: A Path object pointing to the directory containing all the artifacts
@@ -64,61 +328,95 @@ def upload_artifacts(artifacts: Path, aws_config: dict) -> typing.List[str]:
                     - 'bucket_name': The name of the S3 bucket to upload the artifacts to.
                     - 'prefix': The S3 object key prefix to prepend to the uploaded artifact
                       objects.
+                    - 'max_workers': Number of files uploaded at the same time. Default 8.
+                    - 'max_concurrency': Number of parts of a file uploaded at the same
+                      time. Default 4.
+                    - 'multipart_threshold': Size in bytes from which files are uploaded in
+                      parts. Default 8 MB.
+                    - 'multipart_chunksize': Size in bytes of each part. Default 8 MB.
+                    - 'skip_unchanged': Skip files already uploaded with the same content.
+                      Default True.
+        report_path: Optional path to write the size, latency and status of each file to.
+        files: Optional files or directories inside artifacts to upload. All the files in
+               artifacts are uploaded by default.
     Returns:
         A list of S3 URIs for each file that was uploaded.
     """
-    # Create an S3 client using the default credentials chain
+    max_workers = aws_config.get("max_workers", 8)
+    transfer_config = TransferConfig(
+        multipart_threshold=aws_config.get("multipart_threshold", 8 * 1024 * 1024),
+        multipart_chunksize=aws_config.get("multipart_chunksize", 8 * 1024 * 1024),
+        max_concurrency=aws_config.get("max_concurrency", 4)
+    )
+
+    # Shared S3 client, sized by configure_s3_client for all the concurrent parts
     try:
-        session = boto3.Session()
-        s3_client = session.client("s3")
+        s3_client = get_s3_client()
     except botocore.exceptions.ClientError as err:
         logger.error("Error creating S3 client. The process can't continue with the upload of " +
                      "artifacts to S3 bucket. Error: ", err)
 
-    # Get bucket name and list of existing buckets
-    bucket_name = aws_config["bucket_name"]
-    list_buckets = [bucket["Name"] for bucket in s3_client.list_buckets()["Buckets"]]
-
     # If bucket doesn't exist log error and return no files.
-    if bucket_name not in list_buckets:
+    bucket_name = aws_config["bucket_name"]
+    try:
+        s3_client.head_bucket(Bucket=bucket_name)
+    except botocore.exceptions.ClientError:
         logger.error("S3 bucket %s does not exist. Create the corresponding bucket on your AWS " +
                     "account before running the project.", bucket_name)
         return ["S3 bucket does not exist. No files uploaded."]
 
-    # Get a list of all files in the artifacts
-    files = artifacts.glob("**/*")
+    # Get a list of all files in the artifacts, skipping directories. S3 has no folders, so
+    # the structure is kept by the object keys.
+    paths = [artifacts] if files is None else files
+    files = [file_name for path in paths
+             for file_name in ([path] if path.is_file() else path.glob("**/*"))
+             if file_name.is_file()]
 
-    # Iterate through each file in the local folder
+    # Upload files concurrently
     s3_uris = []
+    report = {}
+    start = time.perf_counter()
 
-    for file_name in files:
-        # Skip directories
-        if file_name.is_dir():
-            continue
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {}
+        for file_name in files:
+            # Construct the S3 key name for the file
+            s3_key = str(Path(aws_config["prefix"]).joinpath(file_name.relative_to(artifacts)))
+            future = executor.submit(upload_file, s3_client, file_name, bucket_name, s3_key,
+                                     transfer_config, aws_config.get("skip_unchanged", True))
+            futures[future] = (file_name, s3_key)
 
-        # Construct the S3 key name for the file
-        s3_key = Path(aws_config["prefix"]).joinpath(file_name.relative_to(artifacts))
-
-        # Create the S3 bucket folders if they don't already exist to map structure
-        if s3_key.parent != Path(aws_config["prefix"]):
+        for future in as_completed(futures):
+            file_name, s3_key = futures[future]
             try:
-                s3_client.put_object(Bucket=bucket_name, Key=str(s3_key.parent) + "/")
-            except botocore.exceptions.BotoCoreError as err:
-                logger.warning("Could not create folder %s. Files in that folder will not be " +
-                               "stored. Error: %s", str(s3_key.parent), err)
-                logger.debug("Folder %s created in S3 bucket %s.", s3_key.parent, bucket_name)
+                stats = future.result()
+            except (botocore.exceptions.BotoCoreError,
+                    botocore.exceptions.ClientError,
+                    boto3.exceptions.S3UploadFailedError) as err:
+                logger.warning("Error uploading file %s to S3. The process will continue " +
+                               "without uploading this file. Error: %s", file_name, err)
+                report[str(file_name.relative_to(artifacts))] = {"status": "failed"}
+            else:
+                # Append S3 URI to list
+                s3_uris.append(f"s3://{bucket_name}/{s3_key}")
+                report[str(file_name.relative_to(artifacts))] = stats
+                logger.debug("File %s %s to S3 bucket %s in %.3f seconds.", file_name,
+                             stats["status"], bucket_name, stats["seconds"])
 
-        # Upload files
-        try:
-            # Upload file to specified S3 bucket
-            s3_client.upload_file(str(file_name), bucket_name, str(s3_key))
-        except botocore.exceptions.BotoCoreError as err:
-            logger.warning("Error uploading file %s to S3. The process will continue without " +
-                           "uploading this file. Error: %s", file_name, err)
-        else:
-            # Append S3 URI to list
-            s3_uris.append(f"s3://{bucket_name}/{s3_key}")
-            logger.debug("File %s uploaded to S3 bucket %s.", file_name, bucket_name)
+    # Throughput summary
+    elapsed = time.perf_counter() - start
+    total_bytes = sum(stats.get("bytes", 0) for stats in report.values())
+    n_skipped = sum(stats["status"] == "skipped" for stats in report.values())
+    logger.info("Uploaded %s bytes in %.2f seconds (%.2f MB/s). %s of %s files skipped as " +
+                "unchanged.", total_bytes, elapsed, total_bytes / elapsed / 1e6 if elapsed else 0,
+                n_skipped, len(files))
+
+    if report_path is not None:
+        with open(report_path, "w", encoding="utf-8") as file:
+            yaml.dump({"seconds": elapsed, "bytes": total_bytes,
+                       "bytes_per_second": total_bytes / elapsed if elapsed else 0.0,
+                       "files": report}, file)
+        logger.info("Upload report written to %s", report_path)
 
     # Function output
     return s3_uris
@@ -4,6 +4,7 @@ This module provides functions for cleaning the raw data by applying different t
 # Libraries
 import re
 import logging
+import typing
 import numpy as np
 import pandas as pd
 
@@ -11,6 +12,12 @@ import pandas as pd
 # Set logger
 logger = logging.getLogger(__name__)
 
+# Precompiled patterns for the vectorized cleaning engine
+DECIMAL_DURATION = re.compile(r'^([0-9]+)(\.[0-9]{1,2})h m')
+HOURS_DURATION = re.compile(r'^([0-9]+)h')
+MINUTES_DURATION = re.compile(r'([0-5][0-9])m')
+HOUR_OF_DAY = re.compile(r'^([0-2][0-9])\:')
+
 def get_duration(text: str) -> float:
     """
     Extracts the duration of an event in hours from a given string. The function assumes that 
@@ -102,7 +109,130 @@ def bucket_hours(time: str, hour_buckets: dict) -> str:
     return bucket
 
 
-def clean_data(raw_data: pd.DataFrame, clean_config: dict) -> pd.DataFrame:
+def factorize_column(values: pd.Series) -> tuple[np.ndarray, pd.Series]:
+    """
+    Splits a column into integer codes and its distinct values. The raw columns have a few
+    hundred distinct strings over hundreds of thousands of rows, so the vectorized functions
+    parse the distinct values once and broadcast the result back with the codes.
+
+    Args:
+        values (pd.Series): Column to factorize.
+
+    Returns:
+        np.ndarray: Position of each row's value in the distinct values.
+        pd.Series: The distinct values (missing values included).
+    """
+    codes, uniques = pd.factorize(values, use_na_sentinel=False)
+    return codes, pd.Series(uniques, dtype=object)
+
+
+def get_duration_vectorized(texts: pd.Series) -> pd.Series:
+    """
+    Column-wide version of get_duration. Extracts the duration in hours from every string in
+    the series with precompiled patterns instead of calling get_duration row by row.
+
+    Args:
+        texts (pd.Series): Series of strings like "5.30h m" or "5h 30m".
+
+    Returns:
+        pd.Series: The durations in hours, rounded to two decimal places.
+
+    Raises:
+        ValueError: If any of the strings does not contain valid duration info.
+    """
+    codes, uniques = factorize_column(texts)
+
+    # Decimal format, e.g. "5.30h m"
+    decimal = uniques.str.extract(DECIMAL_DURATION)
+    is_decimal = decimal[0].notna()
+
+    # Hours and minutes format, e.g. "5h 30m"
+    hours = uniques.str.extract(HOURS_DURATION, expand=False)
+    minutes = uniques.str.extract(MINUTES_DURATION, expand=False)
+
+    hours = hours.where(~is_decimal, decimal[0])
+    decimal_minutes = np.round(decimal[1].astype(float) * 60)
+    minutes = minutes.astype(float).where(~is_decimal, decimal_minutes)
+
+    # Same failure cases as get_duration, reported for the whole column at once
+    invalid = hours.isna() | minutes.isna()
+    if invalid.any():
+        raise ValueError(f"Invalid duration values: {uniques[invalid].tolist()[:5]}")
+
+    # Calculate duration in hours
+    duration = np.round(hours.astype(int) + minutes / 60, 2).to_numpy(dtype=float)
+
+    # Function output
+    return pd.Series(duration[codes], index=texts.index, name=texts.name)
+
+
+def get_stops_vectorized(texts: pd.Series, pattern: str, stop_dict: dict) -> pd.Series:
+    """
+    Column-wide version of get_stops. Extracts the stops information of every string in the
+    series and maps it to an integer with stop_dict.
+
+    Args:
+        texts (pd.Series): Series of strings containing the stops information.
+        pattern (str): The regular expression pattern to extract the stops information from
+                       the text.
+        stop_dict (dict): A dictionary mapping the stops information (as string) to integers.
+
+    Returns:
+        pd.Series: The number of stops. Strings without valid stops info are mapped to NA.
+    """
+    codes, uniques = factorize_column(texts)
+
+    # Wrap the pattern in a group so the whole match is extracted, as with match.group()
+    stops = uniques.str.extract(f"({pattern})", expand=True)[0]
+    n_stops = pd.Series(stops.map(stop_dict).to_numpy()[codes],
+                        index=texts.index, name=texts.name)
+
+    # Keep integer dtype when all rows matched, as Series.apply does for get_stops
+    if n_stops.notna().all():
+        n_stops = n_stops.astype(int)
+    else:
+        logger.debug("%s strings do not contain valid stops info. Returning NA",
+                     n_stops.isna().sum())
+
+    # Function output
+    return n_stops
+
+
+def bucket_hours_vectorized(times: pd.Series, hour_buckets: dict) -> pd.Series:
+    """
+    Column-wide version of bucket_hours. Maps every time in the series to its hour bucket.
+
+    Args:
+        times (pd.Series): Series of strings containing the time information.
+        hour_buckets (dict): A dictionary mapping each hour to a specific bucket.
+
+    Returns:
+        pd.Series: The name of the bucket to which the hour of each time belongs.
+
+    Raises:
+        ValueError: If any of the times does not fall into a bucket.
+    """
+    codes, uniques = factorize_column(times)
+
+    # Regex for hour of the day
+    hours = uniques.str.extract(HOUR_OF_DAY, expand=False).astype(float)
+
+    # bucket_hours keeps the last matching bucket, so conditions are checked in reverse
+    block_names = list(hour_buckets)[::-1]
+    conditions = [(hours >= hour_buckets[name]["min"]) & (hours < hour_buckets[name]["max"])
+                  for name in block_names]
+    buckets = np.select(conditions, block_names, default=None)
+
+    # Same failure cases as bucket_hours, reported for the whole column at once
+    invalid = pd.isna(buckets)
+    if invalid.any():
+        raise ValueError(f"Invalid time values: {uniques[invalid].tolist()[:5]}")
+
+    return pd.Series(buckets[codes], index=times.index, name=times.name, dtype=object)
+
+
+def clean_data(raw_data: pd.DataFrame, clean_config: dict, engine: str = "vectorized",
+               compact: bool = False, dtypes: typing.Optional[dict] = None) -> pd.DataFrame:
     """
     The function downloads a raw data file from an S3 bucket, cleans and transforms the data
     according to the provided configuration, and returns a cleaned pandas DataFrame.
@@ -123,12 +253,24 @@ def clean_data(raw_data: pd.DataFrame, clean_config: dict) -> pd.DataFrame:
                             corresponding pattern to remove and its replacement before converting
                             to integer.
             - "selected_features": A list of column names to include in the final cleaned DataFrame.
+        engine (str): "vectorized" (default) to transform whole columns at once or "scalar"
+                      to apply the row-wise functions. Both produce the same output.
+        compact (bool): If True, cast the clean data to the dtypes declared in 'dtypes', e.g.
+                        category for the text columns and smaller numeric types, to reduce
+                        its memory footprint.
+        dtypes (dict): Dtype of each column of the clean data in compact mode.
 
     Returns:
         A cleaned pandas DataFrame.
     """
-    # Create clean dataframe
-    df_clean = raw_data.copy()
+    if engine not in ("vectorized", "scalar"):
+        raise ValueError(f"Unknown cleaning engine {engine}. Use 'vectorized' or 'scalar'.")
+    vectorized = engine == "vectorized"
+    logger.debug("Cleaning raw data with the %s engine.", engine)
+
+    # Create clean dataframe. The columns are replaced, never modified in place, so a shallow
+    # copy leaves the raw data untouched without duplicating it.
+    df_clean = raw_data.copy(deep=False)
 
     # Rename columns
     df_clean.rename(columns = clean_config["rename_cols"], inplace=True)
@@ -140,8 +282,10 @@ def clean_data(raw_data: pd.DataFrame, clean_config: dict) -> pd.DataFrame:
         col1 = concat_cols["col1"]
         col2 = concat_cols["col2"]
 
-        # Create new feature by concatenating columns
-        df_clean[new_col] = raw_data[col1] + "-" + raw_data[col2].astype(concat_cols["col_type"])
+        # Create new feature by concatenating columns. Raw data read from a columnar artifact
+        # has categorical text columns, which do not support concatenation.
+        df_clean[new_col] = raw_data[col1].astype(str) + "-" + \
+                            raw_data[col2].astype(concat_cols["col_type"])
 
         # debug info
         logger.debug("New column %s created conatenating columns %s and %s", new_col, col1, col2)
@@ -149,22 +293,33 @@ def clean_data(raw_data: pd.DataFrame, clean_config: dict) -> pd.DataFrame:
 
     # Bucket time
     for new_col, bucket_col in clean_config["bucket_time_cols"].items():
-        df_clean[new_col] = raw_data[bucket_col]\
-                            .apply(lambda x: bucket_hours(x, clean_config["bucket_hours"]))
+        if vectorized:
+            df_clean[new_col] = bucket_hours_vectorized(raw_data[bucket_col],
+                                                        clean_config["bucket_hours"])
+        else:
+            df_clean[new_col] = raw_data[bucket_col]\
+                                .apply(lambda x: bucket_hours(x, clean_config["bucket_hours"]))
         # debug info
         logger.debug("New column %s created bucketing column %s", new_col, bucket_col)
 
 
     # Convert time take to hours
     for new_col, time_col in clean_config["time_to_hours"].items():
-        df_clean[new_col] = raw_data[time_col].apply(lambda x: get_duration(x))
+        if vectorized:
+            df_clean[new_col] = get_duration_vectorized(raw_data[time_col])
+        else:
+            df_clean[new_col] = raw_data[time_col].apply(lambda x: get_duration(x))
         logger.debug("New column %s created converting column %s to hours.", new_col, time_col)
 
 
     # Get number of stops
     for new_col, stop_col in clean_config["stops_cols"].items():
-        df_clean[new_col] = raw_data[stop_col]\
-                            .apply(lambda x: get_stops(x, **clean_config["get_stops"]))
+        if vectorized:
+            df_clean[new_col] = get_stops_vectorized(raw_data[stop_col],
+                                                     **clean_config["get_stops"])
+        else:
+            df_clean[new_col] = raw_data[stop_col]\
+                                .apply(lambda x: get_stops(x, **clean_config["get_stops"]))
         logger.debug("New column %s created from column %s", new_col, stop_col)
 
 
@@ -178,8 +333,29 @@ def clean_data(raw_data: pd.DataFrame, clean_config: dict) -> pd.DataFrame:
 
     # Select features
     df_clean = df_clean[clean_config["selected_features"]]
+
+    # Compact schema
+    if compact:
+        df_clean = compact_schema(df_clean, dtypes or {})
     logger.info("Clean data created succeesfully.")
     logger.debug("Clean data shape: %s", df_clean.shape)
 
     # Function output
     return df_clean
+
+
+def compact_schema(data: pd.DataFrame, dtypes: dict) -> pd.DataFrame:
+    """
+    Casts the columns of a dataframe to the declared dtypes. Columns without a declared dtype
+    are kept as they are, without copying them.
+
+    Args:
+        data (pd.DataFrame): Dataframe to cast.
+        dtypes (dict): Dtype of each column, e.g. category, int8 or float32.
+
+    Returns:
+        pd.DataFrame: The dataframe with the declared dtypes.
+    """
+    dtypes = {column: dtype for column, dtype in dtypes.items() if column in data.columns}
+    logger.debug("Casting columns to compact dtypes: %s", dtypes)
+    return data.astype(dtypes, copy=False)
@@ -0,0 +1,226 @@
+"""
+This module provides a small executor for the pipeline stages declared as a directed
+acyclic graph. Each stage names the values it reads and writes, and stages whose inputs are
+ready run concurrently in a pool of threads, e.g. saving the data sets while the models
+train. A run can start or stop at any stage, reading the outputs of the earlier stages from
+a previous run.
+"""
+# Libraries
+import logging
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Set
+
+import yaml
+
+import src.profiling as profiling
+import src.stage_cache as sc
+
+
+# Set logger
+logger = logging.getLogger(__name__)
+
+@dataclass
+class Stage:
+    """
+    A node of the pipeline graph.
+
+    Args:
+        name (str): Name of the stage, used by --from-stage and --until-stage.
+        func (Callable): Function called with the inputs as keyword arguments. Returns a
+                         dictionary with the outputs, or None if the stage has no outputs.
+        inputs (list[str]): Names of the values read by the stage.
+        outputs (list[str]): Names of the values written by the stage.
+        files (list[str]): Artifacts written by the stage in the run directory.
+        load (Callable): Optional function reading the outputs of the stage from the
+                         directory of a previous run.
+    """
+    name: str
+    func: Callable[..., Optional[dict]]
+    inputs: List[str] = field(default_factory=list)
+    outputs: List[str] = field(default_factory=list)
+    files: List[str] = field(default_factory=list)
+    load: Optional[Callable[[Path], dict]] = None
+
+
+def get_dependencies(stages: List[Stage]) -> Dict[str, Set[str]]:
+    """
+    Finds the stages each stage depends on, from the values they read and write.
+
+    Args:
+        stages (list[Stage]): Stages of the pipeline.
+
+    Returns:
+        dict: Names of the stages producing the inputs of each stage.
+
+    Raises:
+        ValueError: If two stages write the same value, a value is read but never written, or
+                    the stages have a cycle.
+    """
+    producers = {}
+    for stage in stages:
+        for output in stage.outputs:
+            if output in producers:
+                raise ValueError(f"Value {output} is written by stages {producers[output]} "
+                                 f"and {stage.name}.")
+            producers[output] = stage.name
+
+    dependencies = {}
+    for stage in stages:
+        missing = [value for value in stage.inputs if value not in producers]
+        if missing:
+            raise ValueError(f"Stage {stage.name} reads values {missing} that no stage writes.")
+        dependencies[stage.name] = {producers[value] for value in stage.inputs}
+
+    # Check the graph is acyclic by removing stages without pending dependencies
+    pending = {name: set(parents) for name, parents in dependencies.items()}
+    while pending:
+        ready = [name for name, parents in pending.items() if not parents]
+        if not ready:
+            raise ValueError(f"The stages {sorted(pending)} have a cyclic dependency.")
+        for name in ready:
+            del pending[name]
+        for parents in pending.values():
+            parents.difference_update(ready)
+
+    return dependencies
+
+
+def get_ancestors(dependencies: Dict[str, Set[str]], names: Set[str]) -> Set[str]:
+    """Returns the stages the given stages depend on, directly or not."""
+    ancestors, queue = set(), list(names)
+    while queue:
+        for parent in dependencies[queue.pop()]:
+            if parent not in ancestors:
+                ancestors.add(parent)
+                queue.append(parent)
+    return ancestors
+
+
+def select_stages(stages: List[Stage], from_stage: Optional[str] = None,
+                  until_stage: Optional[str] = None) -> Dict[str, str]:
+    """
+    Selects the stages to run for the requested range.
+
+    Args:
+        stages (list[Stage]): Stages of the pipeline.
+        from_stage (str): Optional first stage. Only this stage and the stages depending on
+                          it run.
+        until_stage (str): Optional last stage. Only this stage and the stages it depends on
+                           run.
+
+    Returns:
+        dict: The action for each selected stage: "run", "load" for the stages whose outputs
+              are read by a stage that runs, or "link" for the earlier stages, whose
+              artifacts are only linked into the run directory.
+    """
+    names = {stage.name for stage in stages}
+    for name in (from_stage, until_stage):
+        if name is not None and name not in names:
+            raise ValueError(f"Unknown stage {name}. Stages are: {sorted(names)}.")
+
+    dependencies = get_dependencies(stages)
+    selected = names
+    if until_stage is not None:
+        selected = get_ancestors(dependencies, {until_stage}) | {until_stage}
+
+    to_run = selected
+    if from_stage is not None:
+        descendants = {name for name in names
+                       if from_stage in get_ancestors(dependencies, {name})}
+        to_run = selected & (descendants | {from_stage})
+
+    actions = {name: "run" for name in to_run}
+    for name in get_ancestors(dependencies, to_run) - to_run:
+        actions[name] = "link"
+    for name in to_run:
+        for parent in dependencies[name] - to_run:
+            actions[parent] = "load"
+    return actions
+
+
+def run_dag(stages: List[Stage], run_dir: Path, max_workers: int = 4,
+            from_stage: Optional[str] = None, until_stage: Optional[str] = None,
+            previous_run: Optional[Path] = None,
+            timings_path: Optional[Path] = None) -> dict:
+    """
+    Runs the stages of the pipeline, each one as soon as the stages it depends on finish.
+
+    Args:
+        stages (list[Stage]): Stages of the pipeline.
+        run_dir (Path): Directory of the current run.
+        max_workers (int): Maximum number of stages running at the same time.
+        from_stage (str): Optional first stage to run.
+        until_stage (str): Optional last stage to run.
+        previous_run (Path): Directory of the run to read the outputs of the stages before
+                             from_stage from. Required with from_stage.
+        timings_path (Path): Optional path to save the start time, wall time and action of
+                             each stage to.
+
+    Returns:
+        dict: All the values written by the stages.
+    """
+    actions = select_stages(stages, from_stage, until_stage)
+    if from_stage is not None and previous_run is None:
+        raise ValueError("A previous run is required to start from a later stage.")
+
+    dependencies = get_dependencies(stages)
+    by_name = {stage.name: stage for stage in stages}
+    pending = {name: dependencies[name] & set(actions) if action == "run" else set()
+               for name, action in actions.items()}
+    values, timings, finished = {}, {}, set()
+    start = time.perf_counter()
+
+    def execute(stage: Stage, action: str) -> dict:
+        """Runs a stage, or reads its outputs from the previous run"""
+        stage_start = time.perf_counter()
+        if action == "run":
+            inputs = {value: values[value] for value in stage.inputs}
+            with profiling.track(stage.name, profile=True) as record:
+                outputs = stage.func(**inputs) or {}
+                record["rows"] = profiling.count_rows(*inputs.values()) \
+                    or profiling.count_rows(*outputs.values())
+        else:
+            for file_name in stage.files:
+                if (previous_run / file_name).exists():
+                    sc.copy_output(previous_run / file_name, run_dir / file_name)
+            outputs = {}
+            if action == "load":
+                outputs = stage.load(previous_run) if stage.load is not None else {}
+            outputs = {output: outputs.get(output) for output in stage.outputs}
+        timings[stage.name] = {"action": action, "start": stage_start - start,
+                               "seconds": time.perf_counter() - stage_start}
+        logger.info("Stage %s %s in %.2f seconds.", stage.name,
+                    "finished" if action == "run" else f"{action}ed from {previous_run}",
+                    timings[stage.name]["seconds"])
+        return outputs
+
+    try:
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            futures = {}
+            while pending or futures:
+                # Submit the stages whose dependencies finished
+                for name in [name for name, parents in pending.items() if parents <= finished]:
+                    del pending[name]
+                    futures[executor.submit(execute, by_name[name], actions[name])] = name
+
+                done, _ = wait(futures, return_when=FIRST_COMPLETED)
+                for future in done:
+                    name = futures.pop(future)
+                    try:
+                        values.update(future.result())
+                    except Exception:
+                        logger.error("Stage %s failed. Waiting for the running stages.", name)
+                        for other in futures:
+                            other.cancel()
+                        raise
+                    finished.add(name)
+    finally:
+        if timings_path is not None:
+            with open(timings_path, "w", encoding="utf-8") as file:
+                yaml.dump({"seconds": time.perf_counter() - start, "stages": timings}, file)
+            logger.info("Stage timings saved to %s", timings_path)
+
+    return values
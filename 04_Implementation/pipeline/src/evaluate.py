@@ -0,0 +1,264 @@
+"""
+This module provides functions for evaluating the trained models on the test set, overall
+and by slice of the data (airline, class, route, stops), on the log scale the models are
+trained on and on the rupee scale of the prices. The errors are summarized into sums that can
+be merged, so the test set is scored in chunks and the summaries of several chunks or
+processes add up to the metrics of the whole set.
+"""
+# Libraries
+import logging
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+import yaml
+
+
+# Set logger
+logger = logging.getLogger(__name__)
+
+# Statistics summarized for each scale: the mean and sum of squared deviations of the target
+# (for R2), and the sums of squared and absolute errors
+STATISTICS = ("mean", "m2", "sse", "sae")
+
+def summarize_errors(y_true: pd.DataFrame, y_pred: pd.DataFrame,
+                     keys: Optional[List[pd.Series]] = None) -> pd.DataFrame:
+    """
+    Summarizes the errors of a set of predictions, by group of the keys.
+
+    Args:
+        y_true (pd.DataFrame): Target on each scale, one column per scale.
+        y_pred (pd.DataFrame): Predictions on each scale, with the same columns and index.
+        keys (list[pd.Series]): Columns defining the groups. All the rows are one group if
+                                None.
+
+    Returns:
+        pd.DataFrame: Number of rows and statistics of each scale ("<scale>_<statistic>")
+                      of each group, indexed by the keys.
+    """
+    keys = keys if keys is not None else [pd.Series(0, index=y_true.index, name="all")]
+    errors = y_true - y_pred
+    grouped_true = y_true.groupby(keys, sort=False, observed=True)
+    means = grouped_true.transform("mean")
+
+    # One groupby per statistic over all the scales at once
+    summary = pd.concat({
+        "mean": grouped_true.mean(),
+        "m2": ((y_true - means) ** 2).groupby(keys, sort=False, observed=True).sum(),
+        "sse": (errors ** 2).groupby(keys, sort=False, observed=True).sum(),
+        "sae": errors.abs().groupby(keys, sort=False, observed=True).sum(),
+    }, axis=1)
+    summary.columns = [f"{scale}_{statistic}" for statistic, scale in summary.columns]
+    summary.insert(0, "count", grouped_true.size())
+    return summary
+
+
+def merge_summaries(left: Optional[pd.DataFrame],
+                    right: Optional[pd.DataFrame]) -> Optional[pd.DataFrame]:
+    """
+    Merges the summaries of two disjoint sets of rows into the summary of their union. Means
+    and sums of squared deviations are combined with the parallel algorithm of Chan et al.,
+    so no group needs to be seen again.
+
+    Args:
+        left (pd.DataFrame): Summary from summarize_errors, or None.
+        right (pd.DataFrame): Summary from summarize_errors, or None.
+
+    Returns:
+        pd.DataFrame: Summary of the rows of both.
+    """
+    if left is None or right is None:
+        return right if left is None else left
+
+    index = left.index.append(right.index).unique()
+    left = left.reindex(index, fill_value=0)
+    right = right.reindex(index, fill_value=0)
+    merged = left + right
+    for scale in [column[:-len("_mean")] for column in left if column.endswith("_mean")]:
+        delta = right[f"{scale}_mean"] - left[f"{scale}_mean"]
+        merged[f"{scale}_mean"] = left[f"{scale}_mean"] + delta * right["count"] / \
+                                  merged["count"]
+        merged[f"{scale}_m2"] += delta ** 2 * left["count"] * right["count"] / merged["count"]
+    return merged
+
+
+def summary_metrics(summary: pd.DataFrame) -> pd.DataFrame:
+    """
+    Computes the MSE, MAE, RMSE and R2 of each scale from a summary of the errors.
+
+    Args:
+        summary (pd.DataFrame): Summary from summarize_errors or merge_summaries.
+
+    Returns:
+        pd.DataFrame: Number of rows and metrics of each scale ("<scale>_<metric>") of each
+                      group. R2 is missing for groups where the target is constant.
+    """
+    metrics = pd.DataFrame({"count": summary["count"]}, index=summary.index)
+    for scale in [column[:-len("_mean")] for column in summary if column.endswith("_mean")]:
+        metrics[f"{scale}_MSE"] = summary[f"{scale}_sse"] / summary["count"]
+        metrics[f"{scale}_MAE"] = summary[f"{scale}_sae"] / summary["count"]
+        metrics[f"{scale}_RMSE"] = np.sqrt(metrics[f"{scale}_MSE"])
+        metrics[f"{scale}_R2"] = 1 - summary[f"{scale}_sse"] / \
+                                 summary[f"{scale}_m2"].where(summary[f"{scale}_m2"] > 0)
+    return metrics
+
+
+class ErrorAccumulator:
+    """
+    Summaries of the errors of a model, overall and by slice, updated one chunk of the test
+    set at a time.
+
+    Args:
+        slices (dict): Columns of each slice, e.g. {"route": ["origin", "destination"]}.
+        log_target (bool): Whether the target is the log of the price, in which case the
+                           errors are also summarized on the rupee scale.
+        target (str): Name of the target column.
+    """
+
+    def __init__(self, slices: Dict[str, List[str]] = None, log_target: bool = True,
+                 target: str = "price"):
+        self.slices = slices or {}
+        self.log_target = log_target
+        self.target = target
+        self.overall: Optional[pd.DataFrame] = None
+        self.by_slice: Dict[str, Optional[pd.DataFrame]] = {name: None for name in self.slices}
+
+    def scales(self, values) -> pd.DataFrame:
+        """Values of the target on each scale"""
+        values = np.asarray(values, dtype=float)
+        if self.log_target:
+            return pd.DataFrame({"log": values, "rupee": np.exp(values)})
+        return pd.DataFrame({"rupee": values})
+
+    def update(self, data: pd.DataFrame, y_pred) -> "ErrorAccumulator":
+        """
+        Adds the errors of the predictions of a chunk.
+
+        Args:
+            data (pd.DataFrame): Chunk of the test set, with the target and slice columns.
+            y_pred (array-like): Predictions of the model for the chunk.
+
+        Returns:
+            ErrorAccumulator: The accumulator.
+        """
+        y_true, y_pred = self.scales(data[self.target]), self.scales(y_pred)
+        self.overall = merge_summaries(self.overall, summarize_errors(y_true, y_pred))
+        for name, columns in self.slices.items():
+            keys = [data[column].reset_index(drop=True) for column in columns]
+            self.by_slice[name] = merge_summaries(self.by_slice[name],
+                                                  summarize_errors(y_true, y_pred, keys))
+        return self
+
+    def merge(self, other: "ErrorAccumulator") -> "ErrorAccumulator":
+        """Adds the errors summarized by another accumulator, e.g. of another process."""
+        self.overall = merge_summaries(self.overall, other.overall)
+        for name in self.slices:
+            self.by_slice[name] = merge_summaries(self.by_slice[name], other.by_slice[name])
+        return self
+
+    def metrics(self) -> dict:
+        """
+        Returns:
+            dict: Number of rows and metrics of each scale over all the rows, e.g.
+                  {"count": 100, "log": {"RMSE": ...}, "rupee": {"RMSE": ...}}.
+        """
+        if self.overall is None:
+            return {"count": 0}
+        metrics = summary_metrics(self.overall).iloc[0]
+        scales = [column[:-len("_RMSE")] for column in metrics.index
+                  if column.endswith("_RMSE")]
+        return {"count": int(metrics["count"]),
+                **{scale: {metric: float(metrics[f"{scale}_{metric}"])
+                           for metric in ("MSE", "MAE", "RMSE", "R2")}
+                   for scale in scales}}
+
+    def slice_metrics(self) -> pd.DataFrame:
+        """
+        Returns:
+            pd.DataFrame: Number of rows and metrics of each scale of each value of each
+                          slice, with the slice name and its value. Values of slices of
+                          several columns are joined by " / ".
+        """
+        frames = []
+        for name, summary in self.by_slice.items():
+            if summary is None:
+                continue
+            metrics = summary_metrics(summary)
+            values = [" / ".join(map(str, key)) if isinstance(key, tuple) else str(key)
+                      for key in metrics.index]
+            frames.append(metrics.reset_index(drop=True)
+                          .assign(slice=name, value=values)
+                          .sort_values("count", ascending=False, kind="stable"))
+        if not frames:
+            return pd.DataFrame(columns=["slice", "value", "count"])
+        metrics = pd.concat(frames, ignore_index=True)
+        return metrics[["slice", "value"] +
+                       [column for column in metrics if column not in ("slice", "value")]]
+
+
+def evaluate_models(models: dict, test: pd.DataFrame, config: dict,
+                    log_target: bool = True) -> Tuple[dict, pd.DataFrame]:
+    """
+    Scores each model on the test set in chunks and summarizes its errors.
+
+    Args:
+        models (dict): Trained models by name.
+        test (pd.DataFrame): Test set with the target "price".
+        config (dict): Configuration of the evaluation:
+            - "chunk_size": Maximum number of rows scored at once. Default 100000.
+            - "slices": Columns of each slice. Slices with missing columns are skipped.
+        log_target (bool): Whether the target is the log of the price.
+
+    Returns:
+        dict: Metrics of each model over the test set.
+        pd.DataFrame: Metrics of each model on each value of each slice.
+    """
+    chunk_size = config.get("chunk_size", 100000)
+    slices = {}
+    for name, columns in config.get("slices", {}).items():
+        missing = [column for column in columns if column not in test]
+        if missing:
+            logger.warning("Slice %s skipped: columns %s not in the test set.", name, missing)
+        else:
+            slices[name] = columns
+
+    # Each chunk is scored by all the models before the next one is read
+    accumulators = {name: ErrorAccumulator(slices, log_target) for name in models}
+    for start in range(0, len(test), chunk_size):
+        chunk = test.iloc[start:start + chunk_size]
+        features = chunk.drop("price", axis=1)
+        for name, model in models.items():
+            accumulators[name].update(chunk, model.predict(features))
+
+    results = {name: accumulator.metrics() for name, accumulator in accumulators.items()}
+    slice_metrics = pd.concat([accumulator.slice_metrics().assign(model=name)
+                               for name, accumulator in accumulators.items()],
+                              ignore_index=True)
+    slice_metrics = slice_metrics[["model"] + [column for column in slice_metrics
+                                               if column != "model"]]
+    for name, metrics in results.items():
+        logger.info("Model %s evaluated on %s rows: %s", name, metrics["count"],
+                    {scale: round(values["RMSE"], 4) for scale, values in metrics.items()
+                     if isinstance(values, dict)})
+    return results, slice_metrics
+
+
+def save_evaluation(results: dict, slice_metrics: pd.DataFrame, results_path: Path,
+                    slices_path: Path) -> None:
+    """
+    Saves the evaluation of the models.
+
+    Args:
+        results (dict): Metrics of each model from evaluate_models.
+        slice_metrics (pd.DataFrame): Metrics by slice from evaluate_models.
+        results_path (Path): Path to save the metrics (yaml).
+        slices_path (Path): Path to save the metrics by slice (csv).
+
+    Returns:
+        None
+    """
+    with open(results_path, "w", encoding="utf-8") as file:
+        yaml.dump(results, file)
+    slice_metrics.to_csv(slices_path, index=False)
+    logger.info("Evaluation saved to %s and %s", results_path, slices_path)
@@ -3,24 +3,34 @@ This module provides functions for generating features from the cleaned data set
 """
 # Libraries
 import logging
+import typing
 import numpy as np
 import pandas as pd
 
 logger = logging.getLogger(__name__)
 
-def generate_features(clean_data: pd.DataFrame, feature_config: dict) -> pd.DataFrame:
+def generate_features(clean_data: pd.DataFrame, feature_config: dict,
+                      flight_counts: typing.Optional[pd.Series] = None,
+                      rare_counts: typing.Optional[typing.List[pd.Series]] = None
+                      ) -> pd.DataFrame:
     """
     This function generates features from the cleaned data set by calling sub-functions.
 
     Args:
         clean_data: Cleaned data set
         feature_config: Configuration dictionary for feature generation
+        flight_counts: Optional number of flights per airline over the whole data set, used
+                       when clean_data is only a chunk of it
+        rare_counts: Optional number of flights of each key of the 'filter_rare' rules over
+                     the whole data set, in the order of the rules
 
     Returns:
         features: Data set with generated features
     """
 
-    features: pd.DataFrame = clean_data.copy()
+    # Shallow copy: columns are replaced, never modified in place, so the clean data is not
+    # changed and its columns are not duplicated
+    features: pd.DataFrame = clean_data.copy(deep=False)
 
     # Drop specified columns
     try:
@@ -32,14 +42,24 @@ def generate_features(clean_data: pd.DataFrame, feature_config: dict) -> pd.Data
         logger.info("Dropped columns: %s",
                     feature_config.get('drop_columns', []))
 
-    # Drop airlines with less than 'min_flights' flights
+    # Drop airlines with less than 'min_flights' flights, and the rare keys of the
+    # 'filter_rare' rules. All the keys are counted before any row is dropped, so the result
+    # does not depend on the order of the rules and matches the streaming mode.
+    rules = feature_config.get('filter_rare', [])
     try:
-        features = filter_airlines(features, feature_config.get('filter_airlines', 1000))
+        keep = rare_mask(features, ['airline'], feature_config.get('filter_airlines', 1000),
+                         flight_counts)
+        for rule, counts in zip(rules, rare_counts or [None] * len(rules)):
+            keep &= rare_mask(features, rule['keys'], rule['min_count'], counts)
+        features = features[keep]
     except KeyError:
         logger.error("Error while filtering airlines")
     else:
         logger.info("Filtered airlines with less than %s flights",
                     feature_config.get('filter_airlines', 1000))
+        for rule in rules:
+            logger.info("Filtered %s with less than %s flights", rule['keys'],
+                        rule['min_count'])
 
     # Log transform specified columns
     try:
@@ -60,14 +80,45 @@ def drop_columns(data: pd.DataFrame, columns: list) -> pd.DataFrame:
     """Drop specified columns from the DataFrame."""
     return data.drop(columns, axis=1)
 
-def filter_airlines(data: pd.DataFrame, min_flights: int) -> pd.DataFrame:
-    """Drop airlines with less than 'min_flights' flights."""
+def filter_airlines(data: pd.DataFrame, min_flights: int,
+                    flight_counts: typing.Optional[pd.Series] = None) -> pd.DataFrame:
+    """
+    Drop airlines with less than 'min_flights' flights. If given, 'flight_counts' holds the
+    number of flights per airline to use instead of counting the rows in 'data'.
+    """
+    return data[rare_mask(data, ['airline'], min_flights, flight_counts)]
+
+def rare_mask(data: pd.DataFrame, keys: typing.List[str], min_count: int,
+              counts: typing.Optional[pd.Series] = None) -> np.ndarray:
+    """
+    Flag the rows whose key, e.g. an airline, flight code or route, has more than 'min_count'
+    flights. The counts are looked up once per row instead of splitting the data by key.
+
+    Args:
+        data: Data set to filter
+        keys: Columns defining the key
+        min_count: Number of flights a key needs to exceed to be kept
+        counts: Optional number of flights per key, as returned by count_keys, to use instead
+                of counting the rows in 'data'
+
+    Returns:
+        np.ndarray: Boolean mask of the rows to keep
+    """
+    if counts is None:
+        counts = count_keys(data, keys)
+    index = pd.Index(data[keys[0]]) if len(keys) == 1 else pd.MultiIndex.from_frame(data[keys])
+    n_flights = counts.reindex(index).fillna(0).to_numpy()
     try:
-        dataframe = data.groupby('airline').filter(lambda x: len(x) > min_flights)
+        return n_flights > min_count
     except TypeError:
-        logger.error("The 'min_flights' argument must be an integer")
+        logger.error("The 'min_count' argument must be an integer")
         raise
-    return dataframe
+
+def count_keys(data: pd.DataFrame, keys: typing.List[str]) -> pd.Series:
+    """Count the flights of each key, leaving out keys with missing values."""
+    if len(keys) == 1:
+        return data[keys[0]].value_counts(sort=False)
+    return data.groupby(keys, sort=False, observed=True).size()
 
 def log_transform(data: pd.DataFrame, columns: list) -> pd.DataFrame:
     """Apply log transformation to specified columns."""
@@ -0,0 +1,315 @@
+"""
+This module provides functions for running the pipeline incrementally when new raw files
+are added to the source. Each raw file is fingerprinted by its S3 ETag, and the raw and
+clean data of files that did not change are read from a local cache instead of S3. The
+models of the previous run keep training on the rows of the new files only, where the model
+supports it. The cached clean data and the training state also record a hash of the
+clean_data and generate_features settings and code, so changing them rebuilds the data and
+retrains the models.
+"""
+# Libraries
+import logging
+from pathlib import Path
+from typing import Optional, Tuple
+
+import joblib
+import numpy as np
+import pandas as pd
+from scipy import sparse
+from sklearn.ensemble import RandomForestRegressor
+from sklearn.linear_model import LinearRegression
+from sklearn.model_selection import train_test_split
+from sklearn.pipeline import Pipeline
+from xgboost import XGBRegressor
+
+import src.aws_utils as aws
+import src.raw_data as rd
+import src.clean_data as cd
+import src.generate_features as gf
+import src.stage_cache as sc
+import src.train_model as tm
+
+
+# Set logger
+logger = logging.getLogger(__name__)
+
+# Settings of train_model that do not change the trained models
+IGNORED_TRAINING_KEYS = ("export", "parallel", "streaming")
+
+def data_fingerprint(clean_config: dict, feature_config: dict) -> dict:
+    """
+    Hashes the settings and code of the clean_data and generate_features stages, which
+    define how the rows the models train on are built.
+
+    Args:
+        clean_config (dict): Keyword arguments for clean_data.clean_data.
+        feature_config (dict): Configuration for generate_features.generate_features.
+
+    Returns:
+        dict: Hash of each stage.
+    """
+    return {"clean_data": sc.stage_key("clean_data", clean_config,
+                                       [sc.code_fingerprint(cd)]),
+            "generate_features": sc.stage_key("generate_features", feature_config,
+                                              [sc.code_fingerprint(gf)])}
+
+
+def load_datasets(bucket_name: str, raw_config: dict, clean_config: dict,
+                  cache_dir: Path) -> Tuple[pd.DataFrame, pd.DataFrame, pd.Series, dict]:
+    """
+    Builds the raw and clean data sets, downloading only the raw files that are not in the
+    cache with the same fingerprint, and cleaning only the files whose clean data is not in
+    the cache with the same clean_data settings and code.
+
+    Args:
+        bucket_name (str): The name of the S3 bucket.
+        raw_config (dict): Configuration for the raw data. Should have the key "file_keys",
+                           and optionally "max_workers" and "part_size".
+        clean_config (dict): Keyword arguments for clean_data.clean_data.
+        cache_dir (Path): Directory of the cache.
+
+    Returns:
+        pd.DataFrame: The raw data set.
+        pd.DataFrame: The clean data set, with a new index.
+        pd.Series: The raw file of each row of the clean data set, with the same index.
+        dict: The fingerprint of each raw file.
+    """
+    file_keys = raw_config["file_keys"]
+    max_workers = raw_config.get("max_workers", 8)
+    fingerprints = aws.get_etags(bucket_name, file_keys, max_workers)
+
+    files_dir = cache_dir / "files"
+    files_dir.mkdir(parents=True, exist_ok=True)
+    cache_paths = {key: files_dir / f"{key.replace('/', '_')}-{fingerprints[key]}"
+                   for key in file_keys}
+    # The clean data of a file is cached by the clean_data settings and code
+    clean_key = sc.stage_key("clean_data", clean_config, [sc.code_fingerprint(cd)])
+    clean_name = f"clean_data-{clean_key[:16]}.parquet"
+
+    # Download the new or changed files
+    changed = [key for key in file_keys
+               if not (cache_paths[key] / "raw_data.parquet").exists()]
+    logger.info("%s of %s raw files are new or changed: %s", len(changed), len(file_keys),
+                changed)
+    raw_frames = {}
+    if changed:
+        raw_frames = rd.read_raw_files(bucket_name, changed, max_workers,
+                                       raw_config.get("part_size", 8 * 1024 * 1024))
+        for key, raw_frame in raw_frames.items():
+            # Older versions of the file are no longer needed
+            for old_path in files_dir.glob(f"{key.replace('/', '_')}-*"):
+                for part in old_path.iterdir():
+                    part.unlink()
+                old_path.rmdir()
+
+            cache_paths[key].mkdir()
+            rd.save_dataset(raw_frame, cache_paths[key] / "raw_data.parquet")
+
+    # Clean the files without clean data for the current settings
+    for key in file_keys:
+        if (cache_paths[key] / clean_name).exists():
+            continue
+        raw_frame = raw_frames[key] if key in raw_frames else \
+                    load_cached(cache_paths[key] / "raw_data.parquet")
+        for old_path in cache_paths[key].glob("clean_data*.parquet"):
+            old_path.unlink()
+        rd.save_dataset(cd.clean_data(raw_frame, **clean_config), cache_paths[key] / clean_name)
+        logger.info("Raw file %s cleaned with the current clean_data settings.", key)
+
+    raw_frames, clean_frames = [], []
+    for key in file_keys:
+        raw_frames.append(load_cached(cache_paths[key] / "raw_data.parquet"))
+        clean_frames.append(load_cached(cache_paths[key] / clean_name))
+
+    raw_data = pd.concat(raw_frames)
+    clean_data = pd.concat(clean_frames, ignore_index=True)
+    sources = pd.Series(np.repeat(file_keys, [len(frame) for frame in clean_frames]),
+                        index=clean_data.index, name="file_key")
+
+    logger.info("Raw and clean data sets built from %s cached files.",
+                len(file_keys) - len(changed))
+    return raw_data, clean_data, sources, fingerprints
+
+
+def load_cached(load_path: Path) -> pd.DataFrame:
+    """Loads a cached data set, restoring its text columns to object dtype."""
+    data = rd.load_dataset(load_path)
+    return data.astype({col: object for col in data.select_dtypes("category")})
+
+
+def train_incremental(features: pd.DataFrame, sources: pd.Series, train_config: dict,
+                      incremental_config: dict, fingerprints: dict,
+                      tuning_path: Optional[Path] = None,
+                      data_settings: Optional[dict] = None
+                      ) -> Tuple[pd.DataFrame, pd.DataFrame, dict, dict]:
+    """
+    Trains and evaluates models, continuing the training of the previous run on the rows of
+    the new raw files when possible.
+
+    The models are retrained from scratch when there is no previous run, when a file of the
+    previous run changed or was removed, or when the training configuration or the way the
+    features are built changed. Otherwise
+    the rows of the new files are split in training and test sets, the models keep training on
+    the new training rows and are evaluated on the test rows of all the files. The fitted
+    preprocessor of the previous run is kept, so categories that only appear in the new files
+    are ignored.
+
+    Args:
+        features (pd.DataFrame): Data set with features.
+        sources (pd.Series): The raw file of each row of the clean data set.
+        train_config (dict): Configuration dictionary for training and evaluation.
+        incremental_config (dict): Configuration for incremental runs. Should have the key
+            "cache_dir", and optionally:
+            - "xgboost_rounds": Boosting rounds added to XGBoost models. Default 100.
+            - "random_forest_trees": Trees added to random forests. Default 50.
+        fingerprints (dict): The fingerprint of each raw file.
+        tuning_path (Path): Optional path to save the trials of the hyperparameter search.
+        data_settings (dict): Hashes of the clean_data and generate_features settings and
+                              code, from data_fingerprint.
+
+    Returns:
+        pd.DataFrame: Training set.
+        pd.DataFrame: Test set.
+        dict: Evaluation results.
+        dict: Trained models.
+    """
+    state_path = Path(incremental_config["cache_dir"]) / "training" / "state.joblib"
+    state = joblib.load(state_path) if state_path.exists() else None
+    training_settings = {key: value for key, value in train_config.items()
+                         if key not in IGNORED_TRAINING_KEYS}
+    training_settings["data"] = data_settings or {}
+
+    if state is None:
+        reason = "no previous run"
+    elif state["settings"] != training_settings:
+        reason = "training configuration changed"
+    elif any(fingerprints.get(key) != etag for key, etag in state["fingerprints"].items()):
+        reason = "files of the previous run changed"
+    else:
+        reason = None
+
+    if reason is not None:
+        logger.info("Training models from scratch: %s.", reason)
+        train, test, results, trained_models = tm.train_and_evaluate(features, train_config,
+                                                                     tuning_path)
+        statistics = {name: normal_equations(*preprocess(model, train))
+                      for name, model in trained_models.items()
+                      if isinstance(model.named_steps['model'], LinearRegression)}
+    else:
+        new_files = [key for key in fingerprints if key not in state["fingerprints"]]
+        new_rows = features[sources.loc[features.index].isin(new_files).to_numpy()]
+        train, test = state["train"], state["test"]
+        trained_models, statistics = state["models"], state["statistics"]
+
+        if new_rows.empty:
+            logger.info("No new rows since the previous run. Models are not retrained.")
+            results = state["results"]
+        else:
+            # Split the new rows as the rows of the previous run were split
+            split_config = train_config.get('train_test_split', {})
+            new_train, new_test = train_test_split(
+                new_rows, test_size=split_config.get("test_size", 0.2),
+                random_state=split_config.get("random_state", 42))
+            logger.info("Continuing training on %s rows of new files %s.", len(new_train),
+                        new_files)
+
+            for name, model in trained_models.items():
+                statistics[name] = continue_training(model, new_train, statistics.get(name),
+                                                     incremental_config)
+
+            train = pd.concat([train, new_train])
+            test = pd.concat([test, new_test])
+            results = {name: tm.calculate_metrics(test['price'],
+                                                  model.predict(test.drop('price', axis=1)))
+                       for name, model in trained_models.items()}
+
+    state_path.parent.mkdir(parents=True, exist_ok=True)
+    joblib.dump({"fingerprints": fingerprints, "settings": training_settings,
+                 "train": train, "test": test, "results": results,
+                 "models": trained_models, "statistics": statistics}, state_path, compress=3)
+    logger.debug("Training state saved to %s", state_path)
+
+    return train, test, results, trained_models
+
+
+def preprocess(model: Pipeline, data: pd.DataFrame) -> Tuple[np.ndarray, np.ndarray]:
+    """Transforms a data set with the fitted preprocessor of a model."""
+    x_processed = model.named_steps['preprocessor'].transform(data.drop('price', axis=1))
+    return x_processed, data['price'].to_numpy()
+
+
+def continue_training(model: Pipeline, new_train: pd.DataFrame,
+                      statistics: Optional[dict], incremental_config: dict) -> Optional[dict]:
+    """
+    Continues the training of a fitted model on new rows.
+
+    XGBoost models add boosting rounds fit on the new rows, starting from the current
+    booster. Random forests add trees fit on the new rows. Linear regressions add the new rows
+    to the normal equations of all the rows seen and solve them by least squares, so their
+    predictions are those of a fit on all the rows at once. With one-hot encoded features and
+    an intercept the normal equations are singular: the coefficients are then one of the
+    least squares solutions and may differ from those of a batch fit. Other models are fit
+    again on the new rows.
+
+    Args:
+        model (Pipeline): Fitted model.
+        new_train (pd.DataFrame): New training rows.
+        statistics (dict): Normal equations of a linear regression, from normal_equations.
+        incremental_config (dict): Configuration for incremental runs.
+
+    Returns:
+        dict: Updated normal equations for linear regressions, None for other models.
+    """
+    estimator = model.named_steps['model']
+    x_new, y_new = preprocess(model, new_train)
+
+    if isinstance(estimator, XGBRegressor):
+        booster = estimator.get_booster()
+        n_rounds = incremental_config.get("xgboost_rounds", 100)
+        estimator.set_params(n_estimators=n_rounds)
+        estimator.fit(x_new, y_new, xgb_model=booster)
+        logger.debug("%s boosting rounds added to the XGBoost model", n_rounds)
+    elif isinstance(estimator, RandomForestRegressor):
+        n_trees = incremental_config.get("random_forest_trees", 50)
+        estimator.set_params(warm_start=True, n_estimators=estimator.n_estimators + n_trees)
+        estimator.fit(x_new, y_new)
+        logger.debug("%s trees added to the random forest", n_trees)
+    elif isinstance(estimator, LinearRegression) and statistics is not None:
+        new_statistics = normal_equations(x_new, y_new)
+        statistics = {key: statistics[key] + new_statistics[key] for key in statistics}
+        solve_normal_equations(estimator, statistics)
+        logger.debug("Linear regression updated with %s rows", len(y_new))
+        return statistics
+    else:
+        estimator.fit(x_new, y_new)
+    return None
+
+
+def normal_equations(x_train, y_train: np.ndarray) -> dict:
+    """
+    Computes the terms of the normal equations of a linear regression with intercept.
+
+    Args:
+        x_train: Preprocessed training features, dense or sparse.
+        y_train (np.ndarray): Training target variable.
+
+    Returns:
+        dict: X'X and X'y, with a leading column of ones in X for the intercept.
+    """
+    if sparse.issparse(x_train):
+        x_train = sparse.hstack([np.ones((x_train.shape[0], 1)), x_train]).tocsr()
+        xtx = (x_train.T @ x_train).toarray()
+    else:
+        x_train = np.hstack([np.ones((x_train.shape[0], 1)), x_train])
+        xtx = x_train.T @ x_train
+    return {"xtx": xtx, "xty": np.asarray(x_train.T @ y_train).ravel()}
+
+
+def solve_normal_equations(estimator: LinearRegression, statistics: dict) -> None:
+    """
+    Sets the coefficients of a linear regression to the minimum norm least squares solution
+    of its normal equations.
+    """
+    solution = np.linalg.lstsq(statistics["xtx"], statistics["xty"], rcond=None)[0]
+    estimator.intercept_ = solution[0]
+    estimator.coef_ = solution[1:]
@@ -0,0 +1,240 @@
+"""
+This module provides the instrumentation of pipeline runs: wall and CPU time, resident
+memory, Python allocations and throughput of each stage and model, and optional cProfile or
+pyinstrument dumps. The measurements of a run are written to profile.json so runs can be
+compared over time.
+
+Stages call track() whether or not a profiler is active, so instrumented code runs unchanged
+when profiling is disabled.
+"""
+# Libraries
+import contextlib
+import cProfile
+import json
+import logging
+import os
+import platform
+import resource
+import threading
+import time
+import tracemalloc
+from pathlib import Path
+from typing import Iterator, Optional
+
+import pandas as pd
+
+
+# Set logger
+logger = logging.getLogger(__name__)
+
+# Profilers supported for the optional dumps
+PROFILERS = ("cprofile", "pyinstrument")
+
+# Profiler of the current run, if any
+_ACTIVE_PROFILER: Optional["Profiler"] = None
+
+def current_rss() -> int:
+    """
+    Returns the resident set size of the process in bytes. Falls back to the peak resident
+    set size on systems without /proc.
+    """
+    try:
+        with open("/proc/self/statm", "r", encoding="utf-8") as file:
+            return int(file.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError):
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def count_rows(*values) -> Optional[int]:
+    """Returns the number of rows of the largest data frame among the values, if any"""
+    rows = [len(value) for value in values if isinstance(value, (pd.DataFrame, pd.Series))]
+    return max(rows) if rows else None
+
+
+class Profiler:
+    """Collects the measurements of a pipeline run.
+
+    Stages running at the same time share the process, so their resident memory and traced
+    allocations overlap. Run the stages one at a time (max_workers: 1) to attribute memory
+    to each stage exactly. CPU time is measured per thread.
+
+    Args:
+        tracemalloc (bool): Trace Python allocations. Slows down the run.
+        profiler (str): Optional "cprofile" or "pyinstrument" to dump a profile of each stage.
+        output_dir (Path): Directory for the profile dumps.
+        sample_interval (float): Seconds between samples of the resident memory.
+    """
+
+    def __init__(self, tracemalloc: bool = False, profiler: Optional[str] = None,
+                 output_dir: Optional[Path] = None, sample_interval: float = 0.05):
+        if profiler is not None and profiler not in PROFILERS:
+            raise ValueError(f"Unsupported profiler {profiler}. "
+                             f"Supported profilers are: {', '.join(PROFILERS)}.")
+        self.trace_memory = tracemalloc
+        self.profiler = profiler
+        self.output_dir = output_dir
+        self.sample_interval = sample_interval
+
+        self.records = {}
+        self._open_records = []
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._sampler = None
+        self._start = None
+
+    def __enter__(self) -> "Profiler":
+        global _ACTIVE_PROFILER
+        _ACTIVE_PROFILER = self
+        self._start = time.perf_counter()
+        if self.trace_memory:
+            tracemalloc.start()
+        self._stop.clear()
+        self._sampler = threading.Thread(target=self._sample, name="profiler-rss", daemon=True)
+        self._sampler.start()
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        global _ACTIVE_PROFILER
+        self._stop.set()
+        self._sampler.join()
+        if self.trace_memory:
+            tracemalloc.stop()
+        self.seconds = time.perf_counter() - self._start
+        _ACTIVE_PROFILER = None
+
+    def _sample(self) -> None:
+        """Samples the resident memory while records are open, keeping their peak"""
+        while not self._stop.wait(self.sample_interval):
+            rss = current_rss()
+            with self._lock:
+                for record in self._open_records:
+                    record["peak_rss_bytes"] = max(record["peak_rss_bytes"], rss)
+
+    @contextlib.contextmanager
+    def track(self, name: str, rows: Optional[int] = None,
+              profile: bool = False) -> Iterator[dict]:
+        """Measures a block of code. The caller can set "rows" on the yielded record."""
+        rss = current_rss()
+        record = {"start": time.perf_counter() - self._start, "rows": rows,
+                  "rss_start_bytes": rss, "peak_rss_bytes": rss}
+        if self.trace_memory:
+            traced_start = tracemalloc.get_traced_memory()[0]
+            tracemalloc.reset_peak()
+        with self._lock:
+            self._open_records.append(record)
+
+        dump = self._start_profile() if profile else None
+        wall_start, cpu_start = time.perf_counter(), time.thread_time()
+        try:
+            yield record
+        finally:
+            record["seconds"] = time.perf_counter() - wall_start
+            record["cpu_seconds"] = time.thread_time() - cpu_start
+            if dump is not None:
+                record["profile"] = self._stop_profile(dump, name)
+
+            rss = current_rss()
+            with self._lock:
+                self._open_records.remove(record)
+                record["rss_end_bytes"] = rss
+                record["peak_rss_bytes"] = max(record["peak_rss_bytes"], rss)
+            if self.trace_memory:
+                traced, traced_peak = tracemalloc.get_traced_memory()
+                record["traced_delta_bytes"] = traced - traced_start
+                record["traced_peak_bytes"] = traced_peak - traced_start
+            if record["rows"]:
+                record["rows_per_second"] = record["rows"] / record["seconds"] \
+                    if record["seconds"] else None
+            with self._lock:
+                self.records[name] = record
+
+    def _start_profile(self):
+        """Starts the configured profiler in the current thread"""
+        if self.profiler == "cprofile":
+            dump = cProfile.Profile()
+            dump.enable()
+            return dump
+        if self.profiler == "pyinstrument":
+            try:
+                from pyinstrument import Profiler as Pyinstrument  # pylint: disable=import-outside-toplevel
+            except ImportError:
+                logger.warning("pyinstrument is not installed. No profile will be dumped.")
+                return None
+            dump = Pyinstrument(async_mode="disabled")
+            dump.start()
+            return dump
+        return None
+
+    def _stop_profile(self, dump, name: str) -> Optional[str]:
+        """Stops a profiler and writes its output to the output directory"""
+        if self.output_dir is None:
+            return None
+        self.output_dir.mkdir(parents=True, exist_ok=True)
+        if self.profiler == "cprofile":
+            dump.disable()
+            path = self.output_dir / f"{name}.prof"
+            dump.dump_stats(path)
+        else:
+            dump.stop()
+            path = self.output_dir / f"{name}.html"
+            path.write_text(dump.output_html(), encoding="utf-8")
+        return str(path)
+
+    def record(self, name: str, seconds: float, rows: Optional[int] = None) -> None:
+        """Adds a timer measured elsewhere, e.g. in a worker process"""
+        with self._lock:
+            self.records[name] = {"seconds": seconds, "rows": rows,
+                                  "rows_per_second": rows / seconds if rows and seconds
+                                                     else None}
+
+    def save(self, save_path: Path) -> None:
+        """
+        Writes the measurements of the run to a JSON file.
+
+        Args:
+            save_path (Path): Path to save the profile.
+
+        Returns:
+            None
+        """
+        profile = {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "seconds": getattr(self, "seconds", None),
+            "max_rss_bytes": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024,
+            "tracemalloc": self.trace_memory,
+            "records": dict(sorted(self.records.items(), key=lambda item:
+                                   item[1].get("start", float("inf")))),
+        }
+        with open(save_path, "w", encoding="utf-8") as file:
+            json.dump(profile, file, indent=2)
+        logger.info("Profile of the run saved to %s", save_path)
+
+
+@contextlib.contextmanager
+def track(name: str, rows: Optional[int] = None, profile: bool = False) -> Iterator[dict]:
+    """
+    Measures a block of code with the profiler of the current run. Does nothing when no
+    profiler is active.
+
+    Args:
+        name (str): Name of the measurement in profile.json.
+        rows (int): Optional number of rows processed, for the throughput. Can also be set on
+                    the yielded record.
+        profile (bool): Dump a profile of the block if the profiler is configured to.
+
+    Yields:
+        dict: The record of the measurement.
+    """
+    if _ACTIVE_PROFILER is None:
+        yield {}
+        return
+    with _ACTIVE_PROFILER.track(name, rows, profile) as record:
+        yield record
+
+
+def record(name: str, seconds: float, rows: Optional[int] = None) -> None:
+    """Adds a timer measured elsewhere to the profiler of the current run, if any"""
+    if _ACTIVE_PROFILER is not None:
+        _ACTIVE_PROFILER.record(name, seconds, rows)
@@ -5,10 +5,12 @@ data frame.
 # Libraries
 import io
 import sys
+import typing
 import logging
 from pathlib import Path
 import zipfile
 import pandas as pd
+import pyarrow.parquet as pq
 
 import src.aws_utils as aws
 
@@ -16,65 +18,196 @@ import src.aws_utils as aws
 # Set logger
 logger = logging.getLogger(__name__)
 
-def raw_data(bucket_name: str, file_keys: list[str]) -> pd.DataFrame:
+# File formats supported for the data set artifacts
+ARTIFACT_FORMATS = {".csv", ".parquet", ".feather"}
+
+def raw_data(bucket_name: str, file_keys: list[str], max_workers: int = 8,
+             part_size: int = 8 * 1024 * 1024) -> pd.DataFrame:
     """
-    This function reads multiple csv files from a zip file stored in an AWS S3 bucket,
-    concatenates them into a single DataFrame, and returns it.
+    This function reads multiple csv files stored in an AWS S3 bucket, concatenates them into
+    a single DataFrame, and returns it. The files are downloaded concurrently and each file is
+    parsed as soon as it arrives, while the others are still downloading.
 
     Parameters:
         bucket_name (str): The name of the S3 bucket.
-        file_key (str): The key of the zip file (i.e., its path within the bucket).
+        file_keys (list[str]): The keys of the csv files (i.e., their paths within the bucket).
+        max_workers (int): Maximum number of concurrent requests to S3.
+        part_size (int): Size in bytes of each ranged GET for large files.
 
     Returns:
         df_raw (pd.DataFrame): A DataFrame containing the data from all csv files.
     """
-    # Empty dataframe for raw data.
-    df_raw = pd.DataFrame()
+    # Data frames read from each file.
+    raw_frames = read_raw_files(bucket_name, file_keys, max_workers, part_size)
 
-    # Loop through files to download
-    for file in file_keys:
-        # Download file from S3
-        df_temp = aws.get_data_s3(bucket_name, file)
+    # Concatenate all files at once, in the order of file_keys
+    frames = [raw_frames[file] for file in file_keys if file in raw_frames]
+    df_raw = pd.concat(frames) if frames else pd.DataFrame()
+
+    # Check rawd ata shape.
+    logger.info("Raw data set successfully created from zip file.")
+    logger.debug("Raw data set shape: %s", df_raw.shape)
+
+    # Function output.
+    return df_raw
+
+
+def read_raw_files(bucket_name: str, file_keys: list[str], max_workers: int = 8,
+                   part_size: int = 8 * 1024 * 1024) -> dict[str, pd.DataFrame]:
+    """
+    This function downloads multiple csv files stored in an AWS S3 bucket concurrently and
+    parses each file as soon as it arrives, while the others are still downloading.
+
+    Parameters:
+        bucket_name (str): The name of the S3 bucket.
+        file_keys (list[str]): The keys of the csv files (i.e., their paths within the bucket).
+        max_workers (int): Maximum number of concurrent requests to S3.
+        part_size (int): Size in bytes of each ranged GET for large files.
+
+    Returns:
+        dict[str, pd.DataFrame]: The data frame of each file that could be read, with the
+                                 class column added.
+    """
+    raw_frames = {}
+
+    # Loop through files as they are downloaded
+    for file, content in aws.download_objects(bucket_name, file_keys, max_workers, part_size):
         logger.info("File %s downloaded from %s", file, bucket_name)
 
         # Open as CSV
         try:
-            with df_temp.open(file) as csvfile:
-                df_temp = pd.read_csv(csvfile)
+            df_temp = pd.read_csv(io.BytesIO(content))
         except pd.errors.ParserError as err:
             logger.error("Error while reading csv file %s. Error: %s", file, err)
         else:
-            logger.info("CSV file %s read successfully.")
+            logger.info("CSV file %s read successfully.", file)
             # Add class type
             df_temp["class"] = file.replace("_raw.csv", "")
 
-            # Concatenate to raw dataframe
-            df_raw = pd.concat([df_raw, df_temp])
+            # Collect for a single concatenation at the end
+            raw_frames[file] = df_temp
             logger.debug("File %s appended to raw dataframe.", file)
 
-    # Check rawd ata shape.
-    logger.info("Raw data set successfully created from zip file.")
-    logger.debug("Raw data set shape: %s", df_raw.shape)
+    return raw_frames
 
-    # Function output.
-    return df_raw
+
+def read_raw_chunks(bucket_name: str, file_keys: list[str],
+                    chunk_size: int) -> typing.Iterator[pd.DataFrame]:
+    """
+    This function streams multiple csv files stored in an AWS S3 bucket and yields them in
+    chunks of at most chunk_size rows, so only one chunk is held in memory at a time.
+
+    Parameters:
+        bucket_name (str): The name of the S3 bucket.
+        file_keys (list[str]): The keys of the csv files (i.e., their paths within the bucket).
+        chunk_size (int): Maximum number of rows per chunk.
+
+    Yields:
+        pd.DataFrame: A chunk of raw data with the class column added.
+    """
+    # Loop through files to stream
+    for file in file_keys:
+        stream = aws.get_stream_s3(bucket_name, file)
+
+        try:
+            with pd.read_csv(stream, chunksize=chunk_size) as reader:
+                for n_chunk, df_chunk in enumerate(reader):
+                    # Add class type
+                    df_chunk["class"] = file.replace("_raw.csv", "")
+                    logger.debug("Chunk %s of file %s read with %s rows.",
+                                 n_chunk, file, len(df_chunk))
+                    yield df_chunk
+        except pd.errors.ParserError as err:
+            logger.error("Error while reading csv file %s. Error: %s", file, err)
+        else:
+            logger.info("CSV file %s streamed successfully.", file)
 
 
-def save_dataset(data: pd.DataFrame, save_path: Path) -> None:
+def save_dataset(data: pd.DataFrame, save_path: Path, append: bool = False) -> None:
     """
-    Save dataframe as csv file to a specified path
+    Save dataframe to a specified path. The file format is taken from the suffix of the path:
+    csv, parquet or feather (Arrow IPC). The columnar formats store text columns as
+    dictionary-encoded categoricals.
 
     Args:
     --------------------------------------------
         data: Pandas dataframe to save
         save_path: Local path to write data to
+        append: If True, add the rows to the data set at save_path, creating it if needed.
+                Csv files are appended in place; parquet and feather data sets are written
+                as one part file per call inside a directory named save_path.
     """
+    if save_path.suffix not in ARTIFACT_FORMATS:
+        raise ValueError(f"Unsupported artifact format {save_path.suffix}. " +
+                         f"Use one of {sorted(ARTIFACT_FORMATS)}.")
+
     # Write data into specified file
     try:
-        data.to_csv(save_path, index = False)
+        if save_path.suffix == ".csv":
+            data.to_csv(save_path, index = False, mode = "a" if append else "w",
+                        header = not (append and save_path.exists()))
+        else:
+            if append:
+                save_path.mkdir(exist_ok = True)
+                n_parts = len(list(save_path.iterdir()))
+                save_path = save_path / f"part-{n_parts:05d}{save_path.suffix}"
+
+            # Dictionary-encode text columns
+            data = data.astype({col: "category" for col in data.select_dtypes("object")})
+
+            if save_path.suffix == ".parquet":
+                data.to_parquet(save_path, index = False)
+            else:
+                data.reset_index(drop = True).to_feather(save_path)
     except FileNotFoundError:
         print(f"Error: {save_path} not found.")
     except pd.errors.ParserError:
         print(f"Error: unexpected error while writing dataframe to {save_path}")
     except Exception as err:
         print(f"Error: an error occurred when saving to file {save_path}: {err}")
+
+
+def load_dataset(load_path: Path) -> pd.DataFrame:
+    """
+    Load a data set written by save_dataset. The file format is taken from the suffix of the
+    path, and parquet or feather data sets written in parts are read as a single dataframe.
+
+    Args:
+        load_path: Local path to read data from
+
+    Returns:
+        pd.DataFrame: The data set
+    """
+    if load_path.suffix == ".csv":
+        return pd.read_csv(load_path)
+    if load_path.suffix == ".parquet":
+        return pd.read_parquet(load_path)
+    if load_path.is_dir():
+        return pd.concat([pd.read_feather(part) for part in sorted(load_path.iterdir())],
+                         ignore_index = True)
+    return pd.read_feather(load_path)
+
+
+def iter_dataset(load_path: Path, chunk_size: int) -> typing.Iterator[pd.DataFrame]:
+    """
+    Read a data set written by save_dataset in chunks.
+
+    Args:
+        load_path: Local path to read data from
+        chunk_size: Maximum number of rows per chunk for csv and single parquet files. Data
+                    sets written in parts are read one part at a time.
+
+    Yields:
+        pd.DataFrame: A chunk of the data set
+    """
+    if load_path.suffix == ".csv":
+        with pd.read_csv(load_path, chunksize = chunk_size) as reader:
+            yield from reader
+    elif load_path.is_dir():
+        for part in sorted(load_path.iterdir()):
+            yield load_dataset(part)
+    elif load_path.suffix == ".parquet":
+        for batch in pq.ParquetFile(load_path).iter_batches(batch_size = chunk_size):
+            yield batch.to_pandas()
+    else:
+        yield pd.read_feather(load_path)
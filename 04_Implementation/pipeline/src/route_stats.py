@@ -0,0 +1,240 @@
+"""
+This module provides functions for summarizing the clean data into the route statistics
+used by the web app: the flight numbers of each airline, the duration of each route and the
+arrival times of each route and departure time. The statistics are a small JSON artifact, so
+the web app does not need to download the clean data. They are built from counts that can
+be merged, so a data set read in chunks is summarized without loading it whole.
+"""
+# Libraries
+import json
+import logging
+from pathlib import Path
+from typing import Dict, List, Optional
+
+import numpy as np
+import pandas as pd
+
+
+# Set logger
+logger = logging.getLogger(__name__)
+
+# Keys of the statistics, as read by the RouteIndex of the web app
+ROUTE = ["airline", "origin", "destination"]
+DEPARTURE = ["airline", "origin", "destination", "departure_time"]
+CITY_DEPARTURE = ["origin", "destination", "departure_time"]
+
+def count_by(data: pd.DataFrame, keys: List[str]) -> pd.Series:
+    """
+    Counts the rows of each observed combination of the keys, in order of appearance.
+
+    Args:
+        data (pd.DataFrame): Chunk of the clean data set.
+        keys (list[str]): Columns defining the groups.
+
+    Returns:
+        pd.Series: Number of rows of each group, indexed by plain (not categorical) values of
+                   the keys, so counts of chunks with different categories can be merged.
+    """
+    counts = data.groupby(keys, sort=False, observed=True).size()
+    counts.index = pd.MultiIndex.from_tuples(list(counts.index), names=keys)
+    return counts
+
+
+def merge_counts(left: Optional[pd.Series], right: Optional[pd.Series]) -> Optional[pd.Series]:
+    """
+    Adds the counts of two chunks. Groups keep the order in which they were first seen.
+
+    Args:
+        left (pd.Series): Counts from count_by, or None.
+        right (pd.Series): Counts from count_by, or None.
+
+    Returns:
+        pd.Series: Counts of the rows of both.
+    """
+    if left is None or right is None:
+        return right if left is None else left
+    return pd.concat([left, right]).groupby(level=list(range(left.index.nlevels)),
+                                            sort=False).sum()
+
+
+def weighted_quantiles(values: np.ndarray, counts: np.ndarray,
+                       quantiles: List[float]) -> np.ndarray:
+    """
+    Computes quantiles of repeated values, with the linear interpolation of pandas.
+
+    Args:
+        values (np.ndarray): Distinct values, in increasing order.
+        counts (np.ndarray): Number of times each value is repeated.
+        quantiles (list[float]): Quantiles to compute.
+
+    Returns:
+        np.ndarray: Value of each quantile.
+    """
+    cumulative = np.cumsum(counts)
+    positions = (cumulative[-1] - 1) * np.asarray(quantiles, dtype=float)
+    lower = np.floor(positions)
+    upper = np.minimum(lower + 1, cumulative[-1] - 1)
+    # Value at each rank of the sorted values
+    lower_values = values[np.searchsorted(cumulative, lower, side="right")]
+    upper_values = values[np.searchsorted(cumulative, upper, side="right")]
+    return lower_values + (positions - lower) * (upper_values - lower_values)
+
+
+class RouteStatsAccumulator:
+    """
+    Counts of the clean data behind the route statistics, updated one chunk at a time. The
+    duration of each route is counted by value, so its quantiles are exact; flight durations
+    have few distinct values, which keeps the counts small.
+
+    Args:
+        quantiles (list[float]): Quantiles of the duration of each route.
+    """
+
+    def __init__(self, quantiles: List[float] = None):
+        self.quantiles = quantiles if quantiles is not None else [0.1, 0.25, 0.5, 0.75, 0.9]
+        self.rows = 0
+        self.duration_sum = 0.0
+        self.flights: Dict[str, Dict[str, None]] = {}
+        self.durations: Optional[pd.Series] = None
+        self.arrivals: Optional[pd.Series] = None
+        self.city_arrivals: Optional[pd.Series] = None
+
+    def update(self, clean_data: pd.DataFrame) -> "RouteStatsAccumulator":
+        """
+        Adds a chunk of the clean data.
+
+        Args:
+            clean_data (pd.DataFrame): Chunk of the clean data set.
+
+        Returns:
+            RouteStatsAccumulator: The accumulator.
+        """
+        # Only the observed combinations of categorical columns are summarized
+        for airline, flight_numbers in clean_data.groupby("airline", sort=False,
+                                                          observed=True)["flight"] \
+                .unique().items():
+            self.flights.setdefault(airline, {}).update(dict.fromkeys(flight_numbers))
+
+        # Duration of each route, in double precision for compact data sets
+        clean_data = clean_data.assign(duration=clean_data["duration"].astype(float))
+        self.rows += len(clean_data)
+        self.duration_sum += clean_data["duration"].sum()
+        self.durations = merge_counts(self.durations,
+                                      count_by(clean_data, ROUTE + ["duration"]))
+        self.arrivals = merge_counts(self.arrivals,
+                                     count_by(clean_data, DEPARTURE + ["arrival_time"]))
+        self.city_arrivals = merge_counts(self.city_arrivals,
+                                          count_by(clean_data, CITY_DEPARTURE + ["arrival_time"]))
+        return self
+
+    def merge(self, other: "RouteStatsAccumulator") -> "RouteStatsAccumulator":
+        """Adds the counts of another accumulator, e.g. of the next part of the data set."""
+        self.rows += other.rows
+        self.duration_sum += other.duration_sum
+        for airline, flight_numbers in other.flights.items():
+            self.flights.setdefault(airline, {}).update(flight_numbers)
+        self.durations = merge_counts(self.durations, other.durations)
+        self.arrivals = merge_counts(self.arrivals, other.arrivals)
+        self.city_arrivals = merge_counts(self.city_arrivals, other.city_arrivals)
+        return self
+
+    def duration_records(self) -> List[dict]:
+        """Number of flights, mean and quantiles of the duration of each route"""
+        if self.durations is None:
+            return []
+        records = []
+        for key, counts in self.durations.groupby(level=ROUTE, sort=False):
+            counts = counts.droplevel(ROUTE).sort_index()
+            values = counts.index.to_numpy(dtype=float)
+            weights = counts.to_numpy()
+            records.append({
+                **dict(zip(ROUTE, key)), "count": int(weights.sum()),
+                "duration": float(values @ weights / weights.sum()),
+                "quantiles": {str(quantile): float(value) for quantile, value in
+                              zip(self.quantiles, weighted_quantiles(values, weights,
+                                                                     self.quantiles))}})
+        return records
+
+    def stats(self) -> dict:
+        """
+        Returns:
+            dict: Route statistics with the following keys:
+                - "rows": Number of flights summarized.
+                - "flights": Flight numbers of each airline, in order of appearance.
+                - "mean_duration": Mean duration of all the flights.
+                - "durations": Number of flights, mean and quantiles of the duration of each
+                               airline, origin and destination.
+                - "arrivals": Most frequent arrival time and share of each arrival time for
+                              each airline, origin, destination and departure time.
+                - "city_arrivals": Same as "arrivals" across airlines, for the routes an
+                                   airline does not fly.
+        """
+        duration_records = self.duration_records()
+        stats = {"rows": self.rows,
+                 "flights": {airline: list(flight_numbers)
+                             for airline, flight_numbers in self.flights.items()},
+                 "mean_duration": float(self.duration_sum / self.rows) if self.rows else None,
+                 "durations": duration_records,
+                 "arrivals": arrival_distribution(self.arrivals, DEPARTURE),
+                 "city_arrivals": arrival_distribution(self.city_arrivals, CITY_DEPARTURE)}
+        logger.info("Route statistics of %s flights: %s routes, %s departures.", self.rows,
+                    len(duration_records), len(stats["arrivals"]))
+        return stats
+
+
+def route_stats(clean_data: pd.DataFrame, quantiles: List[float] = None) -> dict:
+    """
+    Summarizes the clean data by route.
+
+    Args:
+        clean_data (pd.DataFrame): Clean data set.
+        quantiles (list[float]): Quantiles of the duration of each route.
+
+    Returns:
+        dict: Route statistics, see RouteStatsAccumulator.stats.
+    """
+    return RouteStatsAccumulator(quantiles).update(clean_data).stats()
+
+
+def arrival_distribution(counts: Optional[pd.Series], keys: List[str]) -> List[dict]:
+    """
+    Computes the share of each arrival time for each group, and its most frequent arrival
+    time. Ties go to the arrival time seen first in the data.
+
+    Args:
+        counts (pd.Series): Number of flights of each group and arrival time, from count_by.
+        keys (list[str]): Columns defining the groups.
+
+    Returns:
+        list[dict]: The keys, the most frequent arrival time and the distribution of each
+                    group.
+    """
+    if counts is None:
+        return []
+    modes = counts.groupby(level=keys, sort=False).idxmax()
+    totals = counts.groupby(level=keys, sort=False).sum()
+
+    distributions = {}
+    for (*key, arrival_time), count in counts.items():
+        distributions.setdefault(tuple(key), {})[arrival_time] = count
+    return [{**dict(zip(keys, key)), "arrival_time": modes[key][-1],
+             "count": int(totals[key]),
+             "distribution": {arrival_time: round(count / totals[key], 6)
+                              for arrival_time, count in distribution.items()}}
+            for key, distribution in distributions.items()]
+
+
+def save_route_stats(stats: dict, save_path: Path) -> None:
+    """
+    Saves the route statistics to a JSON file.
+
+    Args:
+        stats (dict): Route statistics from route_stats.
+        save_path (Path): Path to save the statistics.
+
+    Returns:
+        None
+    """
+    with open(save_path, "w", encoding="utf-8") as file:
+        json.dump(stats, file)
+    logger.info("Route statistics saved to %s", save_path)
@@ -0,0 +1,134 @@
+"""
+This module provides a content-addressed cache for the outputs of the pipeline stages. Each
+stage is keyed by a hash of its configuration section, its inputs and its code, so a run
+only executes the stages whose key changed and links the cached outputs of the others into
+the new run directory.
+"""
+# Libraries
+import hashlib
+import logging
+import os
+import shutil
+from pathlib import Path
+from types import ModuleType
+from typing import List, Optional
+
+import yaml
+
+import src.aws_utils as aws
+
+
+# Set logger
+logger = logging.getLogger(__name__)
+
+def stage_key(stage_name: str, stage_config: dict, inputs: List[str]) -> str:
+    """
+    Computes the cache key of a stage.
+
+    Args:
+        stage_name (str): Name of the stage.
+        stage_config (dict): Configuration section of the stage.
+        inputs (list[str]): Fingerprints of the inputs of the stage: the keys of the stages
+                            it reads from, the ETags of source files or the fingerprint of
+                            its code.
+
+    Returns:
+        str: Hex digest identifying the outputs of the stage.
+    """
+    sha256 = hashlib.sha256(stage_name.encode())
+    sha256.update(yaml.safe_dump(stage_config, sort_keys=True).encode())
+    for fingerprint in inputs:
+        sha256.update(str(fingerprint).encode())
+    return sha256.hexdigest()
+
+
+def code_fingerprint(*modules: ModuleType) -> str:
+    """
+    Fingerprints the source files of modules, so editing the code of a stage invalidates its
+    cached outputs.
+
+    Args:
+        modules (ModuleType): Modules used by the stage.
+
+    Returns:
+        str: Hashes of the source files of the modules.
+    """
+    return ",".join(aws.file_sha256(Path(module.__file__)) for module in modules)
+
+
+def restore_stage(cache_dir: Optional[Path], stage_name: str, key: str,
+                  run_dir: Path) -> bool:
+    """
+    Links the cached outputs of a stage into the run directory, if they exist.
+
+    Args:
+        cache_dir (Path): Directory of the cache. None disables the cache.
+        stage_name (str): Name of the stage.
+        key (str): Cache key of the stage from stage_key.
+        run_dir (Path): Directory of the current run.
+
+    Returns:
+        bool: True if the outputs were found in the cache.
+    """
+    if cache_dir is None:
+        return False
+
+    entry = cache_dir / stage_name / key
+    if not entry.is_dir():
+        logger.info("Stage %s: cache miss (%s).", stage_name, key[:12])
+        return False
+
+    for output in sorted(entry.iterdir()):
+        copy_output(output, run_dir / output.name)
+    logger.info("Stage %s: cache hit (%s), outputs linked into %s.", stage_name, key[:12],
+                run_dir)
+    return True
+
+
+def store_stage(cache_dir: Optional[Path], stage_name: str, key: str,
+                outputs: List[Path]) -> None:
+    """
+    Stores the outputs of a stage in the cache. The entry is written to a temporary directory
+    and renamed once complete, so an interrupted run never leaves a partial entry.
+
+    Args:
+        cache_dir (Path): Directory of the cache. None disables the cache.
+        stage_name (str): Name of the stage.
+        key (str): Cache key of the stage from stage_key.
+        outputs (list[Path]): Files or directories written by the stage.
+
+    Returns:
+        None
+    """
+    if cache_dir is None:
+        return
+
+    entry = cache_dir / stage_name / key
+    tmp_entry = entry.with_name(f"{key}.tmp-{os.getpid()}")
+    tmp_entry.mkdir(parents=True, exist_ok=True)
+    for output in outputs:
+        copy_output(output, tmp_entry / output.name)
+
+    try:
+        os.replace(tmp_entry, entry)
+    except OSError:
+        # Another run stored the same entry meanwhile
+        shutil.rmtree(tmp_entry, ignore_errors=True)
+    logger.debug("Stage %s: outputs %s stored in cache (%s).", stage_name,
+                 [output.name for output in outputs], key[:12])
+
+
+def copy_output(source: Path, destination: Path) -> None:
+    """Hard links a file or directory of files, copying when links are not supported."""
+    if source.is_dir():
+        shutil.copytree(source, destination, copy_function=link_or_copy, dirs_exist_ok=True)
+    else:
+        link_or_copy(source, destination)
+
+
+def link_or_copy(source: Path, destination: Path) -> None:
+    """Hard links a file, copying it when the file systems do not support links."""
+    try:
+        os.link(source, destination)
+    except OSError:
+        shutil.copy2(source, destination)
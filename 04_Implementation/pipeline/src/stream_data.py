@@ -0,0 +1,78 @@
+"""
+This module provides functions for running the data stages of the pipeline (raw data, clean
+data and features) in streaming mode. The source files are read in chunks and every chunk is
+cleaned, transformed and appended to the artifacts, so peak memory is bounded by the chunk
+size instead of the size of the data set.
+"""
+# Libraries
+import logging
+from pathlib import Path
+import pandas as pd
+
+import src.raw_data as rd
+import src.clean_data as cd
+import src.generate_features as gf
+
+
+# Set logger
+logger = logging.getLogger(__name__)
+
+def stream_datasets(bucket_name: str, raw_config: dict, clean_config: dict,
+                    feature_config: dict, artifacts: Path,
+                    artifact_format: str = "csv") -> Path:
+    """
+    Streams the raw files from S3 through clean_data and generate_features, writing the raw,
+    clean and features data sets incrementally to the artifacts directory.
+
+    Filtering airlines and rare keys needs the number of flights of each airline and key over
+    the whole data set, so the features are generated in a second pass over the clean data,
+    once those counts are known.
+
+    Args:
+        bucket_name (str): The name of the S3 bucket.
+        raw_config (dict): Configuration for the raw data. Should have the keys "file_keys"
+                           and "chunk_size".
+        clean_config (dict): Keyword arguments for clean_data.clean_data.
+        feature_config (dict): Configuration dictionary for feature generation.
+        artifacts (Path): Directory to write the raw_data, clean_data and features data sets to.
+        artifact_format (str): File format of the data sets: csv, parquet or feather.
+
+    Returns:
+        Path: Path to the features data set.
+    """
+    chunk_size = raw_config.get("chunk_size", 100000)
+    raw_path = artifacts / f"raw_data.{artifact_format}"
+    clean_path = artifacts / f"clean_data.{artifact_format}"
+    features_path = artifacts / f"features.{artifact_format}"
+
+    # First pass: raw data to clean data, counting flights per airline and rare key
+    rules = feature_config.get("filter_rare", [])
+    flight_counts = pd.Series(dtype=int)
+    rare_counts = [None] * len(rules)
+    n_rows = 0
+    for raw_chunk in rd.read_raw_chunks(bucket_name, raw_config["file_keys"], chunk_size):
+        rd.save_dataset(raw_chunk, raw_path, append=True)
+
+        clean_chunk = cd.clean_data(raw_chunk, **clean_config)
+        rd.save_dataset(clean_chunk, clean_path, append=True)
+
+        flight_counts = flight_counts.add(clean_chunk["airline"].value_counts(), fill_value=0)
+        for position, rule in enumerate(rules):
+            counts = gf.count_keys(clean_chunk, rule["keys"])
+            rare_counts[position] = counts if rare_counts[position] is None else \
+                                    rare_counts[position].add(counts, fill_value=0)
+        n_rows += len(clean_chunk)
+
+    logger.info("Raw and clean data streamed to %s in chunks of %s rows (%s rows).",
+                artifacts, chunk_size, n_rows)
+
+    # Second pass: clean data to features, filtering airlines on the global counts
+    for clean_chunk in rd.iter_dataset(clean_path, chunk_size):
+        features_chunk = gf.generate_features(clean_chunk, feature_config, flight_counts,
+                                                rare_counts)
+        rd.save_dataset(features_chunk, features_path, append=True)
+
+    logger.info("Features streamed to %s.", features_path)
+
+    # Function output
+    return features_path
@@ -0,0 +1,298 @@
+"""
+This module provides functions for training the models out of core, on a features data set
+larger than memory. The data set is read in chunks: linear regressions are replaced by
+stochastic gradient descent fit with partial_fit on each chunk, XGBoost models train on an
+external memory DMatrix fed chunk by chunk, and other models are fit on a uniform sample of
+the training rows. The models are evaluated on a hold-out set sampled from the stream with a
+reservoir, so only the samples and one chunk are held in memory at a time.
+"""
+# Libraries
+import logging
+import tempfile
+from pathlib import Path
+from typing import Iterator, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+import xgboost as xgb
+from sklearn.compose import ColumnTransformer
+from sklearn.linear_model import LinearRegression, SGDRegressor
+from sklearn.pipeline import Pipeline
+from xgboost import XGBRegressor
+
+import src.profiling as profiling
+import src.raw_data as rd
+import src.train_model as tm
+
+
+# Set logger
+logger = logging.getLogger(__name__)
+
+class Reservoir:
+    """
+    Uniform sample of a fixed number of rows of a stream of dataframes (Algorithm R). Every
+    row seen has the same probability of being in the sample, whatever the length of the
+    stream, which does not need to be known in advance.
+
+    Args:
+        size (int): Number of rows of the sample.
+        seed (int): Seed of the random generator.
+    """
+
+    def __init__(self, size: int, seed: Optional[int] = None):
+        self.size = size
+        self.rng = np.random.default_rng(seed)
+        self.seen = 0
+        self.positions = np.empty(0, dtype=np.int64)
+        self.rows: Optional[pd.DataFrame] = None
+
+    def add(self, chunk: pd.DataFrame) -> None:
+        """Offers the rows of the next chunk of the stream to the sample."""
+        positions = np.arange(self.seen, self.seen + len(chunk))
+        self.seen += len(chunk)
+
+        # Fill the sample, then replace a random slot with decreasing probability
+        n_fill = min(len(chunk), max(0, self.size - len(self.positions)))
+        self.positions = np.concatenate([self.positions, positions[:n_fill]])
+        candidates = positions[n_fill:]
+        slots = (self.rng.random(len(candidates)) * (candidates + 1)).astype(np.int64)
+        replaced = slots < self.size
+
+        # A later row replaces an earlier one that took the same slot
+        slots, last = np.unique(slots[replaced][::-1], return_index=True)
+        self.positions[slots] = candidates[replaced][::-1][last]
+
+        added = chunk.set_axis(positions)
+        added = added.loc[added.index.isin(self.positions)]
+        self.rows = added if self.rows is None else \
+                    pd.concat([self.rows.loc[self.rows.index.isin(self.positions)], added])
+
+    def sample(self) -> pd.DataFrame:
+        """The rows of the sample, indexed and sorted by their position in the stream."""
+        if self.rows is None:
+            return pd.DataFrame()
+        return self.rows.sort_index()
+
+
+def scan_features(features_path: Path, chunk_size: int, holdout_size: int,
+                  sample_size: int, categorical_features: list,
+                  random_state: int = 42) -> Tuple[pd.DataFrame, pd.DataFrame, dict]:
+    """
+    Reads the features data set once to sample the hold-out and training rows and to list
+    the categories of the categorical features.
+
+    Args:
+        features_path (Path): Features data set written by save_dataset.
+        chunk_size (int): Maximum number of rows per chunk.
+        holdout_size (int): Number of rows held out to evaluate the models.
+        sample_size (int): Number of rows sampled to fit the preprocessors, and the models
+                           that cannot be trained in chunks. Rows also in the hold-out set
+                           are left out, so the sample is slightly smaller.
+        categorical_features (list): Categorical features.
+        random_state (int): Seed of the samples.
+
+    Returns:
+        pd.DataFrame: Hold-out rows, indexed by their position in the data set.
+        pd.DataFrame: Sample of the training rows, indexed by their position.
+        dict: Sorted categories of each categorical feature over the whole data set.
+    """
+    holdout = Reservoir(holdout_size, random_state)
+    sample = Reservoir(sample_size, random_state + 1)
+    categories: dict = {feature: set() for feature in categorical_features}
+    for chunk in rd.iter_dataset(features_path, chunk_size):
+        holdout.add(chunk)
+        sample.add(chunk)
+        for feature, values in categories.items():
+            values.update(chunk[feature].dropna().unique())
+
+    holdout_rows = holdout.sample()
+    sample_rows = sample.sample()
+    sample_rows = sample_rows[~sample_rows.index.isin(holdout_rows.index)]
+    logger.info("Scanned %s rows: %s held out, %s sampled to fit the preprocessors.",
+                holdout.seen, len(holdout_rows), len(sample_rows))
+    return holdout_rows, sample_rows, {feature: sorted(values)
+                                       for feature, values in categories.items()}
+
+
+def iter_training_chunks(features_path: Path, chunk_size: int,
+                         holdout_positions: np.ndarray) -> Iterator[pd.DataFrame]:
+    """Reads the features data set in chunks, leaving out the hold-out rows."""
+    offset = 0
+    for chunk in rd.iter_dataset(features_path, chunk_size):
+        positions = np.arange(offset, offset + len(chunk))
+        offset += len(chunk)
+        train = chunk[~np.isin(positions, holdout_positions)]
+        if len(train) > 0:
+            yield train
+
+
+def fit_preprocessor(preprocessor: ColumnTransformer, categories: dict,
+                     sample: pd.DataFrame) -> ColumnTransformer:
+    """
+    Fits a preprocessor on the sample of the training rows. The categories of its encoder
+    are set to those of the whole data set, so categories missing from the sample are not
+    unknown to the models.
+    """
+    for name, encoder, features in preprocessor.transformers:
+        if name == 'cat' and 'categories' in encoder.get_params():
+            encoder.set_params(categories=[categories[feature] for feature in features])
+    return preprocessor.fit(sample.drop('price', axis=1), sample['price'])
+
+
+class FeaturesIter(xgb.DataIter):
+    """
+    Feeds the preprocessed training chunks of a features data set to an external memory
+    DMatrix. XGBoost caches the chunks on disk under cache_prefix.
+    """
+
+    def __init__(self, features_path: Path, chunk_size: int, holdout_positions: np.ndarray,
+                 preprocessor: ColumnTransformer, cache_prefix: str):
+        self.features_path = features_path
+        self.chunk_size = chunk_size
+        self.holdout_positions = holdout_positions
+        self.preprocessor = preprocessor
+        self.chunks: Optional[Iterator[pd.DataFrame]] = None
+        super().__init__(cache_prefix=cache_prefix)
+
+    def next(self, input_data) -> int:
+        if self.chunks is None:
+            self.reset()
+        chunk = next(self.chunks, None)
+        if chunk is None:
+            return 0
+        input_data(data=self.preprocessor.transform(chunk.drop('price', axis=1)),
+                   label=chunk['price'].to_numpy())
+        return 1
+
+    def reset(self) -> None:
+        self.chunks = iter_training_chunks(self.features_path, self.chunk_size,
+                                           self.holdout_positions)
+
+
+def train_sgd(preprocessor: ColumnTransformer, features_path: Path, chunk_size: int,
+              holdout_positions: np.ndarray, streaming_config: dict) -> SGDRegressor:
+    """
+    Fits a linear model by stochastic gradient descent, one chunk at a time.
+
+    Args:
+        preprocessor (ColumnTransformer): Fitted preprocessor.
+        features_path (Path): Features data set.
+        chunk_size (int): Maximum number of rows per chunk.
+        holdout_positions (np.ndarray): Positions of the hold-out rows.
+        streaming_config (dict): Configuration of the out-of-core training, with the number
+                                 of passes over the data set ("epochs") and the parameters
+                                 of SGDRegressor ("sgd").
+
+    Returns:
+        SGDRegressor: The fitted model.
+    """
+    rng = np.random.default_rng(streaming_config.get("random_state", 42))
+    model = SGDRegressor(**streaming_config.get("sgd", {}))
+    for _ in range(streaming_config.get("epochs", 1)):
+        for chunk in iter_training_chunks(features_path, chunk_size, holdout_positions):
+            # Rows of a chunk are shuffled, as SGD assumes they come in random order
+            chunk = chunk.iloc[rng.permutation(len(chunk))]
+            model.partial_fit(preprocessor.transform(chunk.drop('price', axis=1)),
+                              chunk['price'].to_numpy())
+    return model
+
+
+def train_xgboost(model: XGBRegressor, preprocessor: ColumnTransformer, features_path: Path,
+                  chunk_size: int, holdout_positions: np.ndarray) -> XGBRegressor:
+    """
+    Trains an XGBoost model on an external memory DMatrix of the training chunks, with the
+    parameters and number of boosting rounds of the configured model.
+
+    Returns:
+        XGBRegressor: The model, holding the trained booster.
+    """
+    params = {key: value for key, value in model.get_xgb_params().items()
+              if value is not None}
+    # External memory supports the hist and approx tree methods
+    params.setdefault("tree_method", "hist")
+    with tempfile.TemporaryDirectory() as cache_dir:
+        data_iter = FeaturesIter(features_path, chunk_size, holdout_positions, preprocessor,
+                                 str(Path(cache_dir) / "cache"))
+        dmatrix = xgb.DMatrix(data_iter)
+        booster = xgb.train(params, dmatrix, num_boost_round=model.n_estimators or 100)
+        del dmatrix
+    model._Booster = booster  # pylint: disable=protected-access
+    return model
+
+
+def train_streaming(features_path: Path, config: dict
+                    ) -> Tuple[None, pd.DataFrame, dict, dict]:
+    """
+    Trains and evaluates models out of core, on a features data set read in chunks.
+
+    Linear regressions are fit with SGDRegressor.partial_fit, XGBoost models on an external
+    memory DMatrix, and other models on the sample of training rows. Hyperparameter tuning
+    and parallel training are not used in this mode.
+
+    Args:
+        features_path (Path): Features data set written by save_dataset.
+        config (dict): Configuration dictionary for training and evaluation, with the
+            "streaming" section:
+            - "chunk_size": Maximum number of rows per chunk. Default 100000.
+            - "holdout_size": Number of rows held out to evaluate the models. Default 50000.
+            - "sample_size": Number of rows sampled to fit the preprocessors and the other
+                             models. Default 100000.
+            - "epochs": Passes over the data set of the linear models. Default 1.
+            - "sgd": Parameters of SGDRegressor.
+            - "random_state": Seed of the samples and of the order of the rows. Default 42.
+
+    Returns:
+        None: The training set is not held in memory.
+        pd.DataFrame: Hold-out set.
+        dict: Evaluation results on the hold-out set, with the class of the fitted estimator
+              ("estimator") and whether it was trained on all the chunks or on the sample
+              ("training").
+        dict: Trained models.
+    """
+    streaming_config = config.get('streaming', {})
+    chunk_size = streaming_config.get('chunk_size', 100000)
+
+    holdout, sample, categories = scan_features(
+        features_path, chunk_size, streaming_config.get('holdout_size', 50000),
+        streaming_config.get('sample_size', 100000), config.get('categorical_features', []),
+        streaming_config.get('random_state', 42))
+    holdout_positions = holdout.index.to_numpy()
+
+    # Fit each preprocessor once on the sample, with the categories of the whole data set
+    preprocessors = tm.define_preprocessors(config)
+    for preprocessor in {id(preprocessor): preprocessor
+                         for preprocessor in preprocessors.values()}.values():
+        fit_preprocessor(preprocessor, categories, sample)
+
+    results: dict = {}
+    trained_models: dict = {}
+    x_holdout, y_holdout = holdout.drop('price', axis=1), holdout['price']
+    for name, model in tm.define_models(config).items():
+        preprocessor = preprocessors[name]
+        training = 'chunks'
+        with profiling.track(f"fit.{name}"):
+            if isinstance(model, LinearRegression):
+                model = train_sgd(preprocessor, features_path, chunk_size, holdout_positions,
+                                  streaming_config)
+            elif isinstance(model, XGBRegressor):
+                model = train_xgboost(model, preprocessor, features_path, chunk_size,
+                                      holdout_positions)
+            else:
+                logger.info("Model %s cannot be trained in chunks. Fitting it on %s sampled "
+                            "rows.", name, len(sample))
+                training = 'sample'
+                model = model.fit(preprocessor.transform(sample.drop('price', axis=1)),
+                                  sample['price'])
+
+        trained_models[name] = Pipeline(steps=[('preprocessor', preprocessor),
+                                               ('model', model)])
+        with profiling.track(f"predict.{name}", rows=len(holdout)):
+            results[name] = tm.calculate_metrics(y_holdout,
+                                                 trained_models[name].predict(x_holdout))
+        # The estimator may differ from the configured class, e.g. an SGDRegressor for
+        # linear_regression
+        results[name]['estimator'] = type(model).__name__
+        results[name]['training'] = training
+        logger.info("Model %s trained out of core and evaluated", name)
+
+    return None, holdout.reset_index(drop=True), results, trained_models
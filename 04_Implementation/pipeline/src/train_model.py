@@ -4,8 +4,14 @@ This module provides functions for training and evaluating models.
 # Libraries
 from pathlib import Path
 import logging
-from typing import Tuple
+import multiprocessing
+import os
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+import time
+from typing import Tuple, Union
 import pickle
+import joblib
 import yaml
 import numpy as np
 import pandas as pd
@@ -15,17 +21,32 @@ from sklearn.pipeline import Pipeline
 from sklearn.linear_model import LinearRegression
 from sklearn.ensemble import RandomForestRegressor
 from sklearn.metrics import mean_squared_error, mean_absolute_error, r2_score
-from sklearn.preprocessing import StandardScaler, OneHotEncoder
+from sklearn.preprocessing import StandardScaler, OneHotEncoder, OrdinalEncoder
 from sklearn.compose import ColumnTransformer
+from sklearn.feature_extraction.text import HashingVectorizer
 from xgboost import XGBRegressor
+try:
+    from sklearn.preprocessing import TargetEncoder
+except ImportError:  # scikit-learn < 1.3
+    TargetEncoder = None
+
+import src.profiling as profiling
+import src.tune_model as tune
 
 
 # Set logger
 logger = logging.getLogger(__name__)
 
+# Formats supported to serialize trained models
+SERIALIZATION_FORMATS = ("pickle", "joblib", "joblib_mmap")
+
+# Encoders supported for the categorical features
+ENCODERS = ("onehot", "ordinal", "target")
+
 def train_and_evaluate(
     features: pd.DataFrame,
-    config: dict
+    config: dict,
+    tuning_path: Path = None
 ) -> Tuple[pd.DataFrame, pd.DataFrame, dict, dict]:
 
     """
@@ -34,14 +55,16 @@ def train_and_evaluate(
     Args:
         features (pandas.DataFrame): Data set with features.
         config (dict): Configuration dictionary for training and evaluation.
+        tuning_path (Path): Optional path to save the trials of the hyperparameter search,
+                            when tuning is enabled.
 
     Returns:
         dict: Evaluation results.
         dict: Details of trained models.
     """
 
-    # Define preprocessor and models for Pipeline
-    preprocessor: ColumnTransformer = define_preprocessor(config)
+    # Define the preprocessor of each model and models for Pipeline
+    preprocessors: dict = define_preprocessors(config)
     models: dict = define_models(config)
 
     # Separate features and target
@@ -61,13 +84,38 @@ def train_and_evaluate(
     logger.debug("Data split into training and test sets with test size %s",
                  split_config.get("test_size", 0.2))
 
-    for name, model in models.items():
-        best_model = train_model(preprocessor, model, x_train, y_train)
-        y_pred = best_model.predict(x_test)
+    # Tune hyperparameters on the training set
+    tuning_config = config.get('tuning', {})
+    tuning_summary: dict = {}
+    if tuning_config.get('enabled', False):
+        models, trials, tuning_summary = tune.tune_models(preprocessors, models, x_train,
+                                                          y_train, tuning_config,
+                                                          config['models'])
+        if tuning_path is not None:
+            trials.to_csv(tuning_path, index=False)
+            logger.info("Tuning trials saved to %s", tuning_path)
+
+    # Train models one after another, or concurrently on shared preprocessed matrices
+    parallel_config = config.get('parallel', {})
+    if parallel_config.get('enabled', False):
+        fitted_models = train_models_parallel(preprocessors, models, x_train, y_train,
+                                              parallel_config.get('n_jobs', -1))
+    else:
+        fitted_models = {}
+        for name, model in models.items():
+            with profiling.track(f"fit.{name}", rows=len(x_train)):
+                fitted_models[name] = train_model(preprocessors[name], model, x_train,
+                                                  y_train)
+
+    for name, best_model in fitted_models.items():
+        with profiling.track(f"predict.{name}", rows=len(x_test)):
+            y_pred = best_model.predict(x_test)
         model_results = calculate_metrics(y_test, y_pred)
 
         trained_models[name] = best_model
         results[name] = model_results
+        if name in tuning_summary:
+            results[name]['tuning'] = tuning_summary[name]
         logger.info("Model %s trained and evaluated", name)
 
     # Add target variable to training and test sets
@@ -77,27 +125,103 @@ def train_and_evaluate(
     return train, test, results, trained_models
 
 
-def define_preprocessor(config: dict) -> ColumnTransformer:
+def define_preprocessor(config: dict, name: str = None) -> ColumnTransformer:
     """
-    Defines a preprocessor for the model.
+    Defines a preprocessor for the model. The numerical features are scaled and the
+    categorical features are encoded as set by the options of the preprocessor in the
+    'preprocessors' section of the configuration:
+        - "encoder": "onehot" (default), "ordinal" or "target" (scikit-learn 1.3 or later).
+        - "min_frequency", "max_categories": Optional caps of the one-hot encoder. Rarer
+                                             categories are grouped in a single column.
+        - "hash_features": Optional categorical features hashed into "n_features" columns
+                           (default 256) instead of encoded, for features with many values.
 
     Args:
         config (dict): Configuration dictionary for training and evaluation.
+        name (str): Name of the preprocessor in the 'preprocessors' section. If not given,
+                    the 'default' one, or one-hot encoding if there is none.
 
     Returns:
         sklearn ColumnTransformer: Preprocessor for the model.
     """
+    preprocessors = config.get('preprocessors', {})
+    if name is not None and name not in preprocessors:
+        raise ValueError(f"Unknown preprocessor {name}. "
+                         f"Defined preprocessors are: {', '.join(preprocessors)}.")
+    options = preprocessors.get(name or 'default', {})
+    hash_features = options.get('hash_features', [])
+    categorical_features = [feature for feature in config.get('categorical_features', [])
+                            if feature not in hash_features]
 
     # Define preprocessor
-    preprocessor = ColumnTransformer(transformers=[
+    transformers = [
         ('num', StandardScaler(), config.get('numerical_features', [])),
-        ('cat', OneHotEncoder(handle_unknown='ignore'), config.get('categorical_features', []))
-    ])
-
-    logger.debug("Preprocessor defined")
+        ('cat', define_encoder(options), categorical_features)
+    ]
+
+    # Each hashed feature is a single column of text, with each value as one token
+    transformers += [
+        (f'hash_{feature}', HashingVectorizer(n_features=options.get('n_features', 256),
+                                              token_pattern=r'.+', lowercase=False,
+                                              alternate_sign=False, norm=None), feature)
+        for feature in hash_features
+    ]
+    preprocessor = ColumnTransformer(transformers=transformers)
+
+    logger.debug("Preprocessor %s defined", name or 'default')
     return preprocessor
 
 
+def define_encoder(options: dict):
+    """
+    Defines the encoder of the categorical features from the options of a preprocessor.
+
+    Args:
+        options (dict): Options of the preprocessor, as described in define_preprocessor.
+
+    Returns:
+        sklearn transformer: Encoder of the categorical features.
+    """
+    encoder = options.get('encoder', 'onehot')
+    if encoder == 'onehot':
+        capped = options.get('min_frequency') is not None or \
+                 options.get('max_categories') is not None
+        # Unknown categories fall in the column of the infrequent ones, if any
+        return OneHotEncoder(handle_unknown='infrequent_if_exist' if capped else 'ignore',
+                             min_frequency=options.get('min_frequency'),
+                             max_categories=options.get('max_categories'))
+    if encoder == 'ordinal':
+        return OrdinalEncoder(handle_unknown='use_encoded_value', unknown_value=-1)
+    if encoder == 'target':
+        if TargetEncoder is None:
+            raise ValueError("Target encoding requires scikit-learn 1.3 or later.")
+        return TargetEncoder(random_state=options.get('random_state', 42))
+    raise ValueError(f"Unsupported encoder {encoder}. "
+                     f"Supported encoders are: {', '.join(ENCODERS)}.")
+
+
+def define_preprocessors(config: dict) -> dict:
+    """
+    Defines the preprocessor of each model, set by the optional 'preprocessor' key of the
+    model in the configuration. Models selecting the same preprocessor share it, so it is
+    only fit once when the models are trained in parallel or tuned.
+
+    Args:
+        config (dict): Configuration dictionary for training and evaluation.
+
+    Returns:
+        dict: Preprocessor of each model.
+    """
+    preprocessors: dict = {}
+    shared: dict = {}
+    for model_name, model_info in config['models'].items():
+        name = model_info.get('preprocessor')
+        if name not in shared:
+            shared[name] = define_preprocessor(config, name)
+        preprocessors[model_name] = shared[name]
+    return preprocessors
+
+
 def define_models(config: dict) -> dict:
     """
     Defines models for the pipeline.
@@ -150,6 +274,92 @@ def train_model(preprocessor: ColumnTransformer, model,
 
     return pipeline
 
+def split_core_budget(models: dict, n_jobs: int = -1) -> Tuple[int, int]:
+    """
+    Splits a budget of cores between the number of models trained at the same time and the
+    number of threads each model uses.
+
+    Args:
+        models (dict): Dictionary of model instances.
+        n_jobs (int): Total number of cores to use. -1 uses all the cores of the machine.
+
+    Returns:
+        int: Number of models trained at the same time.
+        int: Number of threads for each model.
+    """
+    n_cores = os.cpu_count() or 1
+    n_jobs = n_cores if n_jobs is None or n_jobs < 1 else min(n_jobs, n_cores)
+    n_workers = max(1, min(len(models), n_jobs))
+    return n_workers, max(1, n_jobs // n_workers)
+
+
+def fit_estimator(model, x_train, y_train):
+    """
+    Fits a model on preprocessed data. Defined at module level to run in a worker process.
+    Returns the fitted model and the seconds spent fitting it.
+    """
+    start = time.perf_counter()
+    model = model.fit(x_train, y_train)
+    return model, time.perf_counter() - start
+
+
+def train_models_parallel(preprocessor: Union[ColumnTransformer, dict], models: dict,
+                          x_train: pd.DataFrame, y_train: pd.DataFrame,
+                          n_jobs: int = -1) -> dict:
+    """
+    Trains several models concurrently. Each preprocessor is fit once and its output is
+    shared by all the models using it, which are fit in a pool of processes. Models without
+    a fixed n_jobs parameter get an equal share of the cores left by the pool.
+
+    Args:
+        preprocessor (sklearn ColumnTransformer or dict): Preprocessor for the models, or the
+                                                          preprocessor of each model.
+        models (dict): Dictionary of model instances.
+        x_train (pandas.DataFrame): Training features.
+        y_train (pandas.Series): Training target variable.
+        n_jobs (int): Total number of cores to use. -1 uses all the cores of the machine.
+
+    Returns:
+        dict: Dictionary of trained pipelines, with the same steps as train_model.
+    """
+    preprocessors = preprocessor if isinstance(preprocessor, dict) else \
+                    {name: preprocessor for name in models}
+    n_workers, n_threads = split_core_budget(models, n_jobs)
+    logger.info("Training %s models with %s processes of %s threads", len(models),
+                n_workers, n_threads)
+
+    # Fit each preprocessor once for all the models using it
+    shared: dict = {}
+    for name in models:
+        shared.setdefault(id(preprocessors[name]), []).append(name)
+    x_processed: dict = {}
+    for names in shared.values():
+        label = "fit.preprocessor" if len(shared) == 1 else f"fit.preprocessor.{names[0]}"
+        with profiling.track(label, rows=len(x_train)):
+            matrix = preprocessors[names[0]].fit_transform(x_train, y_train)
+        logger.debug("Preprocessor of %s fit once, shared matrix shape: %s", names,
+                     matrix.shape)
+        x_processed.update({name: matrix for name in names})
+
+    # Give each model its share of threads, unless set in the configuration
+    for model in models.values():
+        if 'n_jobs' in model.get_params() and model.get_params()['n_jobs'] is None:
+            model.set_params(n_jobs=n_threads)
+
+    # Forking a process that runs other threads can deadlock, so workers are started clean
+    with ProcessPoolExecutor(max_workers=n_workers,
+                             mp_context=multiprocessing.get_context("forkserver")) as executor:
+        futures = {name: executor.submit(fit_estimator, model, x_processed[name], y_train)
+                   for name, model in models.items()}
+        fitted = {}
+        for name, future in futures.items():
+            fitted[name], seconds = future.result()
+            profiling.record(f"fit.{name}", seconds, rows=len(x_train))
+
+    return {name: Pipeline(steps=[('preprocessor', preprocessors[name]), ('model', model)])
+            for name, model in fitted.items()}
+
+
 def calculate_metrics(y_test: pd.Series, y_pred: pd.Series) -> dict:
     """
     Calculates evaluation metrics.
@@ -223,13 +433,67 @@ def save_best_model(results: dict, trained_models: dict, file_path: Path) -> Non
             logger.info("Model saved to %s", file_path)
 
 
-def save_all_models(trained_models: dict, file_path: Path) -> None:
+def save_model(model: Pipeline, save_path: Path, export_config: dict = None) -> None:
+    """
+    Saves a trained model in the configured serialization format.
+
+    Args:
+        model (Pipeline): Trained model.
+        save_path (Path): Path to save the model.
+        export_config (dict): Serialization settings. Should have the following keys:
+            - "format": "pickle" (default), "joblib" for a compressed joblib file or
+                        "joblib_mmap" for an uncompressed joblib file whose arrays can be
+                        memory-mapped when loading.
+            - "compress": Compression level of the "joblib" format. Default 3.
+
+    Returns:
+        None
     """
-    Saves all trained models to individual pickle files.
+    export_config = export_config or {}
+    export_format = export_config.get("format", "pickle")
+
+    if export_format == "pickle":
+        with open(save_path, 'wb') as file:
+            pickle.dump(model, file)
+    elif export_format == "joblib":
+        joblib.dump(model, save_path, compress=export_config.get("compress", 3))
+    elif export_format == "joblib_mmap":
+        joblib.dump(model, save_path)
+    else:
+        raise ValueError(f"Unknown serialization format {export_format}. " +
+                         f"Use one of {SERIALIZATION_FORMATS}.")
+
+
+def load_model(load_path: Path, export_format: str = "pickle") -> Pipeline:
+    """
+    Loads a model saved with save_model.
+
+    Args:
+        load_path (Path): Path of the saved model.
+        export_format (str): Serialization format the model was saved with.
+
+    Returns:
+        Pipeline: The trained model.
+    """
+    if export_format == "pickle":
+        with open(load_path, 'rb') as file:
+            return pickle.load(file)
+    if export_format == "joblib":
+        return joblib.load(load_path)
+    if export_format == "joblib_mmap":
+        return joblib.load(load_path, mmap_mode="r")
+    raise ValueError(f"Unknown serialization format {export_format}. " +
+                     f"Use one of {SERIALIZATION_FORMATS}.")
+
+
+def save_all_models(trained_models: dict, file_path: Path, export_config: dict = None) -> None:
+    """
+    Saves all trained models to individual files.
 
     Args:
         trained_models (dict): Dictionary of trained model instances.
         file_path (Path): Directory path to save the models.
+        export_config (dict): Serialization settings, see save_model.
 
     Returns:
         None
@@ -243,13 +507,53 @@ def save_all_models(trained_models: dict, file_path: Path) -> None:
 
         logger.info("Saving model: %s", model_name)
 
-        # Save the model as a pickle file
-        with open(specific_file_path, 'wb') as file:
-            try:
-                pickle.dump(model, file)
-            except pickle.PicklingError:
-                logger.error("Error while saving model to %s", specific_file_path)
-            except FileNotFoundError:
-                logger.error("Error while saving model to %s", specific_file_path)
-            else:
-                logger.info("Model saved to %s", specific_file_path)
+        # Save the model in the configured format
+        try:
+            save_model(model, specific_file_path, export_config)
+        except pickle.PicklingError:
+            logger.error("Error while saving model to %s", specific_file_path)
+        except FileNotFoundError:
+            logger.error("Error while saving model to %s", specific_file_path)
+        else:
+            logger.info("Model saved to %s", specific_file_path)
+
+
+def benchmark_serialization(trained_models: dict, export_config: dict = None,
+                            n_repeats: int = 3) -> dict:
+    """
+    Measures the file size and load time of each model in every serialization format.
+
+    Args:
+        trained_models (dict): Dictionary of trained model instances.
+        export_config (dict): Serialization settings, see save_model. Its compression level
+                              is used for the "joblib" format.
+        n_repeats (int): Number of loads per format; the fastest one is reported.
+
+    Returns:
+        dict: Size in bytes and load time in seconds of each model and format.
+    """
+    export_config = export_config or {}
+    benchmark = {}
+
+    with tempfile.TemporaryDirectory() as directory:
+        for model_name, model in trained_models.items():
+            benchmark[model_name] = {}
+            for export_format in SERIALIZATION_FORMATS:
+                save_path = Path(directory) / f"{model_name}-{export_format}.pkl"
+                save_model(model, save_path, {**export_config, "format": export_format})
+
+                load_seconds = []
+                for _ in range(n_repeats):
+                    start = time.perf_counter()
+                    load_model(save_path, export_format)
+                    load_seconds.append(time.perf_counter() - start)
+
+                benchmark[model_name][export_format] = {
+                    "bytes": save_path.stat().st_size,
+                    "load_seconds": min(load_seconds)
+                }
+            logger.debug("Serialization benchmark for %s: %s", model_name,
+                         benchmark[model_name])
+
+    logger.info("Serialization benchmark completed for %s models", len(trained_models))
+    return benchmark
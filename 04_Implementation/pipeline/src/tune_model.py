@@ -0,0 +1,324 @@
+"""
+This module provides functions for tuning the hyperparameters of the models before training.
+Candidates are sampled from the search space of each model in the configuration file and
+scored with cross-validation, using random search, successive halving or Hyperband.
+"""
+# Libraries
+import json
+import logging
+import math
+import time
+from typing import List, Tuple, Union
+
+import numpy as np
+import pandas as pd
+from joblib import Parallel, delayed
+from sklearn.base import clone
+from sklearn.compose import ColumnTransformer
+from sklearn.metrics import get_scorer
+from sklearn.model_selection import KFold, ParameterSampler
+from xgboost import XGBRegressor
+
+
+# Set logger
+logger = logging.getLogger(__name__)
+
+# Methods supported to search the hyperparameters
+TUNING_METHODS = ("random", "halving", "hyperband")
+
+def tune_models(preprocessor: Union[ColumnTransformer, dict], models: dict,
+                x_train: pd.DataFrame, y_train: pd.Series, tuning_config: dict,
+                models_config: dict) -> Tuple[dict, pd.DataFrame, dict]:
+    """
+    Tunes the hyperparameters of the models that have a search space in the configuration.
+
+    The training set is split in folds and each fold is preprocessed once by each
+    preprocessor; all the trials of all the models using it reuse those folds. Models without
+    a search space are returned unchanged.
+
+    Args:
+        preprocessor (sklearn ColumnTransformer or dict): Preprocessor for the models, or the
+                                                          preprocessor of each model.
+        models (dict): Dictionary of model instances.
+        x_train (pandas.DataFrame): Training features.
+        y_train (pandas.Series): Training target variable.
+        tuning_config (dict): Configuration for tuning. Should have the following keys:
+            - "method": "random", "halving" or "hyperband". Default "halving".
+            - "n_candidates": Number of candidates sampled by random search and successive
+                              halving. Default 16.
+            - "cv": Number of folds. Default 3.
+            - "factor": Rate at which resources grow and candidates are discarded in
+                        successive halving and Hyperband. Default 3.
+            - "min_resources": Number of training rows of each fold used in the first round
+                               of successive halving and Hyperband. Default 1000.
+            - "scoring": Name of a scikit-learn scorer. Default
+                         "neg_root_mean_squared_error".
+            - "early_stopping_rounds": Rounds without improvement after which XGBoost trials
+                                       stop. 0 disables early stopping. Default 20.
+            - "validation_fraction": Share of the training rows of each fold held out for
+                                     early stopping. Default 0.1.
+            - "n_jobs": Number of trials run at the same time. Default -1 (all cores).
+            - "random_state": Seed for the folds and the sampled candidates. Default 42.
+        models_config (dict): Configuration of the models, with an optional "search_space"
+                              for each model mapping parameters to lists of values.
+
+    Returns:
+        dict: Dictionary of model instances with the best parameters found.
+        pandas.DataFrame: One row per trial with its parameters, score and fit time.
+        dict: Best parameters, best score, number of trials and time spent for each model.
+    """
+    method = tuning_config.get("method", "halving")
+    if method not in TUNING_METHODS:
+        raise ValueError(f"Unsupported tuning method {method}. "
+                         f"Supported methods are: {', '.join(TUNING_METHODS)}.")
+
+    preprocessors = preprocessor if isinstance(preprocessor, dict) else \
+                    {name: preprocessor for name in models}
+
+    # Preprocess the folds once for all the models sharing a preprocessor
+    shared_folds = {}
+    tuned_models, trials, summary = {}, [], {}
+    for name, model in models.items():
+        search_space = models_config.get(name, {}).get("search_space")
+        if not search_space:
+            tuned_models[name] = model
+            continue
+
+        key = id(preprocessors[name])
+        if key not in shared_folds:
+            shared_folds[key] = preprocess_folds(preprocessors[name], x_train, y_train,
+                                                 tuning_config.get("cv", 3),
+                                                 tuning_config.get("random_state", 42))
+        folds = shared_folds[key]
+
+        start = time.perf_counter()
+        model_trials = search(model, search_space, folds, tuning_config)
+        best_params, best_score, n_estimators = select_best(model_trials)
+
+        if n_estimators is not None:
+            best_params["n_estimators"] = n_estimators
+        tuned_models[name] = clone(model).set_params(**best_params)
+
+        for trial in model_trials:
+            trial["model"] = name
+        trials.extend(model_trials)
+        summary[name] = {"best_params": best_params, "best_score": best_score,
+                         "n_trials": len(model_trials),
+                         "seconds": time.perf_counter() - start}
+        logger.info("Model %s tuned with %s in %.1f s (%s trials): %s, score %.4f", name,
+                    method, summary[name]["seconds"], len(model_trials), best_params,
+                    best_score)
+
+    return tuned_models, trials_to_frame(trials), summary
+
+
+def preprocess_folds(preprocessor: ColumnTransformer, x_train: pd.DataFrame,
+                     y_train: pd.Series, n_splits: int, random_state: int) -> List[tuple]:
+    """
+    Splits the training set in folds and fits a copy of the preprocessor on each of them.
+
+    The training rows of each fold are shuffled, so the first rows of a fold are a random
+    sample of it.
+
+    Args:
+        preprocessor (sklearn ColumnTransformer): Preprocessor for the models.
+        x_train (pandas.DataFrame): Training features.
+        y_train (pandas.Series): Training target variable.
+        n_splits (int): Number of folds.
+        random_state (int): Seed for the split.
+
+    Returns:
+        list: Preprocessed training features, training target, validation features and
+              validation target of each fold.
+    """
+    rng = np.random.default_rng(random_state)
+    y_values = np.asarray(y_train)
+    folds = []
+    for train_index, val_index in KFold(n_splits, shuffle=True,
+                                        random_state=random_state).split(x_train):
+        train_index = rng.permutation(train_index)
+        fold_preprocessor = clone(preprocessor)
+        folds.append((fold_preprocessor.fit_transform(x_train.iloc[train_index],
+                                                      y_values[train_index]),
+                      y_values[train_index],
+                      fold_preprocessor.transform(x_train.iloc[val_index]),
+                      y_values[val_index]))
+
+    logger.debug("Training set split in %s preprocessed folds", n_splits)
+    return folds
+
+
+def search(model, search_space: dict, folds: List[tuple], tuning_config: dict) -> List[dict]:
+    """
+    Runs the configured search for one model.
+
+    Random search scores all the candidates on all the rows. Successive halving scores the
+    candidates on few rows and keeps the best 1/factor of them for each round with factor
+    times more rows. Hyperband runs several successive halving brackets, from many
+    candidates on few rows to few candidates on all the rows.
+
+    Args:
+        model (sklearn model): Model to tune.
+        search_space (dict): Lists of values for each parameter.
+        folds (list): Preprocessed folds from preprocess_folds.
+        tuning_config (dict): Configuration for tuning, as in tune_models.
+
+    Returns:
+        list: One dictionary per trial.
+    """
+    method = tuning_config.get("method", "halving")
+    n_candidates = tuning_config.get("n_candidates", 16)
+    factor = tuning_config.get("factor", 3)
+    random_state = tuning_config.get("random_state", 42)
+    max_resources = min(len(fold[1]) for fold in folds)
+    min_resources = min(tuning_config.get("min_resources", 1000), max_resources)
+
+    # Number of candidates and rows of the first round of each bracket
+    if method == "random":
+        brackets = [(n_candidates, max_resources)]
+    elif method == "halving":
+        brackets = [(n_candidates, min_resources)]
+    else:
+        s_max = int(math.log(max_resources / min_resources, factor) + 1e-9)
+        brackets = [(math.ceil((s_max + 1) / (s + 1) * factor ** s),
+                     int(max_resources / factor ** s)) for s in range(s_max, -1, -1)]
+
+    trials = []
+    with Parallel(n_jobs=tuning_config.get("n_jobs", -1)) as parallel:
+        for bracket, (n_bracket, resources) in enumerate(brackets):
+            candidates = list(ParameterSampler(search_space, n_bracket,
+                                               random_state=random_state + bracket))
+            trials.extend(successive_halving(parallel, model, candidates, folds, resources,
+                                             max_resources, factor, tuning_config, bracket))
+    return trials
+
+
+def successive_halving(parallel: Parallel, model, candidates: List[dict], folds: List[tuple],
+                       resources: int, max_resources: int, factor: int, tuning_config: dict,
+                       bracket: int = 0) -> List[dict]:
+    """
+    Scores the candidates on a growing number of rows, keeping the best 1/factor of them
+    after each round, until one candidate is left or all the rows are used.
+
+    Args:
+        parallel (joblib.Parallel): Pool running the trials.
+        model (sklearn model): Model to tune.
+        candidates (list): Parameters of each candidate.
+        folds (list): Preprocessed folds from preprocess_folds.
+        resources (int): Number of training rows of each fold in the first round.
+        max_resources (int): Number of training rows of the smallest fold.
+        factor (int): Rate at which rows grow and candidates are discarded.
+        tuning_config (dict): Configuration for tuning, as in tune_models.
+        bracket (int): Index of the bracket, recorded in the trials.
+
+    Returns:
+        list: One dictionary per trial.
+    """
+    trials = []
+    candidate_ids = list(range(len(candidates)))
+    for rung in range(len(candidates)):
+        rung_trials = parallel(
+            delayed(run_trial)(model, candidates[candidate], fold, resources, tuning_config)
+            for candidate in candidate_ids for fold in folds)
+        for index, trial in enumerate(rung_trials):
+            trial.update({"bracket": bracket, "rung": rung, "resources": resources,
+                          "candidate": candidate_ids[index // len(folds)],
+                          "fold": index % len(folds),
+                          "params": candidates[candidate_ids[index // len(folds)]]})
+        trials.extend(rung_trials)
+
+        if len(candidate_ids) == 1 or resources >= max_resources:
+            break
+
+        # Keep the candidates with the best mean score over the folds
+        scores = [np.mean([trial["score"] for trial in rung_trials
+                           if trial["candidate"] == candidate]) for candidate in candidate_ids]
+        n_keep = max(1, len(candidate_ids) // factor)
+        candidate_ids = [candidate_ids[i] for i in np.argsort(scores)[::-1][:n_keep]]
+        resources = min(resources * factor, max_resources)
+
+    return trials
+
+
+def run_trial(model, params: dict, fold: tuple, resources: int, tuning_config: dict) -> dict:
+    """
+    Fits a candidate on the first rows of a fold and scores it on the validation rows.
+
+    XGBoost models stop adding trees when the score on a share of the training rows does not
+    improve for early_stopping_rounds rounds.
+
+    Args:
+        model (sklearn model): Model to tune.
+        params (dict): Parameters of the candidate.
+        fold (tuple): Preprocessed fold from preprocess_folds.
+        resources (int): Number of training rows to use.
+        tuning_config (dict): Configuration for tuning, as in tune_models.
+
+    Returns:
+        dict: Score, fit time and, for XGBoost, best iteration of the trial.
+    """
+    x_fit, y_fit, x_val, y_val = fold
+    x_fit, y_fit = x_fit[:resources], y_fit[:resources]
+
+    estimator = clone(model).set_params(**params)
+    # Trials run in parallel, so each of them uses a single thread
+    if 'n_jobs' in estimator.get_params() and estimator.get_params()['n_jobs'] is None:
+        estimator.set_params(n_jobs=1)
+
+    fit_params = {}
+    early_stopping_rounds = tuning_config.get("early_stopping_rounds", 20)
+    if isinstance(estimator, XGBRegressor) and early_stopping_rounds:
+        n_stop = max(1, int(len(y_fit) * tuning_config.get("validation_fraction", 0.1)))
+        fit_params = {"eval_set": [(x_fit[:n_stop], y_fit[:n_stop])], "verbose": False}
+        x_fit, y_fit = x_fit[n_stop:], y_fit[n_stop:]
+        estimator.set_params(early_stopping_rounds=early_stopping_rounds)
+
+    start = time.perf_counter()
+    estimator.fit(x_fit, y_fit, **fit_params)
+    fit_seconds = time.perf_counter() - start
+
+    scorer = get_scorer(tuning_config.get("scoring", "neg_root_mean_squared_error"))
+    return {"score": float(scorer(estimator, x_val, y_val)), "fit_seconds": fit_seconds,
+            "best_iteration": estimator.best_iteration if fit_params else None}
+
+
+def select_best(trials: List[dict]) -> Tuple[dict, float, int]:
+    """
+    Selects the candidate with the best mean score among those scored on the most rows.
+
+    Args:
+        trials (list): Trials of one model.
+
+    Returns:
+        dict: Parameters of the best candidate.
+        float: Mean score of the best candidate.
+        int: Number of trees for XGBoost models tuned with early stopping, the mean best
+             iteration of the best candidate plus one. None otherwise.
+    """
+    max_resources = max(trial["resources"] for trial in trials)
+    scores = {}
+    for trial in trials:
+        if trial["resources"] == max_resources:
+            scores.setdefault((trial["bracket"], trial["candidate"]), []).append(trial)
+
+    best = max(scores.values(), key=lambda group: np.mean([t["score"] for t in group]))
+    best_iterations = [t["best_iteration"] for t in best if t["best_iteration"] is not None]
+    n_estimators = int(np.mean(best_iterations)) + 1 if best_iterations else None
+    return dict(best[0]["params"]), float(np.mean([t["score"] for t in best])), n_estimators
+
+
+def trials_to_frame(trials: List[dict]) -> pd.DataFrame:
+    """
+    Converts the trials to a data frame, with the parameters of each trial as JSON.
+
+    Args:
+        trials (list): Trials of all the models.
+
+    Returns:
+        pandas.DataFrame: One row per trial.
+    """
+    columns = ["model", "bracket", "rung", "candidate", "fold", "resources", "params",
+               "score", "fit_seconds", "best_iteration"]
+    frame = pd.DataFrame(trials, columns=columns)
+    frame["params"] = frame["params"].map(lambda params: json.dumps(params, sort_keys=True))
+    return frame
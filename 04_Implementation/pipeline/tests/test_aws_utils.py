@@ -0,0 +1,139 @@
+import pytest
+import boto3
+import pandas as pd
+import yaml
+from moto import mock_s3
+import src.aws_utils as aws
+import src.raw_data as rd
+
+BUCKET_NAME = "test-bucket"
+
+
+@pytest.fixture
+def s3_bucket(monkeypatch):
+    # Fake credentials so no request can reach a real AWS account
+    monkeypatch.setenv("AWS_ACCESS_KEY_ID", "testing")
+    monkeypatch.setenv("AWS_SECRET_ACCESS_KEY", "testing")
+    monkeypatch.setenv("AWS_DEFAULT_REGION", "us-east-1")
+
+    with mock_s3():
+        # The shared client must be created inside the mock
+        aws.get_s3_client.cache_clear()
+        s3_client = boto3.client("s3")
+        s3_client.create_bucket(Bucket=BUCKET_NAME)
+        yield s3_client
+    aws.get_s3_client.cache_clear()
+
+
+@pytest.fixture
+def raw_files():
+    return {
+        "business_raw.csv": pd.DataFrame({"airline": ["Vistara"] * 50,
+                                          "price": range(50)}).to_csv(index=False),
+        "economy_raw.csv": pd.DataFrame({"airline": ["Indigo"] * 3,
+                                         "price": [1, 2, 3]}).to_csv(index=False),
+    }
+
+
+def test_get_s3_client_is_shared(s3_bucket):
+    assert aws.get_s3_client() is aws.get_s3_client()
+
+
+def test_configure_s3_client(s3_bucket, monkeypatch):
+    monkeypatch.setattr(aws, "MAX_POOL_CONNECTIONS", aws.MAX_POOL_CONNECTIONS)
+    config = {"raw_data": {"max_workers": 16},
+              "aws_config": {"max_workers": 8, "max_concurrency": 4}}
+    assert aws.s3_pool_size(config) == 32
+    assert aws.s3_pool_size({}) == 32
+
+    aws.configure_s3_client(aws.s3_pool_size({"raw_data": {"max_workers": 48}}))
+    s3_client = aws.get_s3_client()
+    assert s3_client.meta.config.max_pool_connections == 48
+
+    # Streams, downloads and uploads all use the configured client
+    s3_bucket.put_object(Bucket=BUCKET_NAME, Key="file.csv", Body=b"a,b")
+    aws.get_stream_s3(BUCKET_NAME, "file.csv").read()
+    dict(aws.download_objects(BUCKET_NAME, ["file.csv"], max_workers=4))
+    assert aws.get_s3_client() is s3_client
+
+
+def test_download_objects(s3_bucket, raw_files):
+    for key, content in raw_files.items():
+        s3_bucket.put_object(Bucket=BUCKET_NAME, Key=key, Body=content.encode())
+
+    # Small part size to split the large file in ranged GETs
+    result = dict(aws.download_objects(BUCKET_NAME, list(raw_files), max_workers=4,
+                                       part_size=64))
+
+    assert result == {key: content.encode() for key, content in raw_files.items()}
+
+
+def test_download_objects_missing_key(s3_bucket):
+    with pytest.raises(SystemExit):
+        list(aws.download_objects(BUCKET_NAME, ["missing.csv"]))
+
+
+def test_raw_data(s3_bucket, raw_files):
+    for key, content in raw_files.items():
+        s3_bucket.put_object(Bucket=BUCKET_NAME, Key=key, Body=content.encode())
+
+    result = rd.raw_data(BUCKET_NAME, list(raw_files), max_workers=4, part_size=64)
+
+    assert len(result) == 53
+    assert list(result["class"].unique()) == ["business", "economy"]
+    assert result["price"].sum() == sum(range(50)) + 6
+
+
+@pytest.fixture
+def artifacts(tmp_path):
+    (tmp_path / "models").mkdir()
+    (tmp_path / "results.yaml").write_text("model: {R2: 0.9}\n")
+    (tmp_path / "models" / "model.pkl").write_bytes(b"0" * 200)
+    return tmp_path
+
+
+@pytest.fixture
+def upload_config():
+    return {"bucket_name": BUCKET_NAME, "prefix": "experiments", "max_workers": 2,
+            "multipart_threshold": 5 * 1024 * 1024, "multipart_chunksize": 5 * 1024 * 1024}
+
+
+def test_upload_artifacts(s3_bucket, artifacts, upload_config, tmp_path_factory):
+    report_path = tmp_path_factory.mktemp("report") / "upload_report.yaml"
+    uris = aws.upload_artifacts(artifacts, upload_config, report_path)
+
+    assert sorted(uris) == [f"s3://{BUCKET_NAME}/experiments/models/model.pkl",
+                            f"s3://{BUCKET_NAME}/experiments/results.yaml"]
+    # No placeholder objects for folders
+    keys = [obj["Key"] for obj in s3_bucket.list_objects_v2(Bucket=BUCKET_NAME)["Contents"]]
+    assert sorted(keys) == ["experiments/models/model.pkl", "experiments/results.yaml"]
+
+    report = yaml.safe_load(report_path.read_text())
+    assert report["files"]["models/model.pkl"]["status"] == "uploaded"
+    assert report["bytes"] == 200 + len("model: {R2: 0.9}\n")
+
+
+def test_upload_artifacts_skips_unchanged(s3_bucket, artifacts, upload_config,
+                                          tmp_path_factory):
+    aws.upload_artifacts(artifacts, upload_config)
+    (artifacts / "results.yaml").write_text("model: {R2: 0.8}\n")
+
+    report_path = tmp_path_factory.mktemp("report") / "upload_report.yaml"
+    aws.upload_artifacts(artifacts, upload_config, report_path)
+
+    report = yaml.safe_load(report_path.read_text())
+    assert report["files"]["models/model.pkl"]["status"] == "skipped"
+    assert report["files"]["results.yaml"]["status"] == "uploaded"
+    body = s3_bucket.get_object(Bucket=BUCKET_NAME, Key="experiments/results.yaml")["Body"]
+    assert body.read() == b"model: {R2: 0.8}\n"
+
+
+def test_upload_artifacts_files(s3_bucket, artifacts, upload_config):
+    uris = aws.upload_artifacts(artifacts, upload_config, files=[artifacts / "models"])
+    assert uris == [f"s3://{BUCKET_NAME}/experiments/models/model.pkl"]
+
+
+def test_upload_artifacts_missing_bucket(s3_bucket, artifacts, upload_config):
+    upload_config["bucket_name"] = "missing-bucket"
+    assert aws.upload_artifacts(artifacts, upload_config) == \
+        ["S3 bucket does not exist. No files uploaded."]
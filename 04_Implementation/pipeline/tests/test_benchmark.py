@@ -0,0 +1,53 @@
+import pandas as pd
+import pytest
+import yaml
+import src.clean_data as cd
+import src.generate_features as gf
+import benchmarks.benchmark as bm
+from benchmarks.synthetic import synthetic_raw_data
+
+
+@pytest.fixture
+def config():
+    with open("config/default-config.yaml", "r", encoding="utf-8") as file:
+        config = yaml.safe_load(file)
+    config["generate_features"]["filter_airlines"] = 10
+    config["train_model"]["models"]["random_forest"]["parameters"]["n_estimators"] = 5
+    config["train_model"]["models"]["xgboost"]["parameters"]["n_estimators"] = 5
+    return config
+
+
+def test_synthetic_raw_data(config):
+    raw_data = synthetic_raw_data(2000, seed=1)
+    pd.testing.assert_frame_equal(raw_data, synthetic_raw_data(2000, seed=1))
+
+    clean_data = cd.clean_data(raw_data, **config["clean_data"])
+    assert len(clean_data) == 2000
+    assert clean_data.notna().all().all()
+    assert set(clean_data["class"]) == {"business", "economy"}
+    features = gf.generate_features(clean_data, config["generate_features"])
+    assert "Trujet" not in set(features["airline"])
+
+
+def test_run_benchmarks(config):
+    results = bm.run_benchmarks(config, [800], repeats=2, n_requests=5)
+
+    timings = results["benchmarks"]["800"]
+    for name in ("clean_data", "filter_airlines", "filter_rare.flight", "save_dataset",
+                 "preprocessor", "fit.xgboost", "predict.random_forest"):
+        assert len(timings[name]["seconds"]) == (1 if name.startswith("fit") else 2)
+        assert timings[name]["rows_per_second"] > 0
+    if "api.predict.xgboost" in timings:
+        assert timings["api.predict.xgboost"]["requests"] == 5
+        assert len(timings["api.batch.linear_regression"]["seconds"]) == 2
+
+
+def test_compare():
+    baseline = {"benchmarks": {"10": {"fast": {"median": 1.0}, "slow": {"median": 1.0},
+                                      "same": {"median": 1.0}}}}
+    results = {"benchmarks": {"10": {"fast": {"median": 0.5}, "slow": {"median": 1.5},
+                                     "same": {"median": 1.1}, "new": {"median": 1.0}}}}
+
+    comparison = bm.compare(results, baseline, tolerance=0.2)
+    assert dict(zip(comparison["benchmark"], comparison["status"])) == {
+        "fast": "improvement", "slow": "regression", "same": "ok"}
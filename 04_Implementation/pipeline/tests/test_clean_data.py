@@ -1,5 +1,7 @@
 import pytest
 import numpy as np
+import pandas as pd
+import yaml
 import src.clean_data as cd
 
 # Happy path tests
@@ -120,3 +122,118 @@ def test_bucket_hours_happy_path(set_bucketDict, time, expected):
 def test_bucket_hours_unhappy_path(time):
     with pytest.raises(Exception):
         cd.bucket_hours(time, set_bucketDict)
+
+
+#------Tests for the vectorized cleaning engine------#
+
+@pytest.fixture
+def raw_sample():
+    # Sample with the raw schema of the Kaggle flight data set
+    return pd.DataFrame({
+        "date": ["11-02-2022"] * 6,
+        "airline": ["Air India", "Vistara", "Indigo", "Vistara", "SpiceJet", "Air India"],
+        "ch_code": ["AI", "UK", "6E", "UK", "SG", "AI"],
+        "num_code": [868, 836, 2046, 995, 8157, 531],
+        "dep_time": ["18:00", "06:20", "00:00", "12:08", "04:38", "21:25"],
+        "from": ["Delhi", "Chennai", "Mumbai", "Delhi", "Kolkata", "Delhi"],
+        "time_taken": ["02h 00m", "2.50h m", "10.30h m", "24h 45m", "1.05h m", "26h 30m"],
+        "stop": ["non-stop ", "1-stop\n\t\t\tVia IXU", "2+-stop", "1-stop", "non-stop", "1-stop"],
+        "arr_time": ["20:00", "08:45", "10:18", "13:53", "05:41", "23:55"],
+        "to": ["Mumbai", "Bangalore", "Delhi", "Mumbai", "Delhi", "Chennai"],
+        "price": ["25,612", "5,953", "7,425", "42,220", "3,100", "64,173"],
+        "class": ["business", "business", "economy", "business", "economy", "business"],
+    })
+
+
+@pytest.fixture
+def clean_config():
+    with open("config/default-config.yaml", "r", encoding="utf-8") as file:
+        return yaml.safe_load(file)["clean_data"]["clean_config"]
+
+
+def test_get_duration_vectorized_parity(raw_sample):
+    result = cd.get_duration_vectorized(raw_sample["time_taken"])
+    expected = raw_sample["time_taken"].apply(cd.get_duration)
+    pd.testing.assert_series_equal(result, expected)
+
+
+def test_get_duration_vectorized_unhappy_path():
+    with pytest.raises(ValueError):
+        cd.get_duration_vectorized(pd.Series(["3h 30m", "3h m"]))
+
+
+def test_get_stops_vectorized_parity(setup_stops):
+    pattern = r'non-stop|1-stop|2\+-stop'
+    texts = pd.Series(["non-stop", "1-stop", "2+-stops", "3 stops", "stop", ""])
+    result = cd.get_stops_vectorized(texts, pattern, setup_stops)
+    expected = texts.apply(lambda x: cd.get_stops(x, pattern, setup_stops))
+    pd.testing.assert_series_equal(result, expected)
+
+
+def test_bucket_hours_vectorized_parity(set_bucketDict):
+    times = pd.Series(["00:00", "06:20", "12:08", "18:43", "04:38", "12:00", "23:59"])
+    result = cd.bucket_hours_vectorized(times, set_bucketDict)
+    expected = times.apply(lambda x: cd.bucket_hours(x, set_bucketDict))
+    pd.testing.assert_series_equal(result, expected)
+
+
+def test_bucket_hours_vectorized_unhappy_path(set_bucketDict):
+    with pytest.raises(ValueError):
+        cd.bucket_hours_vectorized(pd.Series(["10:00", "25:00"]), set_bucketDict)
+
+
+def test_clean_data_engine_parity(raw_sample, clean_config):
+    # Concatenated sources keep duplicated index labels, as in raw_data
+    raw = pd.concat([raw_sample, raw_sample])
+    vectorized = cd.clean_data(raw, clean_config, engine="vectorized")
+    scalar = cd.clean_data(raw, clean_config, engine="scalar")
+    pd.testing.assert_frame_equal(vectorized, scalar)
+
+
+def test_clean_data_unknown_engine(raw_sample, clean_config):
+    with pytest.raises(ValueError):
+        cd.clean_data(raw_sample, clean_config, engine="fast")
+
+
+#------Tests for the compact schema------#
+
+@pytest.fixture
+def compact_dtypes():
+    with open("config/default-config.yaml", "r", encoding="utf-8") as file:
+        return yaml.safe_load(file)["clean_data"]["dtypes"]
+
+
+def test_clean_data_compact_dtypes(raw_sample, clean_config, compact_dtypes):
+    clean = cd.clean_data(raw_sample, clean_config, compact=True, dtypes=compact_dtypes)
+    assert isinstance(clean["airline"].dtype, pd.CategoricalDtype)
+    assert isinstance(clean["flight"].dtype, pd.CategoricalDtype)
+    assert clean["stops"].dtype == np.int8
+    assert clean["duration"].dtype == np.float32
+    assert clean["price"].dtype == np.int32
+
+
+def test_clean_data_compact_parity(raw_sample, clean_config, compact_dtypes):
+    clean = cd.clean_data(raw_sample, clean_config)
+    compact = cd.clean_data(raw_sample, clean_config, compact=True, dtypes=compact_dtypes)
+    pd.testing.assert_frame_equal(compact.astype(clean.dtypes.to_dict()), clean, atol=1e-5)
+
+
+def test_clean_data_keeps_raw_data(raw_sample, clean_config, compact_dtypes):
+    expected = raw_sample.copy()
+    cd.clean_data(raw_sample, clean_config, compact=True, dtypes=compact_dtypes)
+    pd.testing.assert_frame_equal(raw_sample, expected)
+
+
+def test_clean_data_categorical_raw_data(raw_sample, clean_config):
+    # Raw data read back from a parquet or feather artifact has categorical text columns
+    raw = raw_sample.astype({col: "category" for col in raw_sample.select_dtypes("object")})
+    clean = cd.clean_data(raw_sample, clean_config)
+    pd.testing.assert_frame_equal(cd.clean_data(raw, clean_config).astype(clean.dtypes.to_dict()),
+                                  clean)
+
+
+def test_compact_schema_ignores_missing_columns():
+    data = pd.DataFrame({"stops": [0, 1, 2]})
+    compact = cd.compact_schema(data, {"stops": "int8", "price": "int32"})
+    assert list(compact.columns) == ["stops"]
+    assert compact["stops"].dtype == np.int8
@@ -0,0 +1,99 @@
+import threading
+
+import pytest
+import yaml
+import src.dag as dag
+
+
+def make_stages(calls):
+    def stage(name, outputs):
+        def func(**inputs):
+            calls.append((name, inputs))
+            return {output: f"{name}:{output}" for output in outputs}
+        return func
+
+    return [
+        dag.Stage("raw", stage("raw", ["raw"]), [], ["raw"], ["raw.csv"],
+                  lambda previous_run: {"raw": "loaded raw"}),
+        dag.Stage("clean", stage("clean", ["clean"]), ["raw"], ["clean"], ["clean.csv"],
+                  lambda previous_run: {"clean": "loaded clean"}),
+        dag.Stage("save_raw", stage("save_raw", ["raw_file"]), ["raw"], ["raw_file"]),
+        dag.Stage("train", stage("train", ["models"]), ["clean"], ["models"]),
+        dag.Stage("upload", stage("upload", []), ["raw_file", "models"]),
+    ]
+
+
+def test_run_dag(tmp_path):
+    calls = []
+    values = dag.run_dag(make_stages(calls), tmp_path, timings_path=tmp_path / "timings.yaml")
+
+    order = [name for name, _ in calls]
+    assert order.index("raw") < order.index("clean") < order.index("train")
+    assert order[-1] == "upload"
+    assert dict(calls)["train"] == {"clean": "clean:clean"}
+    assert values["models"] == "train:models"
+
+    timings = yaml.safe_load((tmp_path / "timings.yaml").read_text())
+    assert set(timings["stages"]) == {"raw", "clean", "save_raw", "train", "upload"}
+    assert all(timing["action"] == "run" for timing in timings["stages"].values())
+
+
+def test_run_dag_concurrent_stages(tmp_path):
+    # Both stages must be running at the same time to pass the barrier
+    barrier = threading.Barrier(2, timeout=5)
+    stages = [dag.Stage("a", lambda: barrier.wait() and None),
+              dag.Stage("b", lambda: barrier.wait() and None)]
+    dag.run_dag(stages, tmp_path, max_workers=2)
+
+
+def test_select_stages():
+    stages = make_stages([])
+    assert dag.select_stages(stages, until_stage="clean") == {"raw": "run", "clean": "run"}
+    assert dag.select_stages(stages, from_stage="train") == {
+        "train": "run", "upload": "run", "clean": "load", "save_raw": "load", "raw": "link"}
+    assert dag.select_stages(stages, from_stage="clean", until_stage="train") == {
+        "clean": "run", "train": "run", "raw": "load"}
+    with pytest.raises(ValueError):
+        dag.select_stages(stages, from_stage="missing")
+
+
+def test_run_dag_from_stage(tmp_path):
+    previous_run, run_dir = tmp_path / "previous", tmp_path / "run"
+    previous_run.mkdir()
+    run_dir.mkdir()
+    (previous_run / "raw.csv").write_text("raw")
+    (previous_run / "clean.csv").write_text("clean")
+
+    calls = []
+    dag.run_dag(make_stages(calls), run_dir, from_stage="train", until_stage="train",
+                previous_run=previous_run)
+
+    assert calls == [("train", {"clean": "loaded clean"})]
+    assert (run_dir / "raw.csv").read_text() == "raw"
+    assert (run_dir / "clean.csv").read_text() == "clean"
+
+    with pytest.raises(ValueError):
+        dag.run_dag(make_stages([]), run_dir, from_stage="train")
+
+
+def test_run_dag_failure(tmp_path):
+    def fail(**inputs):
+        raise RuntimeError("stage failed")
+
+    calls = []
+    stages = make_stages(calls)
+    stages[1].func = fail
+    with pytest.raises(RuntimeError):
+        dag.run_dag(stages, tmp_path, timings_path=tmp_path / "timings.yaml")
+    assert "train" not in [name for name, _ in calls]
+    assert "clean" not in yaml.safe_load((tmp_path / "timings.yaml").read_text())["stages"]
+
+
+@pytest.mark.parametrize("stages", [
+    [dag.Stage("a", None, [], ["x"]), dag.Stage("b", None, [], ["x"])],
+    [dag.Stage("a", None, ["y"], ["x"])],
+    [dag.Stage("a", None, ["y"], ["x"]), dag.Stage("b", None, ["x"], ["y"])],
+])
+def test_get_dependencies_invalid(stages):
+    with pytest.raises(ValueError):
+        dag.get_dependencies(stages)
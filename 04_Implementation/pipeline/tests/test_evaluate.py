@@ -0,0 +1,119 @@
+# libraries for testing
+import pytest
+import pandas as pd
+import numpy as np
+from sklearn.metrics import mean_absolute_error, mean_squared_error, r2_score
+import src.evaluate as ev
+
+
+SLICES = {'airline': ['airline'], 'route': ['origin', 'destination']}
+
+
+@pytest.fixture
+def test_set():
+    rng = np.random.default_rng(423)
+    n_rows = 500
+    data = pd.DataFrame({
+        'airline': pd.Categorical(rng.choice(['Air India', 'Vistara', 'Indigo'], n_rows)),
+        'origin': rng.choice(['Delhi', 'Mumbai'], n_rows),
+        'destination': rng.choice(['Chennai', 'Kolkata'], n_rows),
+        'price': rng.normal(9, 1, n_rows),
+    })
+    y_pred = data['price'].to_numpy() + rng.normal(0, 0.3, n_rows)
+    return data, y_pred
+
+
+class PriceModel:
+    """Model predicting a fixed vector of prices, one chunk at a time"""
+    def __init__(self, y_pred):
+        self.y_pred = pd.Series(y_pred)
+    def predict(self, features):
+        return self.y_pred[features.index].to_numpy()
+
+
+def assert_metrics_close(metrics, expected):
+    assert metrics['count'] == expected['count']
+    for scale in ('log', 'rupee'):
+        assert metrics[scale] == pytest.approx(expected[scale])
+
+
+def test_metrics_match_sklearn(test_set):
+    data, y_pred = test_set
+    metrics = ev.ErrorAccumulator(SLICES).update(data, y_pred).metrics()
+
+    assert metrics['count'] == len(data)
+    for scale, y_true, pred in [('log', data['price'], y_pred),
+                                ('rupee', np.exp(data['price']), np.exp(y_pred))]:
+        assert metrics[scale]['MSE'] == pytest.approx(mean_squared_error(y_true, pred))
+        assert metrics[scale]['MAE'] == pytest.approx(mean_absolute_error(y_true, pred))
+        assert metrics[scale]['RMSE'] == pytest.approx(np.sqrt(mean_squared_error(y_true,
+                                                                                  pred)))
+        assert metrics[scale]['R2'] == pytest.approx(r2_score(y_true, pred))
+
+
+def test_chunks_and_merge_match_single_pass(test_set):
+    data, y_pred = test_set
+    single = ev.ErrorAccumulator(SLICES).update(data, y_pred)
+
+    # Uneven chunks, as read from a file
+    chunked = ev.ErrorAccumulator(SLICES)
+    for start in range(0, len(data), 77):
+        chunked.update(data.iloc[start:start + 77], y_pred[start:start + 77])
+
+    # Accumulators of two processes merged
+    merged = ev.ErrorAccumulator(SLICES).update(data.iloc[:123], y_pred[:123])
+    merged.merge(ev.ErrorAccumulator(SLICES).update(data.iloc[123:], y_pred[123:]))
+
+    expected = single.slice_metrics().set_index(['slice', 'value']).sort_index()
+    for accumulator in (chunked, merged):
+        assert_metrics_close(accumulator.metrics(), single.metrics())
+        pd.testing.assert_frame_equal(
+            accumulator.slice_metrics().set_index(['slice', 'value']).sort_index(), expected)
+
+
+def test_slice_metrics(test_set):
+    data, y_pred = test_set
+    slices = ev.ErrorAccumulator(SLICES).update(data, y_pred).slice_metrics()
+
+    assert list(slices.columns[:3]) == ['slice', 'value', 'count']
+    assert slices.groupby('slice')['count'].sum().to_dict() == {'airline': 500, 'route': 500}
+    assert set(slices.loc[slices['slice'] == 'route', 'value']) == {
+        'Delhi / Chennai', 'Delhi / Kolkata', 'Mumbai / Chennai', 'Mumbai / Kolkata'}
+
+    vistara = slices.set_index(['slice', 'value']).loc[('airline', 'Vistara')]
+    rows = (data['airline'] == 'Vistara').to_numpy()
+    assert vistara['count'] == rows.sum()
+    assert vistara['log_R2'] == pytest.approx(r2_score(data['price'][rows], y_pred[rows]))
+    assert vistara['rupee_MAE'] == pytest.approx(
+        mean_absolute_error(np.exp(data['price'][rows]), np.exp(y_pred[rows])))
+
+
+def test_constant_slice_has_no_r2():
+    data = pd.DataFrame({'airline': ['Vistara'], 'price': [9.0]})
+    slices = ev.ErrorAccumulator({'airline': ['airline']}).update(data, [9.5]).slice_metrics()
+    assert slices['log_MAE'].iloc[0] == pytest.approx(0.5)
+    assert np.isnan(slices['log_R2'].iloc[0])
+
+
+def test_rupee_target():
+    data = pd.DataFrame({'price': [1000.0, 2000.0]})
+    metrics = ev.ErrorAccumulator(log_target=False).update(data, [1100.0, 1900.0]).metrics()
+    assert set(metrics) == {'count', 'rupee'}
+    assert metrics['rupee']['MAE'] == pytest.approx(100)
+
+
+def test_evaluate_models(tmp_path, test_set):
+    data, y_pred = test_set
+    config = {'chunk_size': 120, 'slices': {**SLICES, 'stops': ['stops']}}
+    results, slices = ev.evaluate_models({'model': PriceModel(y_pred)}, data, config)
+
+    assert_metrics_close(results['model'],
+                         ev.ErrorAccumulator(SLICES).update(data, y_pred).metrics())
+    # The stops slice is skipped, as the test set has no stops column
+    assert set(slices['slice']) == {'airline', 'route'}
+    assert set(slices['model']) == {'model'}
+
+    ev.save_evaluation(results, slices, tmp_path / 'evaluation.yaml',
+                       tmp_path / 'evaluation_slices.csv')
+    assert (tmp_path / 'evaluation.yaml').exists()
+    assert len(pd.read_csv(tmp_path / 'evaluation_slices.csv')) == len(slices)
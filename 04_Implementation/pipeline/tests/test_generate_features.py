@@ -72,3 +72,40 @@ def test_filter_airlines_no_airlines():
     # Unhappy test
     with pytest.raises(KeyError):
         gf.filter_airlines(data_no_airline, 3)
+
+
+#------Tests for rare key filters------#
+
+@pytest.fixture
+def flights_df():
+    return pd.DataFrame({
+        'airline': ['A', 'A', 'A', 'B', 'B', 'A', None],
+        'flight': ['A-1', 'A-1', 'A-2', 'B-1', 'B-1', 'A-1', 'C-1'],
+        'origin': ['X', 'X', 'Y', 'X', 'X', 'Y', 'X'],
+        'price': [1, 2, 3, 4, 5, 6, 7],
+    })
+
+@pytest.mark.parametrize("keys", [['airline'], ['flight'], ['airline', 'origin']])
+@pytest.mark.parametrize("min_count", [0, 1, 2, 3])
+def test_rare_mask_groupby_parity(flights_df, keys, min_count):
+    expected = flights_df.groupby(keys).filter(lambda x: len(x) > min_count)
+    pd.testing.assert_frame_equal(flights_df[gf.rare_mask(flights_df, keys, min_count)],
+                                  expected)
+
+def test_rare_mask_categorical(flights_df):
+    data = flights_df.astype({'airline': 'category', 'flight': 'category'})
+    expected = flights_df.groupby('flight').filter(lambda x: len(x) > 1)
+    result = data[gf.rare_mask(data, ['flight'], 1)].astype({'airline': object, 'flight': object})
+    pd.testing.assert_frame_equal(result, expected)
+
+def test_rare_mask_counts(flights_df):
+    # Counts of the whole data set, e.g. in streaming mode, take precedence over the rows
+    counts = gf.count_keys(pd.concat([flights_df, flights_df]), ['airline', 'origin'])
+    result = flights_df[gf.rare_mask(flights_df, ['airline', 'origin'], 2, counts)]
+    assert list(result['price']) == [1, 2, 3, 4, 5, 6]
+    assert not gf.rare_mask(flights_df, ['airline', 'origin'], 2).any()
+
+def test_generate_features_filter_rare(flights_df):
+    config = {'filter_airlines': 1, 'filter_rare': [{'keys': ['flight'], 'min_count': 2}]}
+    result = gf.generate_features(flights_df, config)
+    assert list(result['price']) == [1, 2, 6]
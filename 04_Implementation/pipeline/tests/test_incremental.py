@@ -0,0 +1,203 @@
+from unittest.mock import patch
+
+import pytest
+import boto3
+import numpy as np
+import pandas as pd
+import yaml
+from moto import mock_s3
+from sklearn.linear_model import LinearRegression
+import src.aws_utils as aws
+import src.raw_data as rd
+import src.clean_data as cd
+import src.generate_features as gf
+import src.incremental as inc
+
+BUCKET_NAME = "test-bucket"
+
+
+def make_raw_file(n_rows, seed):
+    # Raw csv file with the schema of the Kaggle flight data set
+    rng = np.random.default_rng(seed)
+    return pd.DataFrame({
+        "date": "11-02-2022",
+        "airline": rng.choice(["Air India", "Vistara"], n_rows),
+        "ch_code": "AI",
+        "num_code": rng.integers(100, 110, n_rows),
+        "dep_time": [f"{h:02d}:{m:02d}" for h, m in zip(rng.integers(0, 24, n_rows),
+                                                       rng.integers(0, 60, n_rows))],
+        "from": rng.choice(["Delhi", "Mumbai"], n_rows),
+        "time_taken": [f"{h:02d}h {m:02d}m" for h, m in zip(rng.integers(1, 30, n_rows),
+                                                           rng.integers(0, 60, n_rows))],
+        "stop": rng.choice(["non-stop ", "1-stop\n\t\tVia IXU", "2+-stop"], n_rows),
+        "arr_time": "10:10",
+        "to": rng.choice(["Chennai", "Kolkata"], n_rows),
+        "price": [f"{p:,}" for p in rng.integers(2000, 90000, n_rows)],
+    }).to_csv(index=False)
+
+
+@pytest.fixture
+def config(tmp_path):
+    with open("config/default-config.yaml", "r", encoding="utf-8") as file:
+        config = yaml.safe_load(file)
+    config["generate_features"]["filter_airlines"] = 10
+    config["train_model"]["parallel"]["enabled"] = False
+    config["train_model"]["models"]["random_forest"]["parameters"]["n_estimators"] = 10
+    config["train_model"]["models"]["xgboost"]["parameters"]["n_estimators"] = 10
+    config["incremental"].update(cache_dir=str(tmp_path / "cache"), xgboost_rounds=5,
+                                 random_forest_trees=3)
+    return config
+
+
+@pytest.fixture
+def s3_bucket(monkeypatch):
+    # Fake credentials so no request can reach a real AWS account
+    monkeypatch.setenv("AWS_ACCESS_KEY_ID", "testing")
+    monkeypatch.setenv("AWS_SECRET_ACCESS_KEY", "testing")
+    monkeypatch.setenv("AWS_DEFAULT_REGION", "us-east-1")
+
+    with mock_s3():
+        # The shared client must be created inside the mock
+        aws.get_s3_client.cache_clear()
+        s3_client = boto3.client("s3")
+        s3_client.create_bucket(Bucket=BUCKET_NAME)
+        s3_client.put_object(Bucket=BUCKET_NAME, Key="business_raw.csv",
+                             Body=make_raw_file(120, 1).encode())
+        s3_client.put_object(Bucket=BUCKET_NAME, Key="economy_raw.csv",
+                             Body=make_raw_file(150, 2).encode())
+        yield s3_client
+    aws.get_s3_client.cache_clear()
+
+
+def run_incremental(config, file_keys):
+    raw_config = {**config["raw_data"], "file_keys": file_keys}
+    with patch("src.raw_data.read_raw_files", wraps=rd.read_raw_files) as read_raw_files:
+        raw_data, clean_data, sources, fingerprints = inc.load_datasets(
+            BUCKET_NAME, raw_config, config["clean_data"],
+            inc.Path(config["incremental"]["cache_dir"]))
+    downloaded = read_raw_files.call_args[0][1] if read_raw_files.called else []
+    features = gf.generate_features(clean_data, config["generate_features"])
+    outputs = inc.train_incremental(features, sources, config["train_model"],
+                                    config["incremental"], fingerprints, None,
+                                    inc.data_fingerprint(config["clean_data"],
+                                                         config["generate_features"]))
+    return raw_data, clean_data, downloaded, outputs
+
+
+def test_load_datasets_reuses_cache(s3_bucket, config):
+    file_keys = config["raw_data"]["file_keys"]
+    raw_config = {**config["raw_data"], "file_keys": file_keys}
+    cache_dir = inc.Path(config["incremental"]["cache_dir"])
+
+    raw_data, clean_data, sources, _ = inc.load_datasets(BUCKET_NAME, raw_config,
+                                                         config["clean_data"], cache_dir)
+    with patch("src.raw_data.read_raw_files") as read_raw_files:
+        cached_raw, cached_clean, _, _ = inc.load_datasets(BUCKET_NAME, raw_config,
+                                                           config["clean_data"], cache_dir)
+    read_raw_files.assert_not_called()
+
+    # Same output as the batch path
+    expected_raw = rd.raw_data(BUCKET_NAME, file_keys)
+    expected_clean = cd.clean_data(expected_raw, **config["clean_data"])
+    for raw in (raw_data, cached_raw):
+        pd.testing.assert_frame_equal(raw, expected_raw)
+    for clean in (clean_data, cached_clean):
+        pd.testing.assert_frame_equal(clean, expected_clean.reset_index(drop=True))
+    assert sources.value_counts().to_dict() == {"economy_raw.csv": 150,
+                                                "business_raw.csv": 120}
+
+
+def test_load_datasets_recleans_on_config_change(s3_bucket, config):
+    file_keys = config["raw_data"]["file_keys"]
+    raw_config = {**config["raw_data"], "file_keys": file_keys}
+    cache_dir = inc.Path(config["incremental"]["cache_dir"])
+    inc.load_datasets(BUCKET_NAME, raw_config, config["clean_data"], cache_dir)
+
+    # Same raw files, different clean_data settings
+    clean_config = config["clean_data"]["clean_config"]
+    clean_config["selected_features"].remove("book_date")
+    with patch("src.raw_data.read_raw_files") as read_raw_files, \
+         patch("src.clean_data.clean_data", wraps=cd.clean_data) as clean_data:
+        raw_data, clean, _, _ = inc.load_datasets(BUCKET_NAME, raw_config,
+                                                  config["clean_data"], cache_dir)
+    read_raw_files.assert_not_called()
+    assert clean_data.call_count == len(file_keys)
+    assert "book_date" not in clean
+    expected_clean = cd.clean_data(rd.raw_data(BUCKET_NAME, file_keys), **config["clean_data"])
+    pd.testing.assert_frame_equal(clean, expected_clean.reset_index(drop=True))
+    # Only the clean data of the current settings is kept
+    assert len(list(cache_dir.glob("files/*/clean_data*.parquet"))) == len(file_keys)
+
+
+def test_train_incremental(s3_bucket, config):
+    # First run trains from scratch
+    _, _, downloaded, (train, test, _, models) = run_incremental(config, ["business_raw.csv"])
+    assert downloaded == ["business_raw.csv"]
+    forest_trees = len(models["random_forest"].named_steps["model"].estimators_)
+    boosting_rounds = models["xgboost"].named_steps["model"].get_booster().num_boosted_rounds()
+
+    # A new file only downloads that file and continues training
+    _, _, downloaded, (new_train, new_test, results, models) = run_incremental(
+        config, ["business_raw.csv", "economy_raw.csv"])
+    assert downloaded == ["economy_raw.csv"]
+    assert len(new_train) + len(new_test) == 270
+    pd.testing.assert_frame_equal(new_train.iloc[:len(train)], train)
+    assert len(models["random_forest"].named_steps["model"].estimators_) == forest_trees + 3
+    assert models["xgboost"].named_steps["model"].get_booster().num_boosted_rounds() \
+        == boosting_rounds + 5
+    assert set(results) == {"linear_regression", "random_forest", "xgboost"}
+
+    # A changed file retrains from scratch
+    s3_bucket.put_object(Bucket=BUCKET_NAME, Key="business_raw.csv",
+                         Body=make_raw_file(120, 3).encode())
+    _, _, downloaded, (_, _, _, models) = run_incremental(
+        config, ["business_raw.csv", "economy_raw.csv"])
+    assert downloaded == ["business_raw.csv"]
+    assert len(models["random_forest"].named_steps["model"].estimators_) == forest_trees
+
+
+def test_train_incremental_retrains_on_feature_change(s3_bucket, config):
+    file_keys = ["business_raw.csv"]
+    _, _, _, (_, _, _, models) = run_incremental(config, file_keys)
+    forest_trees = len(models["random_forest"].named_steps["model"].estimators_)
+
+    # Same files, but the features are built differently
+    config["generate_features"]["filter_airlines"] = 20
+    _, _, _, (_, _, _, models) = run_incremental(config, file_keys + ["economy_raw.csv"])
+    assert len(models["random_forest"].named_steps["model"].estimators_) == forest_trees
+
+
+def test_linear_regression_normal_equations_one_hot():
+    # One-hot columns and the intercept are collinear: only the fitted values are unique
+    rng = np.random.default_rng(423)
+    categories = rng.integers(0, 3, 100)
+    x_train = np.column_stack([np.eye(3)[categories], rng.random(100)])
+    y_train = x_train @ [1., 2., 3., 4.] + rng.normal(0, .1, 100)
+
+    model = inc.Pipeline(steps=[('preprocessor', 'passthrough'),
+                                ('model', LinearRegression())])
+    statistics = inc.normal_equations(x_train[:60], y_train[:60])
+    inc.solve_normal_equations(model.named_steps['model'], statistics)
+    with patch("src.incremental.preprocess", return_value=(x_train[60:], y_train[60:])):
+        inc.continue_training(model, None, statistics, {})
+
+    expected = LinearRegression().fit(x_train, y_train)
+    np.testing.assert_allclose(model.named_steps['model'].predict(x_train),
+                               expected.predict(x_train))
+
+
+def test_linear_regression_normal_equations():
+    rng = np.random.default_rng(423)
+    x_train = rng.random((100, 4))
+    y_train = x_train @ [1., 2., 3., 4.] + 5 + rng.normal(0, .1, 100)
+
+    model = inc.Pipeline(steps=[('preprocessor', 'passthrough'),
+                                ('model', LinearRegression())])
+    statistics = inc.normal_equations(x_train[:60], y_train[:60])
+    inc.solve_normal_equations(model.named_steps['model'], statistics)
+    with patch("src.incremental.preprocess", return_value=(x_train[60:], y_train[60:])):
+        inc.continue_training(model, None, statistics, {})
+
+    expected = LinearRegression().fit(x_train, y_train)
+    np.testing.assert_allclose(model.named_steps['model'].coef_, expected.coef_)
+    np.testing.assert_allclose(model.named_steps['model'].intercept_, expected.intercept_)
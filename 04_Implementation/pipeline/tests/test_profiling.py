@@ -0,0 +1,53 @@
+import json
+
+import pandas as pd
+import pytest
+import src.dag as dag
+import src.profiling as profiling
+
+
+def test_track_without_profiler():
+    with profiling.track("stage", rows=10) as record:
+        pass
+    profiling.record("fit.model", 1.0)
+    assert record == {}
+
+
+def test_profiler_records(tmp_path):
+    with profiling.Profiler(tracemalloc=True, sample_interval=0.01) as profiler:
+        with profiling.track("stage", rows=1000):
+            data = list(range(100_000))
+        profiling.record("fit.model", 2.0, rows=500)
+    profiler.save(tmp_path / "profile.json")
+    del data
+
+    profile = json.loads((tmp_path / "profile.json").read_text())
+    stage = profile["records"]["stage"]
+    assert stage["rows"] == 1000
+    assert stage["rows_per_second"] == pytest.approx(1000 / stage["seconds"])
+    assert stage["peak_rss_bytes"] >= stage["rss_start_bytes"] > 0
+    assert stage["traced_delta_bytes"] > 0
+    assert stage["traced_peak_bytes"] >= stage["traced_delta_bytes"]
+    assert profile["records"]["fit.model"] == {"seconds": 2.0, "rows": 500,
+                                               "rows_per_second": 250.0}
+    assert profile["seconds"] >= stage["seconds"]
+
+
+def test_profiler_cprofile_dag(tmp_path):
+    stages = [
+        dag.Stage("load", lambda: {"data": pd.DataFrame({"a": range(50)})}, [], ["data"]),
+        dag.Stage("double", lambda data: {"doubled": data * 2}, ["data"], ["doubled"]),
+    ]
+    with profiling.Profiler(profiler="cprofile", output_dir=tmp_path / "profiles") as profiler:
+        dag.run_dag(stages, tmp_path)
+
+    assert set(profiler.records) == {"load", "double"}
+    assert profiler.records["double"]["rows"] == 50
+    assert profiler.records["load"]["rows"] == 50
+    for name in ("load", "double"):
+        assert (tmp_path / "profiles" / f"{name}.prof").exists()
+
+
+def test_profiler_unsupported():
+    with pytest.raises(ValueError):
+        profiling.Profiler(profiler="perf")
@@ -0,0 +1,47 @@
+from pathlib import Path
+
+import pytest
+import pandas as pd
+import src.raw_data as rd
+
+
+@pytest.fixture
+def sample_df():
+    return pd.DataFrame({
+        'airline': ['Vistara', 'Indigo', 'Vistara', 'Air India', 'Indigo'],
+        'duration': [2.5, 10.3, 3.5, 1.75, 2.0],
+        'stops': [0, 1, 2, 1, 0],
+        'price': [5953, 7425, 42220, 3100, 64173]
+    })
+
+
+@pytest.mark.parametrize("artifact_format", ["csv", "parquet", "feather"])
+def test_save_load_dataset(tmp_path, sample_df, artifact_format):
+    save_path = tmp_path / f"data.{artifact_format}"
+    rd.save_dataset(sample_df, save_path)
+    result = rd.load_dataset(save_path)
+
+    if artifact_format != "csv":
+        assert isinstance(result['airline'].dtype, pd.CategoricalDtype)
+    pd.testing.assert_frame_equal(result, sample_df, check_categorical=False, check_dtype=False)
+
+
+@pytest.mark.parametrize("artifact_format", ["csv", "parquet", "feather"])
+def test_save_dataset_append(tmp_path, sample_df, artifact_format):
+    save_path = tmp_path / f"data.{artifact_format}"
+    rd.save_dataset(sample_df.iloc[:3], save_path, append=True)
+    rd.save_dataset(sample_df.iloc[3:], save_path, append=True)
+
+    # Whole data set
+    result = rd.load_dataset(save_path)
+    result = result.astype({col: object for col in result.select_dtypes("category")})
+    pd.testing.assert_frame_equal(result, sample_df)
+
+    # One chunk per part (csv chunks follow chunk_size)
+    chunks = list(rd.iter_dataset(save_path, chunk_size=3))
+    assert [len(chunk) for chunk in chunks] == [3, 2]
+
+
+def test_save_dataset_unsupported_format(tmp_path, sample_df):
+    with pytest.raises(ValueError):
+        rd.save_dataset(sample_df, tmp_path / "data.xlsx")
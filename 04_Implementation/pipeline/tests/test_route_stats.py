@@ -0,0 +1,116 @@
+import json
+
+import numpy as np
+import pandas as pd
+import pytest
+import src.route_stats as rs
+
+
+@pytest.fixture
+def clean_data():
+    return pd.DataFrame({
+        "airline": ["Vistara", "Vistara", "Vistara", "Indigo", "Vistara"],
+        "flight": ["UK-1", "UK-2", "UK-1", "6E-5", "UK-3"],
+        "origin": ["Delhi", "Delhi", "Delhi", "Delhi", "Mumbai"],
+        "destination": ["Mumbai", "Mumbai", "Mumbai", "Mumbai", "Delhi"],
+        "departure_time": ["morning", "morning", "morning", "morning", "night"],
+        "arrival_time": ["evening", "night", "night", "evening", "late_night"],
+        "duration": [2.0, 3.0, 4.0, 5.0, 6.0],
+    })
+
+
+def test_route_stats(clean_data):
+    stats = rs.route_stats(clean_data, [0.5])
+
+    assert stats["rows"] == 5
+    assert stats["flights"] == {"Vistara": ["UK-1", "UK-2", "UK-3"], "Indigo": ["6E-5"]}
+    assert stats["mean_duration"] == 4.0
+    assert stats["durations"][0] == {"airline": "Vistara", "origin": "Delhi",
+                                     "destination": "Mumbai", "count": 3, "duration": 3.0,
+                                     "quantiles": {"0.5": 3.0}}
+    assert stats["arrivals"][0] == {"airline": "Vistara", "origin": "Delhi",
+                                    "destination": "Mumbai", "departure_time": "morning",
+                                    "arrival_time": "night", "count": 3,
+                                    "distribution": {"evening": pytest.approx(1 / 3),
+                                                     "night": pytest.approx(2 / 3)}}
+
+    # Across airlines, the tie goes to the arrival time seen first
+    city_arrival = stats["city_arrivals"][0]
+    assert city_arrival["arrival_time"] == "evening"
+    assert city_arrival["distribution"] == {"evening": 0.5, "night": 0.5}
+    assert len(stats["city_arrivals"]) == 2
+
+
+def test_save_route_stats(clean_data, tmp_path):
+    stats = rs.route_stats(clean_data)
+    rs.save_route_stats(stats, tmp_path / "route_stats.json")
+    assert json.loads((tmp_path / "route_stats.json").read_text()) == stats
+
+
+def random_clean_data(n_rows, seed=423):
+    rng = np.random.default_rng(seed)
+    airline = rng.choice(["Vistara", "Indigo", "SpiceJet"], n_rows)
+    return pd.DataFrame({
+        "airline": airline,
+        "flight": [f"{name[:2].upper()}-{number}" for name, number
+                   in zip(airline, rng.integers(1, 30, n_rows))],
+        "origin": rng.choice(["Delhi", "Mumbai", "Chennai"], n_rows),
+        "destination": rng.choice(["Kolkata", "Hyderabad"], n_rows),
+        "departure_time": rng.choice(["morning", "evening", "night"], n_rows),
+        "arrival_time": rng.choice(["morning", "evening", "night", "late_night"], n_rows),
+        "duration": rng.integers(100, 3000, n_rows) / 100,
+    })
+
+
+def assert_stats_close(stats, expected):
+    assert stats["rows"] == expected["rows"]
+    assert stats["flights"] == expected["flights"]
+    assert stats["mean_duration"] == pytest.approx(expected["mean_duration"])
+    assert stats["arrivals"] == expected["arrivals"]
+    assert stats["city_arrivals"] == expected["city_arrivals"]
+    assert len(stats["durations"]) == len(expected["durations"])
+    for record, expected_record in zip(stats["durations"], expected["durations"]):
+        assert record == {**expected_record,
+                          "duration": pytest.approx(expected_record["duration"]),
+                          "quantiles": pytest.approx(expected_record["quantiles"])}
+
+
+def test_route_stats_matches_pandas():
+    clean_data = random_clean_data(2000)
+    stats = rs.route_stats(clean_data)
+
+    grouped = clean_data.groupby(rs.ROUTE, sort=False)["duration"]
+    expected = grouped.quantile([0.1, 0.25, 0.5, 0.75, 0.9]).unstack()
+    assert [tuple(record[column] for column in rs.ROUTE)
+            for record in stats["durations"]] == list(grouped.size().index)
+    for record in stats["durations"]:
+        assert list(record["quantiles"].values()) == pytest.approx(
+            list(expected.loc[tuple(record[column] for column in rs.ROUTE)]))
+    assert stats["mean_duration"] == pytest.approx(clean_data["duration"].mean())
+
+
+def test_chunks_and_merge_match_single_pass():
+    clean_data = random_clean_data(3000)
+    expected = rs.route_stats(clean_data)
+
+    # Chunks read from a file, some with categorical columns as in parquet files
+    chunked = rs.RouteStatsAccumulator()
+    for number, start in enumerate(range(0, len(clean_data), 700)):
+        chunk = clean_data.iloc[start:start + 700]
+        if number % 2:
+            chunk = chunk.astype({"airline": "category", "origin": "category"})
+        chunked.update(chunk)
+    assert_stats_close(chunked.stats(), expected)
+
+    merged = rs.RouteStatsAccumulator().update(clean_data.iloc[:1234])
+    merged.merge(rs.RouteStatsAccumulator().update(clean_data.iloc[1234:]))
+    assert_stats_close(merged.stats(), expected)
+    json.dumps(merged.stats())
+
+
+def test_weighted_quantiles():
+    values = pd.Series([1.0, 2.0, 2.0, 2.0, 5.0, 7.0, 7.0])
+    distinct = values.value_counts().sort_index()
+    quantiles = [0, 0.1, 0.33, 0.5, 0.9, 1]
+    assert rs.weighted_quantiles(distinct.index.to_numpy(), distinct.to_numpy(), quantiles) \
+        == pytest.approx(values.quantile(quantiles).to_numpy())
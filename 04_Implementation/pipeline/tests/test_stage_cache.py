@@ -0,0 +1,43 @@
+import pandas as pd
+import src.raw_data as rd
+import src.stage_cache as sc
+
+
+def test_stage_key():
+    key = sc.stage_key("clean_data", {"a": 1, "b": [1, 2]}, ["raw-key"])
+    assert key == sc.stage_key("clean_data", {"b": [1, 2], "a": 1}, ["raw-key"])
+    assert key != sc.stage_key("clean_data", {"a": 2, "b": [1, 2]}, ["raw-key"])
+    assert key != sc.stage_key("clean_data", {"a": 1, "b": [1, 2]}, ["other-raw-key"])
+    assert key != sc.stage_key("generate_features", {"a": 1, "b": [1, 2]}, ["raw-key"])
+
+
+def test_code_fingerprint():
+    assert sc.code_fingerprint(rd) == sc.code_fingerprint(rd)
+    assert sc.code_fingerprint(rd) != sc.code_fingerprint(sc)
+
+
+def test_store_and_restore_stage(tmp_path):
+    cache_dir = tmp_path / "cache"
+    first_run, second_run = tmp_path / "run1", tmp_path / "run2"
+    first_run.mkdir()
+    second_run.mkdir()
+
+    data = pd.DataFrame({"airline": ["Vistara", "Indigo"], "price": [1, 2]})
+    rd.save_dataset(data, first_run / "features.csv")
+    rd.save_dataset(data, first_run / "features.parquet", append=True)
+
+    assert not sc.restore_stage(cache_dir, "generate_features", "key", second_run)
+    sc.store_stage(cache_dir, "generate_features", "key",
+                   [first_run / "features.csv", first_run / "features.parquet"])
+    assert sc.restore_stage(cache_dir, "generate_features", "key", second_run)
+
+    pd.testing.assert_frame_equal(rd.load_dataset(second_run / "features.csv"), data)
+    restored = rd.load_dataset(second_run / "features.parquet")
+    pd.testing.assert_frame_equal(restored.astype({"airline": object}), data)
+    assert not sc.restore_stage(cache_dir, "generate_features", "other-key", second_run)
+
+
+def test_stage_cache_disabled(tmp_path):
+    (tmp_path / "results.yaml").write_text("a: 1")
+    sc.store_stage(None, "train_model", "key", [tmp_path / "results.yaml"])
+    assert not sc.restore_stage(None, "train_model", "key", tmp_path)
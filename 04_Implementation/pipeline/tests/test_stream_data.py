@@ -0,0 +1,99 @@
+import io
+from unittest.mock import patch
+
+import pytest
+import numpy as np
+import pandas as pd
+import yaml
+import src.raw_data as rd
+import src.clean_data as cd
+import src.generate_features as gf
+import src.stream_data as sd
+
+
+@pytest.fixture
+def config():
+    with open("config/default-config.yaml", "r", encoding="utf-8") as file:
+        config = yaml.safe_load(file)
+    config["raw_data"]["chunk_size"] = 7
+    config["generate_features"]["filter_airlines"] = 10
+    return config
+
+
+@pytest.fixture
+def raw_files():
+    # Raw csv files with the schema of the Kaggle flight data set
+    rng = np.random.default_rng(423)
+    files = {}
+    for file_key, n_rows in [("business_raw.csv", 20), ("economy_raw.csv", 33)]:
+        files[file_key] = pd.DataFrame({
+            "date": "11-02-2022",
+            "airline": rng.choice(["Air India", "Vistara", "Indigo"], n_rows, p=[.5, .4, .1]),
+            "ch_code": "AI",
+            "num_code": rng.integers(100, 999, n_rows),
+            "dep_time": [f"{h:02d}:{m:02d}" for h, m in zip(rng.integers(0, 24, n_rows),
+                                                           rng.integers(0, 60, n_rows))],
+            "from": rng.choice(["Delhi", "Mumbai"], n_rows),
+            "time_taken": [f"{h:02d}h {m:02d}m" for h, m in zip(rng.integers(1, 30, n_rows),
+                                                               rng.integers(0, 60, n_rows))],
+            "stop": rng.choice(["non-stop ", "1-stop\n\t\tVia IXU", "2+-stop"], n_rows),
+            "arr_time": "10:10",
+            "to": rng.choice(["Chennai", "Kolkata"], n_rows),
+            "price": [f"{p:,}" for p in rng.integers(2000, 90000, n_rows)],
+        }).to_csv(index=False)
+    return files
+
+
+def test_read_raw_chunks(raw_files):
+    with patch("src.aws_utils.get_stream_s3",
+               side_effect=lambda bucket, key: io.StringIO(raw_files[key])):
+        chunks = list(rd.read_raw_chunks("bucket", list(raw_files), 7))
+
+    assert [len(chunk) for chunk in chunks] == [7, 7, 6, 7, 7, 7, 7, 5]
+    assert set(chunks[0]["class"]) == {"business"}
+    assert set(chunks[-1]["class"]) == {"economy"}
+
+
+@pytest.mark.parametrize("artifact_format", ["csv", "parquet", "feather"])
+def test_stream_datasets_parity(tmp_path, config, raw_files, artifact_format):
+    # Batch path
+    with patch("src.aws_utils.download_objects",
+               side_effect=lambda bucket, keys, *args: ((key, raw_files[key].encode())
+                                                        for key in keys)):
+        raw_data = rd.raw_data("bucket", config["raw_data"]["file_keys"])
+    clean_data = cd.clean_data(raw_data, **config["clean_data"])
+    features = gf.generate_features(clean_data, config["generate_features"])
+
+    # Streaming path
+    with patch("src.aws_utils.get_stream_s3",
+               side_effect=lambda bucket, key: io.StringIO(raw_files[key])):
+        features_path = sd.stream_datasets("bucket", config["raw_data"], config["clean_data"],
+                                           config["generate_features"], tmp_path,
+                                           artifact_format)
+
+    streamed = rd.load_dataset(features_path)
+    streamed = streamed.astype({col: object for col in streamed.select_dtypes("category")})
+    pd.testing.assert_frame_equal(streamed, features.reset_index(drop=True))
+    assert len(rd.load_dataset(tmp_path / f"raw_data.{artifact_format}")) == len(raw_data)
+    assert "Indigo" not in streamed["airline"].values
+
+
+def test_stream_datasets_filter_rare(tmp_path, config, raw_files):
+    # Routes are counted over the whole data set, not over each chunk
+    config["generate_features"]["filter_rare"] = [{"keys": ["origin", "destination"],
+                                                   "min_count": 12}]
+    with patch("src.aws_utils.download_objects",
+               side_effect=lambda bucket, keys, *args: ((key, raw_files[key].encode())
+                                                        for key in keys)):
+        raw_data = rd.raw_data("bucket", config["raw_data"]["file_keys"])
+    features = gf.generate_features(cd.clean_data(raw_data, **config["clean_data"]),
+                                    config["generate_features"])
+
+    with patch("src.aws_utils.get_stream_s3",
+               side_effect=lambda bucket, key: io.StringIO(raw_files[key])):
+        features_path = sd.stream_datasets("bucket", config["raw_data"], config["clean_data"],
+                                           config["generate_features"], tmp_path)
+
+    streamed = rd.load_dataset(features_path)
+    pd.testing.assert_frame_equal(streamed, features.reset_index(drop=True))
+    assert 0 < len(streamed) < len(raw_data)
@@ -0,0 +1,111 @@
+# libraries for testing
+import pytest
+import pandas as pd
+import numpy as np
+from sklearn.linear_model import SGDRegressor
+from sklearn.pipeline import Pipeline
+from xgboost import XGBRegressor
+import src.raw_data as rd
+import src.stream_train as st
+
+
+@pytest.fixture
+def features_path(tmp_path):
+    # Features data set written in parts, as by stream_datasets
+    rng = np.random.default_rng(423)
+    n_rows = 1200
+    features = pd.DataFrame({
+        'duration': rng.uniform(1, 30, n_rows),
+        'airline': rng.choice(['Air India', 'Vistara', 'Indigo', 'SpiceJet'], n_rows,
+                              p=[.5, .3, .19, .01]),
+        'class': rng.choice(['business', 'economy'], n_rows),
+    })
+    features['price'] = np.log(3000 + 2000 * features['duration'] +
+                               40000 * (features['class'] == 'business'))
+    path = tmp_path / 'features.parquet'
+    for start in range(0, n_rows, 500):
+        rd.save_dataset(features.iloc[start:start + 500], path, append=True)
+    return path
+
+
+@pytest.fixture
+def config():
+    return {
+        'numerical_features': ['duration'],
+        'categorical_features': ['airline', 'class'],
+        'models': {
+            'linear_regression': {'class': 'LinearRegression', 'parameters': {}},
+            'random_forest': {'class': 'RandomForestRegressor',
+                              'parameters': {'n_estimators': 5, 'random_state': 42}},
+            'xgboost': {'class': 'XGBRegressor',
+                        'parameters': {'n_estimators': 20, 'max_depth': 3}},
+        },
+        'streaming': {'chunk_size': 300, 'holdout_size': 200, 'sample_size': 400,
+                      'epochs': 3, 'random_state': 423},
+    }
+
+
+def test_reservoir_size_and_order():
+    reservoir = st.Reservoir(10, seed=1)
+    for start in range(0, 95, 7):
+        reservoir.add(pd.DataFrame({'value': np.arange(start, min(start + 7, 95))}))
+    sample = reservoir.sample()
+
+    assert reservoir.seen == 95
+    assert len(sample) == 10
+    assert sample.index.is_monotonic_increasing
+    # Rows are indexed by their position in the stream
+    assert (sample['value'] == sample.index).all()
+
+
+def test_reservoir_short_stream():
+    reservoir = st.Reservoir(10, seed=1)
+    reservoir.add(pd.DataFrame({'value': range(4)}))
+    assert list(reservoir.sample()['value']) == [0, 1, 2, 3]
+    assert st.Reservoir(10).sample().empty
+
+
+def test_reservoir_uniform():
+    # Each of 50 rows must be sampled with probability 5 / 50
+    counts = np.zeros(50)
+    for seed in range(2000):
+        reservoir = st.Reservoir(5, seed=seed)
+        for start in range(0, 50, 8):
+            reservoir.add(pd.DataFrame({'value': np.arange(start, min(start + 8, 50))}))
+        counts[reservoir.sample().index] += 1
+    assert np.allclose(counts / 2000, 0.1, atol=0.025)
+
+
+def test_scan_features(features_path):
+    holdout, sample, categories = st.scan_features(features_path, 300, 200, 400,
+                                                   ['airline', 'class'], random_state=1)
+    assert len(holdout) == 200
+    assert 0 < len(sample) <= 400
+    assert not holdout.index.isin(sample.index).any()
+    assert categories == {'airline': ['Air India', 'Indigo', 'SpiceJet', 'Vistara'],
+                          'class': ['business', 'economy']}
+
+
+def test_iter_training_chunks(features_path):
+    holdout_positions = np.array([0, 5, 499, 500, 1199])
+    chunks = list(st.iter_training_chunks(features_path, 300, holdout_positions))
+    assert sum(len(chunk) for chunk in chunks) == 1200 - len(holdout_positions)
+
+
+def test_train_streaming(features_path, config):
+    train, holdout, results, models = st.train_streaming(features_path, config)
+
+    assert train is None
+    assert len(holdout) == 200
+    assert set(results) == set(config['models'])
+    assert isinstance(models['linear_regression'].named_steps['model'], SGDRegressor)
+    assert isinstance(models['xgboost'].named_steps['model'], XGBRegressor)
+    # The results record the estimator actually fitted for each configured model
+    assert results['linear_regression']['estimator'] == 'SGDRegressor'
+    assert results['linear_regression']['training'] == 'chunks'
+    assert results['random_forest']['training'] == 'sample'
+    for name, model in models.items():
+        assert isinstance(model, Pipeline)
+        # The price only depends on the class and duration, so every model must learn it
+        assert results[name]['R2'] > 0.6, name
+        assert len(model.predict(holdout.drop('price', axis=1))) == len(holdout)
@@ -5,6 +5,9 @@ import numpy as np
 from sklearn.pipeline import Pipeline
 from sklearn.base import BaseEstimator
 from unittest.mock import patch, MagicMock
+from sklearn.linear_model import LinearRegression
+from sklearn.preprocessing import OrdinalEncoder
+from xgboost import XGBRegressor
 import src.train_model as tm
 
 # Sample test data and configuration
@@ -54,3 +57,169 @@ def test_calculate_metrics():
     assert 'MAE' in metrics
     assert 'RMSE' in metrics
     assert 'R2' in metrics
+
+
+@pytest.fixture
+def trained_models():
+    models = {'linear_regression': LinearRegression(),
+              'xgboost': XGBRegressor(n_estimators=5, max_depth=2)}
+    preprocessor = tm.define_preprocessor(config)
+    return {name: tm.train_model(preprocessor, model, X, X['price'])
+            for name, model in models.items()}
+
+
+@pytest.mark.parametrize("export_format", tm.SERIALIZATION_FORMATS)
+def test_save_load_model(tmp_path, trained_models, export_format):
+    tm.save_all_models(trained_models, tmp_path, {'format': export_format})
+
+    for name, model in trained_models.items():
+        loaded = tm.load_model(tmp_path / f"{name}.pkl", export_format)
+        np.testing.assert_allclose(loaded.predict(X), model.predict(X))
+    assert sorted(path.name for path in tmp_path.iterdir()) == \
+        ['linear_regression.pkl', 'xgboost.pkl']
+
+
+def test_joblib_compression(tmp_path, trained_models):
+    model = trained_models['xgboost']
+    tm.save_model(model, tmp_path / "compressed.pkl", {'format': 'joblib'})
+    tm.save_model(model, tmp_path / "plain.pkl", {'format': 'joblib', 'compress': 0})
+    tm.save_model(model, tmp_path / "mmap.pkl", {'format': 'joblib_mmap'})
+
+    # Compressed by default, memory-mappable only without compression
+    assert (tmp_path / "plain.pkl").read_bytes() == (tmp_path / "mmap.pkl").read_bytes()
+    assert (tmp_path / "compressed.pkl").stat().st_size < (tmp_path / "plain.pkl").stat().st_size
+
+
+def test_save_model_unknown_format(tmp_path, trained_models):
+    with pytest.raises(ValueError):
+        tm.save_model(trained_models['linear_regression'], tmp_path / "model.pkl",
+                      {'format': 'onnx'})
+
+
+def test_benchmark_serialization(trained_models):
+    benchmark = tm.benchmark_serialization(trained_models, n_repeats=1)
+    assert set(benchmark) == set(trained_models)
+    for results in benchmark.values():
+        assert set(results) == set(tm.SERIALIZATION_FORMATS)
+        assert all(result['bytes'] > 0 and result['load_seconds'] >= 0
+                   for result in results.values())
+
+
+def test_split_core_budget():
+    models = {'a': None, 'b': None, 'c': None}
+    with patch('os.cpu_count', return_value=8):
+        assert tm.split_core_budget(models, -1) == (3, 2)
+        assert tm.split_core_budget(models, 2) == (2, 1)
+        assert tm.split_core_budget(models, 64) == (3, 2)
+
+
+def test_train_and_evaluate_parallel_parity():
+    rng = np.random.default_rng(423)
+    features = pd.DataFrame({
+        'feature1': rng.random(200),
+        'feature2': rng.choice(['cat', 'dog', 'fish'], 200),
+    })
+    features['price'] = 3 * features['feature1'] + (features['feature2'] == 'dog') + 1
+    parity_config = {**config, 'models': {
+        'linear_regression': {'class': 'LinearRegression', 'parameters': {}},
+        'random_forest': {'class': 'RandomForestRegressor',
+                          'parameters': {'n_estimators': 10, 'random_state': 423}},
+        'xgboost': {'class': 'XGBRegressor',
+                    'parameters': {'n_estimators': 10, 'random_state': 423}},
+    }}
+
+    *_, sequential_results, _ = tm.train_and_evaluate(features, parity_config)
+    *_, parallel_results, models = tm.train_and_evaluate(
+        features, {**parity_config, 'parallel': {'enabled': True, 'n_jobs': 2}})
+
+    assert parallel_results == sequential_results
+    assert all(isinstance(model, Pipeline) for model in models.values())
+
+
+#------Tests for the preprocessor options------#
+
+encoding_config = {**config, 'categorical_features': ['feature2', 'feature3'],
+                   'preprocessors': {
+                       'capped': {'encoder': 'onehot', 'min_frequency': 5},
+                       'hashed': {'hash_features': ['feature3'], 'n_features': 16},
+                       'ordinal': {'encoder': 'ordinal'},
+                   }}
+
+@pytest.fixture
+def encoding_data():
+    rng = np.random.default_rng(423)
+    return pd.DataFrame({
+        'feature1': rng.random(200),
+        'feature2': rng.choice(['cat', 'dog', 'fish'], 200),
+        'feature3': [f'code-{code}' for code in rng.integers(0, 100, 200)],
+    })
+
+
+def test_define_preprocessor_capped(encoding_data):
+    matrix = tm.define_preprocessor(encoding_config, 'capped').fit_transform(encoding_data)
+    n_frequent = (encoding_data['feature3'].value_counts() >= 5).sum()
+    # Scaled number, three animals, the frequent codes and the infrequent codes
+    assert matrix.shape == (200, 1 + 3 + n_frequent + 1)
+
+    # Unknown categories are encoded as infrequent instead of failing
+    preprocessor = tm.define_preprocessor(encoding_config, 'capped').fit(encoding_data)
+    unknown = encoding_data.iloc[:1].assign(feature3='code-unknown')
+    names = list(preprocessor.get_feature_names_out())
+    assert preprocessor.transform(unknown)[0, names.index('cat__feature3_infrequent_sklearn')] == 1
+
+
+def test_define_preprocessor_hashed(encoding_data):
+    preprocessor = tm.define_preprocessor(encoding_config, 'hashed')
+    matrix = preprocessor.fit_transform(encoding_data)
+    assert matrix.shape == (200, 1 + 3 + 16)
+    # Each value is hashed as a single token
+    assert (matrix[:, 4:].sum(axis=1) == 1).all()
+    assert [name for name, *_ in preprocessor.transformers] == ['num', 'cat', 'hash_feature3']
+
+
+def test_define_preprocessor_ordinal(encoding_data):
+    preprocessor = tm.define_preprocessor(encoding_config, 'ordinal').fit(encoding_data)
+    assert preprocessor.transform(encoding_data).shape == (200, 3)
+    unknown = encoding_data.iloc[:1].assign(feature2='bird')
+    assert preprocessor.transform(unknown)[0, 1] == -1
+
+
+def test_define_preprocessor_errors():
+    with pytest.raises(ValueError):
+        tm.define_preprocessor(encoding_config, 'missing')
+    with pytest.raises(ValueError):
+        tm.define_preprocessor({**config, 'preprocessors': {'default': {'encoder': 'binary'}}})
+
+
+def test_define_preprocessors_shared():
+    models_config = {**encoding_config, 'models': {
+        'a': {'class': 'LinearRegression', 'preprocessor': 'capped', 'parameters': {}},
+        'b': {'class': 'LinearRegression', 'parameters': {}},
+        'c': {'class': 'LinearRegression', 'preprocessor': 'capped', 'parameters': {}},
+    }}
+    preprocessors = tm.define_preprocessors(models_config)
+    assert preprocessors['a'] is preprocessors['c']
+    assert preprocessors['a'] is not preprocessors['b']
+
+
+def test_train_and_evaluate_per_model_preprocessors(encoding_data):
+    features = encoding_data.assign(price=3 * encoding_data['feature1'] + 1)
+    models_config = {**encoding_config, 'models': {
+        'linear_regression': {'class': 'LinearRegression', 'preprocessor': 'capped',
+                              'parameters': {}},
+        'random_forest': {'class': 'RandomForestRegressor', 'preprocessor': 'ordinal',
+                          'parameters': {'n_estimators': 10, 'random_state': 423}},
+        'xgboost': {'class': 'XGBRegressor',
+                    'parameters': {'n_estimators': 10, 'random_state': 423}},
+    }}
+
+    *_, sequential_results, models = tm.train_and_evaluate(features, models_config)
+    *_, parallel_results, _ = tm.train_and_evaluate(
+        features, {**models_config, 'parallel': {'enabled': True, 'n_jobs': 2}})
+
+    assert parallel_results == sequential_results
+    preprocessors = {name: model.named_steps['preprocessor'] for name, model in models.items()}
+    assert isinstance(preprocessors['random_forest'].named_transformers_['cat'],
+                      OrdinalEncoder)
+    assert len(preprocessors['linear_regression'].get_feature_names_out()) < \
+           len(preprocessors['xgboost'].get_feature_names_out())
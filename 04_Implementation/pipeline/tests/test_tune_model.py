@@ -0,0 +1,111 @@
+from unittest.mock import patch
+
+import pytest
+import numpy as np
+import pandas as pd
+from sklearn.ensemble import RandomForestRegressor
+from sklearn.linear_model import LinearRegression
+from xgboost import XGBRegressor
+import src.train_model as tm
+import src.tune_model as tune
+
+config = {
+    'numerical_features': ['feature1'],
+    'categorical_features': ['feature2'],
+}
+
+tuning_config = {
+    'method': 'halving', 'n_candidates': 4, 'cv': 2, 'factor': 2, 'min_resources': 40,
+    'early_stopping_rounds': 5, 'n_jobs': 1, 'random_state': 423,
+}
+
+models_config = {
+    'linear_regression': {},
+    'random_forest': {'search_space': {'n_estimators': [5, 10], 'max_depth': [2, 4, None]}},
+    'xgboost': {'search_space': {'n_estimators': [200], 'max_depth': [2, 3],
+                                'learning_rate': [0.1, 0.3]}},
+}
+
+
+@pytest.fixture
+def training_data():
+    rng = np.random.default_rng(423)
+    x_train = pd.DataFrame({
+        'feature1': rng.random(200),
+        'feature2': rng.choice(['cat', 'dog', 'fish'], 200),
+    })
+    y_train = 3 * x_train['feature1'] + (x_train['feature2'] == 'dog') + rng.normal(0, .1, 200)
+    return x_train, y_train
+
+
+@pytest.fixture
+def models():
+    return {'linear_regression': LinearRegression(),
+            'random_forest': RandomForestRegressor(random_state=423),
+            'xgboost': XGBRegressor(random_state=423)}
+
+
+def test_preprocess_folds(training_data):
+    x_train, y_train = training_data
+    folds = tune.preprocess_folds(tm.define_preprocessor(config), x_train, y_train, 2, 423)
+    assert len(folds) == 2
+    for x_fit, y_fit, x_val, y_val in folds:
+        assert x_fit.shape == (100, 4) and x_val.shape == (100, 4)
+        assert len(y_fit) == 100 and len(y_val) == 100
+
+
+@pytest.mark.parametrize("method", ["random", "halving", "hyperband"])
+def test_tune_models(training_data, models, method):
+    x_train, y_train = training_data
+    tuned, trials, summary = tune.tune_models(tm.define_preprocessor(config), models, x_train,
+                                              y_train, {**tuning_config, 'method': method},
+                                              models_config)
+
+    # Models without a search space are not tuned
+    assert tuned['linear_regression'] is models['linear_regression']
+    assert set(summary) == {'random_forest', 'xgboost'}
+    assert set(trials['model']) == {'random_forest', 'xgboost'}
+    assert (trials['fit_seconds'] > 0).all()
+    for name, model_summary in summary.items():
+        assert model_summary['n_trials'] == (trials['model'] == name).sum()
+        for param, value in model_summary['best_params'].items():
+            assert tuned[name].get_params()[param] == value
+
+    # XGBoost stops early and is refit with the number of trees found
+    assert trials.loc[trials['model'] == 'xgboost', 'best_iteration'].notna().all()
+    assert tuned['xgboost'].get_params()['n_estimators'] < 200
+    assert tuned['xgboost'].get_params()['early_stopping_rounds'] is None
+
+
+def test_successive_halving_discards_candidates(training_data, models):
+    x_train, y_train = training_data
+    _, trials, _ = tune.tune_models(tm.define_preprocessor(config), models, x_train, y_train,
+                                    tuning_config, models_config)
+    forest = trials[trials['model'] == 'random_forest']
+    per_rung = forest.groupby('rung').agg(candidates=('candidate', 'nunique'),
+                                          resources=('resources', 'first'))
+    assert per_rung['candidates'].tolist() == [4, 2, 1]
+    assert per_rung['resources'].tolist() == [40, 80, 100]
+
+
+def test_tune_models_unknown_method(training_data, models):
+    x_train, y_train = training_data
+    with pytest.raises(ValueError):
+        tune.tune_models(tm.define_preprocessor(config), models, x_train, y_train,
+                         {'method': 'grid'}, models_config)
+
+
+def test_tune_models_per_model_preprocessors(training_data, models):
+    x_train, y_train = training_data
+    preprocessors = tm.define_preprocessors({
+        **config, 'preprocessors': {'ordinal': {'encoder': 'ordinal'}},
+        'models': {'linear_regression': {}, 'random_forest': {'preprocessor': 'ordinal'},
+                   'xgboost': {}}})
+    with patch.object(tune, 'preprocess_folds', wraps=tune.preprocess_folds) as folds:
+        _, _, summary = tune.tune_models(preprocessors, models, x_train, y_train,
+                                         {**tuning_config, 'method': 'random'}, models_config)
+
+    # One set of folds per preprocessor of the tuned models
+    assert set(summary) == {'random_forest', 'xgboost'}
+    assert [call.args[0] for call in folds.call_args_list] == [
+        preprocessors['random_forest'], preprocessors['xgboost']]